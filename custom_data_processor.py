@@ -7,8 +7,11 @@
     - 使用 `unstructured` 库，支持多种文件格式 (PDF, DOCX, MD, TXT 等)。
     - 能够解析复杂文档，如 PDF 和 Markdown，并提取其中的特殊结构。
     - 表格解析：将文档中的表格提取并转换为 Markdown 或 HTML 格式的文本。
+    - 分页窗口解析：超大 PDF 按页窗口分段（可并行）解析，控制峰值内存，单个窗口失败不影响其余部分。
     - 图片解析 (OCR)：(可选，需额外配置) 能够提取嵌入图片中的文字内容。
     - 生成的每个文档元素都包含丰富的元数据，如文件来源、页码、元素类型等。
+    - 解析缓存：按 (文件内容哈希, unstructured 版本, 解析参数) 缓存解析结果，未修改的文件无需重新解析。
+    - 目录批量处理：支持目录和 glob 模式，多进程并行解析与切块，单个文件超时或崩溃不影响其他文件。
 
 2.  Chunk File (文件切块):
     - 对加载和解析后的文本内容进行切块。
@@ -22,9 +25,29 @@
 
 3.  Save to JSON (保存为JSON):
     - 将处理和切块后的文本块保存为统一格式的 JSON 文件。
+    - 流式模式：解析、切块、保存串联为生成器，以 JSON Lines (可选 gzip/zstd 压缩) 增量写入，
+      并提供流式读取接口供后续向量化使用，内存占用不随文档和语料规模增长。
     - 每个 JSON 对象包含文本内容 (`page_content`) 和元数据 (`metadata`)，
       为后续的 Embedding 和向量存储做好准备。
 
+4.  Embed with Store (基于向量存储的向量化):
+    - 通过后端的内容寻址向量存储 (hash(模型+文本) → 向量) 为文本块生成向量。
+    - 与术语入库脚本、在线服务共用同一存储，同一模型已向量化过的文本不会重复计算。
+
+5.  Deduplicate Chunks (文本块去重):
+    - 向量化之前按归一化文本哈希去除精确重复，再用 MinHash + LSH 去除近似重复（阈值可配置），
+      适用于年报、研报中反复出现的页眉页脚、免责声明等样板文本。
+    - 保留最先出现的文本块，被合并块的来源（文件、页码、相似度）记录在保留块的元数据中，并输出去除的块数和字节数。
+
+6.  Index into Milvus (写入向量库):
+    - 切块结果通过 `EmbeddingFactory` 按批向量化后直接写入可配置的 Milvus 集合，从原始文件一次完成到可检索索引。
+    - 复用后端的入库流水线：阶段之间有界队列衔接（背压），失败批次指数退避重试，输出各阶段吞吐量。
+
+7.  Incremental Re-chunking (增量切块):
+    - 每个解析元素带有稳定的内容哈希 (`element_hash`)，每个文档保存一份切块清单（元素哈希 → chunk_id）。
+    - 文档更新后按元素哈希序列做差异比较，只对新增或修改的元素重新切块，输出新增文本块和待删除 chunk_id 的变更集，
+      可直接应用到 Milvus，未变化的内容无需重新向量化。
+
 使用前置依赖:
 - `langchain`: `pip install langchain`
 - `unstructured`: `pip install "unstructured[all-docs]"` (安装所有文档格式的支持)
@@ -42,9 +65,30 @@
 """
 
 import os
+import sys
+import glob
+import gzip
 import json
+import zlib
+import hashlib
+import time
 import logging
-from typing import List, Dict, Any, Optional, Literal
+import argparse
+import functools
+import tempfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from multiprocessing.connection import wait
+from typing import List, Dict, Any, Optional, Literal, Iterable, Iterator, Tuple, Callable
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，追加写入不加锁
+    fcntl = None
 
 # LangChain 相关导入
 from langchain.docstore.document import Document
@@ -57,110 +101,435 @@ from langchain.text_splitter import (
 # Unstructured 相关导入
 from unstructured.partition.auto import partition
 from unstructured.documents.elements import Element
+from unstructured.__version__ import __version__ as UNSTRUCTURED_VERSION
 
 # 日志配置
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 后端工具模块（向量存储等）所在目录
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag-finance-nlp-box", "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
 
 # --- 1. Load & Parse File ---
 
-def load_and_parse_file(file_path: str, **unstructured_kwargs) -> List[Document]:
+class ParseCache:
     """
-    加载并解析单个文件，将其转换为 LangChain Document 对象列表。
-    这个过程利用 unstructured 库，同时完成了加载和智能解析（例如，提取表格和图片内容）。
+    unstructured 解析结果的持久化缓存。
+    缓存键为 (文件内容哈希, unstructured 版本, 解析参数)，文件内容、库版本或参数任一变化都会重新解析；
+    缓存值为 gzip 压缩的 JSON Lines，每行一个元素的 page_content 和 metadata。
+    另外按 (文件大小, 修改时间) 记录文件哈希，未改动的文件无需重新计算哈希；
+    哈希记录以追加方式写入 file_hashes.jsonl（每行一条，后写的覆盖先写的），
+    多个解析 worker 进程并发写入时互不覆盖，每次新增哈希的开销也与已记录的文件数无关。
+    """
+
+    def __init__(self, cache_dir: str):
+        """
+        Args:
+            cache_dir (str): 缓存目录。
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._hash_index_path = os.path.join(cache_dir, "file_hashes.jsonl")
+        self._hash_index: Dict[str, List[Any]] = self._load_hash_index()
+
+    def _load_hash_index(self) -> Dict[str, List[Any]]:
+        """读取文件哈希记录，{绝对路径: [大小, 修改时间, 哈希]}"""
+        index: Dict[str, List[Any]] = {}
+        if not os.path.exists(self._hash_index_path):
+            return index
+        try:
+            with open(self._hash_index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        abs_path, size, mtime_ns, file_hash = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue  # 中断时写了一半的行，对应文件下次重新计算哈希即可
+                    index[abs_path] = [size, mtime_ns, file_hash]
+        except OSError as e:
+            logging.warning(f"读取文件哈希记录失败: {self._hash_index_path} ({e})")
+        return index
+
+    def _append_hash(self, abs_path: str, entry: List[Any]):
+        """追加一条文件哈希记录；文件锁保证多进程写入的行不会交错"""
+        line = (json.dumps([abs_path, *entry], ensure_ascii=False) + "\n").encode('utf-8')
+        with open(self._hash_index_path, 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes):
+        """先写临时文件再替换，避免并发进程读到写了一半的缓存"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def file_hash(self, file_path: str) -> str:
+        """计算文件内容的 SHA-256；大小和修改时间未变时直接复用上次的结果"""
+        abs_path = os.path.abspath(file_path)
+        stat = os.stat(abs_path)
+        cached = self._hash_index.get(abs_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(abs_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        file_hash = digest.hexdigest()
+        self._hash_index[abs_path] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        self._append_hash(abs_path, self._hash_index[abs_path])
+        return file_hash
+
+    def key(self, file_path: str, unstructured_kwargs: Dict[str, Any]) -> str:
+        """计算缓存键"""
+        payload = json.dumps(
+            {"file": self.file_hash(file_path), "unstructured": UNSTRUCTURED_VERSION, "kwargs": unstructured_kwargs},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.jsonl.gz")
+
+    def has(self, key: str) -> bool:
+        """缓存中是否存在该键"""
+        return os.path.exists(self._entry_path(key))
+
+    def iter_load(self, key: str) -> Iterator[Document]:
+        """逐行读取缓存的解析结果"""
+        with gzip.open(self._entry_path(key), 'rt', encoding='utf-8') as f:
+            for line in f:
+                item = json.loads(line)
+                yield Document(page_content=item["page_content"], metadata=item["metadata"])
+
+    def load(self, key: str) -> Optional[List[Document]]:
+        """读取缓存的解析结果，未命中时返回 None"""
+        if not self.has(key):
+            return None
+        try:
+            return list(self.iter_load(key))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"解析缓存 '{self._entry_path(key)}' 损坏，将重新解析: {e}")
+            return None
+
+    def open_writer(self, key: str) -> "_ParseCacheWriter":
+        """打开一个流式写入器，调用 close(commit=True) 后缓存才会生效"""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return _ParseCacheWriter(path)
+
+    def store(self, key: str, documents: List[Document]):
+        """保存解析结果"""
+        writer = self.open_writer(key)
+        try:
+            for doc in documents:
+                writer.write(doc)
+        except BaseException:
+            writer.close(commit=False)
+            raise
+        writer.close(commit=True)
+
+
+class _ParseCacheWriter:
+    """解析缓存的流式写入器：先写临时文件，提交时再原子替换为正式缓存文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._file = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+
+    def write(self, doc: Document):
+        self._file.write(
+            json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False, default=str) + "\n"
+        )
+
+    def close(self, commit: bool):
+        self._file.close()
+        if commit:
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _element_to_document(element: Element, file_path: str) -> Document:
+    """将 unstructured 元素转换为 Document"""
+    # 表格元素，元数据中会包含 HTML 表示
+    if "unstructured.documents.elements.Table" in str(type(element)):
+        metadata = element.metadata.to_dict()
+        # unstructured 在某些情况下会将表格内容直接放入 text 字段
+        # 如果 text 字段为空，则使用 HTML 表示
+        page_content = element.text
+        if not page_content.strip() and metadata.get('text_as_html'):
+             page_content = metadata['text_as_html']
+        
+        # 清理元数据，避免冗余
+        metadata.pop('text_as_html', None)
+    else:
+        page_content = element.text
+        metadata = element.metadata.to_dict()
+
+    # 清理元数据中的空值
+    metadata = {k: v for k, v in metadata.items() if v is not None}
+    
+    # 确保来源信息正确
+    metadata['source'] = metadata.get('filename', os.path.basename(file_path))
+    # 元素内容的稳定哈希，用于文档更新后的增量切块
+    metadata['element_hash'] = compute_element_hash(page_content)
+
+    return Document(page_content=page_content, metadata=metadata)
+
+
+def compute_element_hash(text: str) -> str:
+    """元素文本的稳定哈希（忽略空白差异），与页码、坐标等位置信息无关，元素移动位置后哈希不变"""
+    return hashlib.sha1(" ".join(text.split()).encode('utf-8')).hexdigest()
+
+
+def _count_pdf_pages(file_path: str) -> Optional[int]:
+    """读取 PDF 页数，pypdf 不可用或读取失败时返回 None"""
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        logging.warning("分页窗口解析需要 pypdf (`pip install pypdf`)，将整体解析文件。")
+        return None
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception as e:
+        logging.warning(f"读取 PDF 页数失败，将整体解析文件 '{file_path}': {e}")
+        return None
+
+
+def _parse_pdf_window(file_path: str, start_page: int, end_page: int, unstructured_kwargs: Dict[str, Any]) -> List[Document]:
+    """
+    解析 PDF 的一个页窗口 [start_page, end_page)（从 0 开始计数）：
+    将这些页抽取为临时 PDF 后交给 unstructured 解析，并把页码、文件名等元数据还原为原文件的值。
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for page_index in range(start_page, end_page):
+        writer.add_page(reader.pages[page_index])
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer.write(f)
+        elements = partition(filename=tmp_path, **unstructured_kwargs)
+    finally:
+        os.remove(tmp_path)
+
+    documents = []
+    for element in elements:
+        doc = _element_to_document(element, file_path)
+        doc.metadata['page_number'] = start_page + doc.metadata.get('page_number', 1)
+        doc.metadata['filename'] = os.path.basename(file_path)
+        doc.metadata['file_directory'] = os.path.dirname(os.path.abspath(file_path))
+        doc.metadata['source'] = doc.metadata['filename']
+        documents.append(doc)
+    return documents
+
+
+def iter_parse_pdf_windows(
+    file_path: str,
+    pages_per_window: int,
+    max_workers: int = 1,
+    failed_windows: Optional[List[Dict[str, Any]]] = None,
+    **unstructured_kwargs,
+) -> Iterator[Document]:
+    """
+    按页窗口解析大型 PDF，按页序逐窗口产出 Document。
+
+    每个窗口单独解析，峰值内存只与窗口大小和并行数有关；某个窗口解析失败只会丢失该窗口，
+    失败信息记录到 `failed_windows` 中，其余窗口继续处理。
 
     Args:
-        file_path (str): 要处理的文件路径。
+        file_path (str): PDF 文件路径。
+        pages_per_window (int): 每个窗口包含的页数。
+        max_workers (int): 并行解析窗口的进程数；在守护进程（如目录并行处理的 worker）中自动退化为串行。
+        failed_windows (Optional[List[Dict[str, Any]]]): 用于收集失败窗口的列表。
         **unstructured_kwargs: 传递给 `unstructured.partition` 函数的额外参数。
-            例如:
-            - strategy (str): 解析策略 ('auto', 'hi_res', 'fast')。'hi_res' 对PDF效果好。
-            - ocr_languages (str): OCR 语言，如 'chi_sim+eng' 用于中英文。
-            - extract_images_in_pdf (bool): 是否提取 PDF 中的图片 (需要OCR支持来转为文字)。
-            - infer_table_structure (bool): 是否推断表格结构并转为HTML。
 
-    Returns:
-        List[Document]: 从文件中解析出的元素列表，每个元素是一个 Document 对象。
+    Yields:
+        Document: 按页序排列的文档元素，page_number 为原文件中的页码。
+    """
+    num_pages = _count_pdf_pages(file_path)
+    if not num_pages:
+        return
+    windows = [(start, min(start + pages_per_window, num_pages)) for start in range(0, num_pages, pages_per_window)]
+    logging.info(f"按页窗口解析 '{file_path}'：共 {num_pages} 页，{len(windows)} 个窗口，每窗口 {pages_per_window} 页。")
+
+    def record_failure(start: int, end: int, error: Exception):
+        logging.error(f"解析 '{file_path}' 第 {start + 1}-{end} 页时出错: {error}")
+        if failed_windows is not None:
+            failed_windows.append({"start_page": start + 1, "end_page": end, "error": repr(error)})
+
+    if max_workers > 1 and multiprocessing.current_process().daemon:
+        logging.info("当前进程为守护进程，不能再创建子进程，页窗口改为串行解析。")
+        max_workers = 1
+
+    if max_workers <= 1:
+        for start, end in windows:
+            try:
+                documents = _parse_pdf_window(file_path, start, end, unstructured_kwargs)
+            except Exception as e:
+                record_failure(start, end, e)
+                continue
+            yield from documents
+        return
+
+    # 并行解析：最多 max_workers 个窗口在途，按窗口顺序组装结果
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        window_iter = iter(windows)
+        for start, end in window_iter:
+            pending.append((start, end, executor.submit(_parse_pdf_window, file_path, start, end, unstructured_kwargs)))
+            if len(pending) >= max_workers:
+                break
+        while pending:
+            start, end, future = pending.popleft()
+            try:
+                documents = future.result()
+            except Exception as e:
+                record_failure(start, end, e)
+                documents = []
+            next_window = next(window_iter, None)
+            if next_window is not None:
+                pending.append((*next_window, executor.submit(
+                    _parse_pdf_window, file_path, next_window[0], next_window[1], unstructured_kwargs)))
+            yield from documents
+
+
+def iter_parse_file(
+    file_path: str,
+    cache_dir: Optional[str] = None,
+    page_window: Optional[int] = None,
+    window_workers: int = 1,
+    **unstructured_kwargs,
+) -> Iterator[Document]:
+    """
+    `load_and_parse_file` 的生成器版本：逐个产出解析得到的 Document，参数含义相同。
+    命中缓存时逐行读取缓存；未命中时边产出边写入缓存，完整遍历结束后缓存才会生效。
+
+    Yields:
+        Document: 从文件中解析出的元素。
     """
     if not os.path.exists(file_path):
         logging.error(f"文件未找到: {file_path}")
-        return []
+        return
 
-    logging.info(f"开始使用 unstructured 解析文件: {file_path}")
-    
     # 默认开启表格结构推断
     unstructured_kwargs.setdefault('infer_table_structure', True)
-    
-    try:
-        elements: List[Element] = partition(filename=file_path, **unstructured_kwargs)  # partition可以解析.pdf,.docx,.md,.txt等文件
-    except Exception as e:
-        logging.error(f"使用 unstructured 解析文件 '{file_path}' 时出错: {e}")
-        return []
 
-    documents = []
-    for element in elements:
-        # 表格元素，元数据中会包含 HTML 表示
-        if "unstructured.documents.elements.Table" in str(type(element)):
-            metadata = element.metadata.to_dict()
-            # unstructured 在某些情况下会将表格内容直接放入 text 字段
-            # 如果 text 字段为空，则使用 HTML 表示
-            page_content = element.text
-            if not page_content.strip() and metadata.get('text_as_html'):
-                 page_content = metadata['text_as_html']
-            
-            # 清理元数据，避免冗余
-            metadata.pop('text_as_html', None)
-        else:
-            page_content = element.text
-            metadata = element.metadata.to_dict()
+    windowed = bool(page_window) and file_path.lower().endswith(".pdf")
+    cache = ParseCache(cache_dir) if cache_dir else None
+    cache_key = None
+    if cache is not None:
+        key_kwargs = {**unstructured_kwargs, "page_window": page_window} if windowed else unstructured_kwargs
+        cache_key = cache.key(file_path, key_kwargs)
+        if cache.has(cache_key):
+            logging.info(f"命中解析缓存: {file_path}")
+            yield from cache.iter_load(cache_key)
+            return
 
-        # 清理元数据中的空值
-        metadata = {k: v for k, v in metadata.items() if v is not None}
-        
-        # 确保来源信息正确
-        metadata['source'] = metadata.get('filename', os.path.basename(file_path))
+    logging.info(f"开始使用 unstructured 解析文件: {file_path}")
 
-        doc = Document(page_content=page_content, metadata=metadata)
-        documents.append(doc)
-    
-    logging.info(f"文件解析完成，共得到 {len(documents)} 个文档元素。")
-    return documents
+    failed_windows: List[Dict[str, Any]] = []
+    num_pages = _count_pdf_pages(file_path) if windowed else None
+    if num_pages and num_pages > page_window:
+        documents = iter_parse_pdf_windows(
+            file_path, page_window, window_workers, failed_windows=failed_windows, **unstructured_kwargs
+        )
+    else:
+        try:
+            elements: List[Element] = partition(filename=file_path, **unstructured_kwargs)  # partition可以解析.pdf,.docx,.md,.txt等文件
+        except Exception as e:
+            logging.error(f"使用 unstructured 解析文件 '{file_path}' 时出错: {e}")
+            return
+        documents = (_element_to_document(element, file_path) for element in elements)
 
+    cache_writer = cache.open_writer(cache_key) if cache is not None else None
+    completed = False
+    count = 0
+    try:
+        for doc in documents:
+            if cache_writer is not None:
+                cache_writer.write(doc)
+            count += 1
+            yield doc
+        # 有窗口解析失败时结果不完整，不写入缓存
+        completed = not failed_windows
+    finally:
+        if cache_writer is not None:
+            cache_writer.close(commit=completed)
 
-# --- 2. Chunk File ---
+    if failed_windows:
+        logging.warning(f"文件 '{file_path}' 有 {len(failed_windows)} 个页窗口解析失败: {failed_windows}")
 
-ChunkingStrategy = Literal["recursive", "character", "code"]
+    logging.info(f"文件解析完成，共得到 {count} 个文档元素。")
 
-def chunk_documents(
-    documents: List[Document],
-    strategy: ChunkingStrategy = "recursive",
-    chunk_size: int = 1000,
-    chunk_overlap: int = 200,
-    code_language: Optional[Language] = None
+
+def load_and_parse_file(
+    file_path: str,
+    cache_dir: Optional[str] = None,
+    page_window: Optional[int] = None,
+    window_workers: int = 1,
+    **unstructured_kwargs,
 ) -> List[Document]:
     """
-    根据指定的策略对 Document列表进行切块。
+    加载并解析单个文件，将其转换为 LangChain Document 对象列表。
+    这个过程利用 unstructured 库，同时完成了加载和智能解析（例如，提取表格和图片内容）。
 
     Args:
-        documents (List[Document]): 待切块的文档列表。
-        strategy (ChunkingStrategy): 切块策略。
-        chunk_size (int): 每个块的最大大小。
-        chunk_overlap (int): 块之间的重叠大小。
-        code_language (Optional[Language]): 如果策略是 'code'，则需要指定编程语言。
+        file_path (str): 要处理的文件路径。
+        cache_dir (Optional[str]): 解析缓存目录。文件内容、unstructured 版本和解析参数都未变化时，
+            直接返回缓存的结果而不重新解析；为空时不使用缓存。
+        page_window (Optional[int]): 对超过该页数的 PDF 按页窗口分段解析，控制峰值内存，
+            单个窗口失败不影响其他窗口；为空时整体解析。
+        window_workers (int): 并行解析页窗口的进程数。
+        **unstructured_kwargs: 传递给 `unstructured.partition` 函数的额外参数。
+            例如:
+            - strategy (str): 解析策略 ('auto', 'hi_res', 'fast')。'hi_res' 对PDF效果好。
+            - ocr_languages (str): OCR 语言，如 'chi_sim+eng' 用于中英文。
+            - extract_images_in_pdf (bool): 是否提取 PDF 中的图片 (需要OCR支持来转为文字)。
+            - infer_table_structure (bool): 是否推断表格结构并转为HTML。
 
     Returns:
-        List[Document]: 切块后的文档列表。
+        List[Document]: 从文件中解析出的元素列表，每个元素是一个 Document 对象。
     """
-    logging.info(f"开始切块，策略: {strategy}，块大小: {chunk_size}，重叠: {chunk_overlap}")
+    return list(iter_parse_file(
+        file_path, cache_dir=cache_dir, page_window=page_window, window_workers=window_workers, **unstructured_kwargs
+    ))
+
 
+# --- 2. Chunk File ---
+
+ChunkingStrategy = Literal["recursive", "character", "code"]
+
+def _create_text_splitter(
+    strategy: ChunkingStrategy,
+    chunk_size: int,
+    chunk_overlap: int,
+    code_language: Optional[Language],
+):
+    """根据切块策略创建 LangChain 文本切分器"""
     if strategy == "recursive":
-        text_splitter = RecursiveCharacterTextSplitter(
+        return RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             length_function=len,
             add_start_index=True,
         )
     elif strategy == "character":
-        text_splitter = CharacterTextSplitter(
+        return CharacterTextSplitter(
             separator="\n\n",
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -170,7 +539,7 @@ def chunk_documents(
     elif strategy == "code":
         if code_language is None:
             raise ValueError("使用 'code' 策略时必须提供 'code_language' 参数。")
-        text_splitter = RecursiveCharacterTextSplitter.from_language(
+        return RecursiveCharacterTextSplitter.from_language(
             language=code_language,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -178,6 +547,49 @@ def chunk_documents(
     else:
         raise ValueError(f"未知的切块策略: {strategy}")
 
+
+def iter_chunk_documents(
+    documents: Iterable[Document],
+    strategy: ChunkingStrategy = "recursive",
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    code_language: Optional[Language] = None
+) -> Iterator[Document]:
+    """
+    `chunk_documents` 的生成器版本：逐个读取输入文档并产出其切块结果，参数含义相同。
+    每个文档独立切块，结果与 `chunk_documents` 完全一致，但内存占用不随文档数量增长。
+
+    Yields:
+        Document: 切块后的文本块。
+    """
+    text_splitter = _create_text_splitter(strategy, chunk_size, chunk_overlap, code_language)
+    for doc in documents:
+        yield from text_splitter.split_documents([doc])
+
+
+def chunk_documents(
+    documents: List[Document],
+    strategy: ChunkingStrategy = "recursive",
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    code_language: Optional[Language] = None
+) -> List[Document]:
+    """
+    根据指定的策略对 Document列表进行切块。
+
+    Args:
+        documents (List[Document]): 待切块的文档列表。
+        strategy (ChunkingStrategy): 切块策略。
+        chunk_size (int): 每个块的最大大小。
+        chunk_overlap (int): 块之间的重叠大小。
+        code_language (Optional[Language]): 如果策略是 'code'，则需要指定编程语言。
+
+    Returns:
+        List[Document]: 切块后的文档列表。
+    """
+    logging.info(f"开始切块，策略: {strategy}，块大小: {chunk_size}，重叠: {chunk_overlap}")
+
+    text_splitter = _create_text_splitter(strategy, chunk_size, chunk_overlap, code_language)
     chunked_docs = text_splitter.split_documents(documents)
     logging.info(f"切块完成，共生成 {len(chunked_docs)} 个文本块。")
     return chunked_docs
@@ -210,20 +622,1049 @@ def save_docs_to_json(documents: List[Document], output_path: str):
         logging.error(f"保存 JSON 文件时出错: {e}")
 
 
-def main():
+Compression = Literal["gzip", "zstd"]
+
+def _infer_compression(path: str) -> Optional[Compression]:
+    """根据扩展名推断压缩格式：.gz → gzip，.zst → zstd，其他不压缩"""
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def _open_text(path: str, mode: str, compression: Optional[Compression]):
+    """按压缩格式以文本模式打开文件，mode 为 'r' 或 'w'"""
+    if compression is None:
+        return open(path, mode, encoding='utf-8')
+    if compression == "gzip":
+        return gzip.open(path, f"{mode}t", encoding='utf-8')
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("使用 zstd 压缩需要安装 zstandard: `pip install zstandard`")
+        return zstandard.open(path, f"{mode}t", encoding='utf-8')
+    raise ValueError(f"未知的压缩格式: {compression}")
+
+
+def save_docs_to_jsonl(
+    documents: Iterable[Document],
+    output_path: str,
+    compression: Optional[Compression] = None,
+    flush_every: int = 1000,
+) -> int:
+    """
+    以 JSON Lines 格式流式保存文档，每行一个 {"page_content", "metadata"} 对象。
+    输入可以是生成器，边产出边写入，内存占用不随文档数量增长。
+
+    Args:
+        documents (Iterable[Document]): 要保存的文档（可为生成器）。
+        output_path (str): 输出文件路径。
+        compression (Optional[Compression]): 压缩格式 ('gzip' 或 'zstd')，为空时按扩展名推断。
+        flush_every (int): 每写入多少行刷新一次缓冲区，便于在处理过程中查看已完成的输出。
+
+    Returns:
+        int: 写入的文档数量。
     """
-    主函数，演示整个处理流程。
+    compression = compression or _infer_compression(output_path)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    count = 0
+    with _open_text(output_path, 'w', compression) as f:
+        for doc in documents:
+            f.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata},
+                               ensure_ascii=False, default=str) + "\n")
+            count += 1
+            if count % flush_every == 0:
+                f.flush()
+    logging.info(f"已流式写入 {count} 个文档到: {output_path}")
+    return count
+
+
+def iter_docs_from_jsonl(input_path: str, compression: Optional[Compression] = None) -> Iterator[Document]:
     """
-    # --- 配置区 ---
-    # 输入文件路径 (请根据您的文件位置修改)
-    # 示例1: 一个复杂的PDF文档
-    INPUT_FILE = os.path.join("..", "90-文档-Data", "RAG", "LLM-RAG.pdf")
-    # 示例2: Python源代码文件
-    # INPUT_FILE = "05-LlamaIndex-语义分块.py" 
-    
-    # 输出文件路径
-    OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "output")
-    filename = os.path.splitext(os.path.basename(INPUT_FILE))[0]
+    流式读取 `save_docs_to_jsonl` 保存的文件，逐个产出 Document，供后续向量化使用。
+
+    Args:
+        input_path (str): JSON Lines 文件路径。
+        compression (Optional[Compression]): 压缩格式，为空时按扩展名推断。
+
+    Yields:
+        Document: 读取到的文档。
+    """
+    with _open_text(input_path, 'r', compression or _infer_compression(input_path)) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                yield Document(page_content=item["page_content"], metadata=item.get("metadata", {}))
+
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """将任意可迭代对象按固定大小分批，例如把流式读取的文本块分批送入向量化"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- 4. Parallel Directory Ingestion ---
+
+SUPPORTED_EXTENSIONS = (
+    ".pdf", ".docx", ".doc", ".pptx", ".ppt", ".xlsx", ".xls", ".csv",
+    ".md", ".txt", ".html", ".htm", ".xml", ".eml", ".rtf", ".odt", ".epub", ".py",
+)
+
+
+def discover_files(input_path: str, extensions: Iterable[str] = SUPPORTED_EXTENSIONS) -> List[str]:
+    """
+    发现待处理的文件，支持单个文件、目录（递归）和 glob 模式（如 'data/**/*.pdf'）。
+
+    Args:
+        input_path (str): 文件路径、目录路径或 glob 模式。
+        extensions (Iterable[str]): 目录和 glob 模式下只保留这些扩展名的文件。
+
+    Returns:
+        List[str]: 排序后的文件路径列表。
+    """
+    if os.path.isfile(input_path):
+        return [input_path]
+
+    if os.path.isdir(input_path):
+        candidates = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(input_path)
+            for name in names
+        ]
+    else:
+        candidates = glob.glob(input_path, recursive=True)
+
+    extensions = tuple(ext.lower() for ext in extensions)
+    return sorted(
+        path for path in set(candidates)
+        if os.path.isfile(path) and path.lower().endswith(extensions)
+    )
+
+
+@dataclass
+class FileResult:
+    """单个文件在 worker 进程中解析和切块的结果"""
+    file_path: str
+    status: Literal["ok", "empty", "error", "timeout", "crashed"]
+    chunks: List[Document] = field(default_factory=list)
+    num_elements: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def _process_file(file_path: str, parse_kwargs: Dict[str, Any], chunk_kwargs: Dict[str, Any]) -> FileResult:
+    """在 worker 进程中解析并切块单个文件"""
+    started = time.perf_counter()
+    parsed_docs = load_and_parse_file(file_path, **parse_kwargs)
+    if not parsed_docs:
+        return FileResult(file_path, "empty", seconds=time.perf_counter() - started)
+    chunks = chunk_documents(parsed_docs, **chunk_kwargs)
+    return FileResult(file_path, "ok", chunks, len(parsed_docs), time.perf_counter() - started)
+
+
+def _parse_worker_loop(conn, parse_kwargs: Dict[str, Any], chunk_kwargs: Dict[str, Any]):
+    """worker 进程主循环：每次从管道接收一个文件路径，处理后把结果发回，收到 None 时退出"""
+    while True:
+        try:
+            file_path = conn.recv()
+        except EOFError:
+            break
+        if file_path is None:
+            break
+        try:
+            result = _process_file(file_path, parse_kwargs, chunk_kwargs)
+        except Exception as e:
+            result = FileResult(file_path, "error", error=repr(e))
+        conn.send(result)
+
+
+class _ParseWorker:
+    """一个 worker 进程及其当前正在处理的文件"""
+    def __init__(self, ctx, parse_kwargs: Dict[str, Any], chunk_kwargs: Dict[str, Any]):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_parse_worker_loop,
+            args=(child_conn, parse_kwargs, chunk_kwargs),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.file_path: Optional[str] = None
+        self.started_at = 0.0
+
+    def assign(self, file_path: str):
+        self.file_path = file_path
+        self.started_at = time.perf_counter()
+        self.conn.send(file_path)
+
+    def stop(self, force: bool = False):
+        if not force:
+            try:
+                self.conn.send(None)
+                self.process.join(timeout=5)
+            except (OSError, BrokenPipeError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def iter_process_files_parallel(
+    file_paths: List[str],
+    parse_kwargs: Optional[Dict[str, Any]] = None,
+    chunk_kwargs: Optional[Dict[str, Any]] = None,
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    start_method: Optional[str] = None,
+) -> Iterator[FileResult]:
+    """
+    使用进程池并行解析和切块多个文件，按完成顺序逐个产出结果。
+
+    每个 worker 进程一次只处理一个文件，主进程跟踪每个文件的开始时间：
+    - 超过 `timeout` 秒未完成的文件会被终止，结果标记为 'timeout'；
+    - worker 进程崩溃（如解析库段错误、内存耗尽被杀）只影响当前文件，结果标记为 'crashed'；
+    两种情况下都会启动新的 worker 继续处理剩余文件。
+
+    Args:
+        file_paths (List[str]): 待处理的文件列表。
+        parse_kwargs (Optional[Dict[str, Any]]): 传给 `load_and_parse_file` 的参数。
+        chunk_kwargs (Optional[Dict[str, Any]]): 传给 `chunk_documents` 的参数。
+        max_workers (Optional[int]): worker 进程数，默认为 CPU 核数。
+        timeout (Optional[float]): 单个文件的最长处理时间（秒），为空表示不限制。
+        start_method (Optional[str]): 多进程启动方式 ('fork', 'spawn', 'forkserver')，默认使用平台默认值。
+
+    Yields:
+        FileResult: 每个文件的处理结果，按完成顺序产出。
+    """
+    parse_kwargs = parse_kwargs or {}
+    chunk_kwargs = chunk_kwargs or {}
+    pending = deque(file_paths)
+    if not pending:
+        return
+
+    ctx = multiprocessing.get_context(start_method)
+    num_workers = max(1, min(max_workers or os.cpu_count() or 1, len(pending)))
+    workers = [_ParseWorker(ctx, parse_kwargs, chunk_kwargs) for _ in range(num_workers)]
+
+    try:
+        while True:
+            for worker in workers:
+                if worker.file_path is None and pending:
+                    worker.assign(pending.popleft())
+            busy = [worker for worker in workers if worker.file_path is not None]
+            if not busy:
+                break
+
+            wait([w.conn for w in busy] + [w.process.sentinel for w in busy], timeout=0.5)
+            now = time.perf_counter()
+            for i, worker in enumerate(workers):
+                if worker.file_path is None:
+                    continue
+                if worker.conn.poll():
+                    try:
+                        result = worker.conn.recv()
+                    except (EOFError, OSError):
+                        # 管道被关闭：worker 在发送结果前退出
+                        crashed = True
+                    else:
+                        worker.file_path = None
+                        yield result
+                        continue
+                else:
+                    crashed = not worker.process.is_alive()
+
+                if crashed:
+                    worker.process.join(timeout=1)
+                    exitcode = worker.process.exitcode
+                    yield FileResult(worker.file_path, "crashed", seconds=now - worker.started_at,
+                                     error=f"worker exited with code {exitcode}")
+                elif timeout is not None and now - worker.started_at > timeout:
+                    yield FileResult(worker.file_path, "timeout", seconds=now - worker.started_at,
+                                     error=f"exceeded {timeout}s")
+                else:
+                    continue
+                # 替换出问题的 worker，保证其他文件不受影响
+                worker.stop(force=True)
+                workers[i] = _ParseWorker(ctx, parse_kwargs, chunk_kwargs)
+    finally:
+        for worker in workers:
+            worker.stop(force=worker.file_path is not None)
+
+
+def _output_name(file_path: str, base_dir: str) -> str:
+    """根据文件相对于输入根目录的路径生成输出文件名，避免不同目录下同名文件互相覆盖"""
+    relative = os.path.relpath(file_path, base_dir) if base_dir else os.path.basename(file_path)
+    stem = os.path.splitext(relative)[0]
+    return stem.replace(os.sep, "__").replace("/", "__")
+
+
+def ingest_directory(
+    input_path: str,
+    output_dir: str,
+    parse_kwargs: Optional[Dict[str, Any]] = None,
+    chunk_kwargs: Optional[Dict[str, Any]] = None,
+    max_workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+    output_format: Literal["json", "jsonl"] = "json",
+    compression: Optional[Compression] = None,
+    deduplicator: Optional["ChunkDeduplicator"] = None,
+    index_fn: Optional[Callable[[Iterable[Document]], Any]] = None,
+    start_method: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    并行处理目录或 glob 模式匹配到的所有文件，每完成一个文件就立即保存其切块结果。
+
+    Args:
+        input_path (str): 目录路径或 glob 模式。
+        output_dir (str): 输出目录，每个文件保存为 `<相对路径>_chunked.json`（或 `.jsonl[.gz|.zst]`）。
+        parse_kwargs (Optional[Dict[str, Any]]): 传给 `load_and_parse_file` 的参数。
+        chunk_kwargs (Optional[Dict[str, Any]]): 传给 `chunk_documents` 的参数。
+        max_workers (Optional[int]): worker 进程数。
+        timeout (Optional[float]): 单个文件的最长处理时间（秒）。
+        output_format (Literal["json", "jsonl"]): 输出格式。
+        compression (Optional[Compression]): jsonl 输出的压缩格式。
+        deduplicator (Optional[ChunkDeduplicator]): 跨文件去重器，按文件完成顺序去除与已保存文本块重复的块。
+        index_fn (Optional[Callable[[Iterable[Document]], Any]]): 写入向量库的函数（如 `index_chunks_to_milvus`），
+            接收文本块生成器；每个文件保存后其文本块立即流入该函数，返回值记录在汇总的 "index" 字段中。
+        start_method (Optional[str]): worker 进程的启动方式。默认在指定 index_fn 时使用 'spawn'：
+            此时 worker 在入库流水线的读取线程中启动，主进程已加载嵌入模型且有其他线程在运行，
+            fork 这样的进程可能使 worker 死锁；否则使用平台默认值。
+
+    Returns:
+        Dict[str, Any]: 处理汇总，包括各状态的文件数、文本块数、耗时、吞吐量、去重统计和失败文件列表。
+    """
+    file_paths = discover_files(input_path)
+    total = len(file_paths)
+    logging.info(f"共发现 {total} 个待处理文件，使用 {max_workers or os.cpu_count()} 个进程。")
+    if not file_paths:
+        return {"files": 0}
+    if start_method is None and index_fn is not None:
+        start_method = "spawn"
+
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in file_paths])
+    counts = {"ok": 0, "empty": 0, "error": 0, "timeout": 0, "crashed": 0}
+    failed = []
+    num_chunks = 0
+    started = time.perf_counter()
+
+    def iter_saved_chunks() -> Iterator[Document]:
+        nonlocal num_chunks
+        results = iter_process_files_parallel(file_paths, parse_kwargs, chunk_kwargs, max_workers, timeout,
+                                              start_method=start_method)
+        for done, result in enumerate(results, start=1):
+            counts[result.status] += 1
+            if result.status == "ok" and deduplicator is not None:
+                result.chunks = list(deduplicator.filter(result.chunks))
+            if result.status == "ok":
+                num_chunks += len(result.chunks)
+                output_stem = os.path.join(output_dir, f"{_output_name(os.path.abspath(result.file_path), base_dir)}_chunked")
+                if output_format == "jsonl":
+                    save_docs_to_jsonl(result.chunks, output_stem + _jsonl_suffix(compression), compression)
+                else:
+                    save_docs_to_json(result.chunks, output_stem + ".json")
+            elif result.status != "empty":
+                failed.append({"file": result.file_path, "status": result.status, "error": result.error})
+
+            elapsed = time.perf_counter() - started
+            logging.info(
+                f"[{done}/{total}] {result.status}: {result.file_path} "
+                f"({len(result.chunks)} 块, {result.seconds:.1f}s) | 累计 {done / elapsed:.2f} 文件/s"
+            )
+            yield from result.chunks
+
+    index_result = None
+    if index_fn is not None:
+        index_result = index_fn(iter_saved_chunks())
+    else:
+        deque(iter_saved_chunks(), maxlen=0)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "files": total,
+        **counts,
+        "chunks": num_chunks,
+        "seconds": round(elapsed, 2),
+        "files_per_second": round(total / elapsed, 3) if elapsed > 0 else 0.0,
+        "chunks_per_second": round(num_chunks / elapsed, 3) if elapsed > 0 else 0.0,
+        "failed": failed,
+    }
+    if index_result is not None:
+        summary["index"] = _report_to_dict(index_result)
+    if deduplicator is not None:
+        summary["dedup"] = {**asdict(deduplicator.report), "kept_chunks": deduplicator.report.kept_chunks}
+        deduplicator.report.log_summary()
+    logging.info(
+        f"目录处理完成：{total} 个文件（成功 {counts['ok']}，无内容 {counts['empty']}，出错 {counts['error']}，"
+        f"超时 {counts['timeout']}，崩溃 {counts['crashed']}），共 {num_chunks} 个文本块，"
+        f"耗时 {elapsed:.1f}s，{summary['files_per_second']} 文件/s，{summary['chunks_per_second']} 块/s。"
+    )
+    return summary
+
+
+# --- 5. Deduplicate Chunks ---
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+def _normalize_chunk_text(text: str) -> str:
+    """归一化文本：合并空白并转为小写，用于精确去重和 shingle 计算"""
+    return " ".join(text.split()).lower()
+
+
+def _char_shingles(text: str, size: int) -> List[str]:
+    """字符级 n-gram，同时适用于中文和英文文本"""
+    if len(text) <= size:
+        return [text]
+    return list({text[i:i + size] for i in range(len(text) - size + 1)})
+
+
+def _choose_lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """选择 LSH 的 (band 数, 每个 band 的行数)，使 S 曲线的拐点 (1/b)^(1/r) 最接近相似度阈值"""
+    best, best_error = (num_perm, 1), float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+@dataclass
+class DedupReport:
+    """去重统计"""
+    input_chunks: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+    input_bytes: int = 0
+    removed_bytes: int = 0
+
+    @property
+    def kept_chunks(self) -> int:
+        return self.input_chunks - self.exact_duplicates - self.near_duplicates
+
+    def log_summary(self):
+        removed = self.exact_duplicates + self.near_duplicates
+        ratio = self.removed_bytes / self.input_bytes * 100 if self.input_bytes else 0.0
+        logging.info(
+            f"去重完成：输入 {self.input_chunks} 块，移除 {removed} 块（精确重复 {self.exact_duplicates}，"
+            f"近似重复 {self.near_duplicates}），保留 {self.kept_chunks} 块；"
+            f"移除 {self.removed_bytes} / {self.input_bytes} 字节 ({ratio:.1f}%)。"
+        )
+
+
+class ChunkDeduplicator:
+    """
+    文本块去重器：先按归一化文本的哈希去除精确重复，再用 MinHash + LSH 去除近似重复。
+    保留最先出现的文本块，被合并的重复块的来源信息写入 provenance 文件，
+    annotate_kept 为 True 时同时记录在保留块的 metadata['duplicates'] 中。
+    去重器是有状态的，可以跨多个文件持续使用（例如去除不同年报中重复的页眉、免责声明）；
+    默认只保留每个文本块的哈希和 MinHash 签名，不持有文本块本身，内存不随文本量增长。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        near_duplicates: bool = True,
+        provenance_path: Optional[str] = None,
+        seed: int = 1,
+        annotate_kept: bool = False,
+    ):
+        """
+        Args:
+            threshold (float): 近似重复的 Jaccard 相似度阈值。
+            num_perm (int): MinHash 签名长度。
+            shingle_size (int): 字符 n-gram 的长度。
+            near_duplicates (bool): 是否去除近似重复，为 False 时只去除精确重复。
+            provenance_path (Optional[str]): 合并记录另存为 JSON Lines 的路径；保留块已写出到磁盘时
+                （如目录并行处理中跨文件的重复），可从该文件追溯被合并的块。
+            seed (int): 随机种子，保证多次运行得到相同的签名。
+            annotate_kept (bool): 是否把合并记录写入保留块的 metadata；需要持有所有保留块的引用，
+                只适合保留块本来就全部在内存中的场景（如 `deduplicate_chunks`）。
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.near_duplicates = near_duplicates
+        self.provenance_path = provenance_path
+        self.report = DedupReport()
+        if provenance_path:
+            os.makedirs(os.path.dirname(os.path.abspath(provenance_path)), exist_ok=True)
+            open(provenance_path, 'w', encoding='utf-8').close()
+
+        rng = np.random.RandomState(seed)
+        # a, b < 2^31 且哈希值 < 2^32，保证 a * h + b 不会溢出 uint64
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+        self._bands, self._rows = _choose_lsh_bands(threshold, num_perm)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self._bands)]
+        self._exact_index: Dict[str, int] = {}
+        self._kept_hashes: List[str] = []
+        self._kept_docs: Optional[List[Document]] = [] if annotate_kept else None
+        self._signatures: List[np.ndarray] = []
+
+    def _signature(self, text: str) -> np.ndarray:
+        hashes = np.array(
+            [zlib.crc32(shingle.encode('utf-8')) for shingle in _char_shingles(text, self.shingle_size)],
+            dtype=np.uint64,
+        )
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME).min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self._rows:(i + 1) * self._rows].tobytes() for i in range(self._bands)]
+
+    def _merge(self, kept_index: int, doc: Document, kind: str, similarity: float, size: int):
+        entry = {
+            "kind": kind,
+            "similarity": round(similarity, 4),
+            "source": doc.metadata.get("source"),
+            "page_number": doc.metadata.get("page_number"),
+            "start_index": doc.metadata.get("start_index"),
+        }
+        if self._kept_docs is not None:
+            kept_doc = self._kept_docs[kept_index]
+            kept_doc.metadata.setdefault("duplicates", []).append(entry)
+            kept_doc.metadata["duplicate_count"] = len(kept_doc.metadata["duplicates"])
+        self.report.removed_bytes += size
+        if self.provenance_path:
+            with open(self.provenance_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"kept_chunk_hash": self._kept_hashes[kept_index], **entry},
+                                   ensure_ascii=False, default=str) + "\n")
+
+    def add(self, doc: Document) -> bool:
+        """
+        处理一个文本块。
+
+        Returns:
+            bool: 该块是否被保留；重复块返回 False，并合并到先前保留的块中。
+        """
+        normalized = _normalize_chunk_text(doc.page_content)
+        size = len(doc.page_content.encode('utf-8'))
+        chunk_hash = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        self.report.input_chunks += 1
+        self.report.input_bytes += size
+
+        kept_index = self._exact_index.get(chunk_hash)
+        if kept_index is not None:
+            self.report.exact_duplicates += 1
+            self._merge(kept_index, doc, "exact", 1.0, size)
+            return False
+
+        signature = None
+        if self.near_duplicates:
+            signature = self._signature(normalized)
+            band_keys = self._band_keys(signature)
+            candidates = {idx for bucket, key in zip(self._buckets, band_keys) for idx in bucket.get(key, ())}
+            best_index, best_similarity = None, 0.0
+            for idx in sorted(candidates):
+                similarity = float(np.mean(self._signatures[idx] == signature))
+                if similarity >= self.threshold and similarity > best_similarity:
+                    best_index, best_similarity = idx, similarity
+            if best_index is not None:
+                self.report.near_duplicates += 1
+                self._merge(best_index, doc, "near", best_similarity, size)
+                return False
+
+        doc.metadata["chunk_hash"] = chunk_hash
+        kept_index = len(self._kept_hashes)
+        self._kept_hashes.append(chunk_hash)
+        if self._kept_docs is not None:
+            self._kept_docs.append(doc)
+        self._exact_index[chunk_hash] = kept_index
+        if signature is not None:
+            self._signatures.append(signature)
+            for bucket, key in zip(self._buckets, band_keys):
+                bucket.setdefault(key, []).append(kept_index)
+        else:
+            self._signatures.append(np.empty(0, dtype=np.uint64))
+        return True
+
+    def filter(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """逐个产出未被去重的文本块"""
+        for doc in documents:
+            if self.add(doc):
+                yield doc
+
+
+def deduplicate_chunks(
+    documents: Iterable[Document],
+    threshold: float = 0.85,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    near_duplicates: bool = True,
+) -> Tuple[List[Document], DedupReport]:
+    """
+    在向量化之前去除重复和近似重复的文本块。
+
+    Args:
+        documents (Iterable[Document]): 切块后的文本块。
+        threshold (float): 近似重复的 Jaccard 相似度阈值 (0~1)，越低去除得越多。
+        num_perm (int): MinHash 签名长度，越大估计越准确但越慢。
+        shingle_size (int): 字符 n-gram 的长度。
+        near_duplicates (bool): 是否去除近似重复，为 False 时只去除精确重复。
+
+    Returns:
+        Tuple[List[Document], DedupReport]: 保留的文本块（metadata 中记录被合并块的来源）和去重统计。
+    """
+    deduplicator = ChunkDeduplicator(threshold, num_perm, shingle_size, near_duplicates, annotate_kept=True)
+    kept = list(deduplicator.filter(documents))
+    deduplicator.report.log_summary()
+    return kept, deduplicator.report
+
+
+# --- 6. Index into Milvus ---
+
+# Milvus VARCHAR 字段的最大字节数
+MILVUS_VARCHAR_MAX_LENGTH = 65535
+
+
+def _truncate_utf8(text: str, max_bytes: int) -> str:
+    encoded = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', errors='ignore')
+
+
+def chunk_row_id(doc: Document) -> str:
+    """
+    文本块在 Milvus 中的主键：优先使用增量切块分配的 chunk_id，
+    否则由 (来源, 页码, 起始位置, 文本) 计算，同一文本块每次得到相同的主键。
+    """
+    chunk_id = doc.metadata.get("chunk_id")
+    if chunk_id:
+        return str(chunk_id)
+    key = "\0".join(str(doc.metadata.get(field) or "") for field in ("source", "page_number", "start_index"))
+    return hashlib.sha1(f"{key}\0{doc.page_content}".encode('utf-8')).hexdigest()
+
+
+class MilvusChunkWriter:
+    """
+    将文本块及其向量写入 Milvus 集合。
+    集合不存在时在首次写入时按向量维度创建，无需提前计算样本向量。
+    以 chunk_id 为主键 upsert，失败批次重试或重复导入同一文件时覆盖已有行，不会写入重复行。
+    """
+
+    def __init__(self, db_path: str, collection_name: str, drop_existing: bool = False):
+        """
+        Args:
+            db_path (str): Milvus Lite 数据库文件路径或 Milvus 服务 URI。
+            collection_name (str): 集合名称。
+            drop_existing (bool): 是否删除已存在的同名集合后重建。
+        """
+        from pymilvus import MilvusClient
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and "://" not in db_path:
+            os.makedirs(db_dir, exist_ok=True)
+        self.client = MilvusClient(db_path)
+        self.collection_name = collection_name
+        if drop_existing and self.client.has_collection(collection_name):
+            self.client.drop_collection(collection_name)
+            logging.info(f"已删除已有集合: {collection_name}")
+        self._ready = self.client.has_collection(collection_name)
+        # 早期版本创建的集合使用自动主键，无法 upsert，改为先按 chunk_id 删除再插入
+        self._auto_id = bool(self._ready and self.client.describe_collection(collection_name).get("auto_id"))
+
+    def _create_collection(self, vector_dim: int):
+        from pymilvus import DataType, FieldSchema, CollectionSchema
+
+        fields = [
+            FieldSchema(name="chunk_id", dtype=DataType.VARCHAR, max_length=64, is_primary=True, auto_id=False),
+            FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=vector_dim),
+            FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=MILVUS_VARCHAR_MAX_LENGTH),
+            FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=1000),
+            FieldSchema(name="page_number", dtype=DataType.INT64),
+            FieldSchema(name="metadata", dtype=DataType.JSON),
+        ]
+        self.client.create_collection(
+            collection_name=self.collection_name,
+            schema=CollectionSchema(fields, "Document Chunks"),
+        )
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(field_name="vector", index_type="AUTOINDEX", metric_type="COSINE")
+        self.client.create_index(collection_name=self.collection_name, index_params=index_params)
+        logging.info(f"已创建集合: {self.collection_name} (dim={vector_dim})")
+
+    @staticmethod
+    def build_rows(documents: List[Document], vectors: List[List[float]]) -> List[Dict[str, Any]]:
+        """按集合 Schema 构建待插入的行，元数据转换为可 JSON 序列化的形式"""
+        rows = []
+        for doc, vector in zip(documents, vectors):
+            metadata = json.loads(json.dumps(doc.metadata, ensure_ascii=False, default=str))
+            rows.append({
+                "vector": list(vector),
+                "chunk_id": chunk_row_id(doc),
+                "text": _truncate_utf8(doc.page_content, MILVUS_VARCHAR_MAX_LENGTH),
+                "source": _truncate_utf8(str(metadata.get("source") or ""), 1000),
+                "page_number": int(metadata.get("page_number") or 0),
+                "metadata": metadata,
+            })
+        return rows
+
+    def __call__(self, documents: List[Document], vectors: List[List[float]]) -> int:
+        """插入一批文本块，返回写入的行数；作为 `run_ingest_pipeline` 的 insert_fn 使用"""
+        if not documents:
+            return 0
+        if not self._ready:
+            self._create_collection(len(vectors[0]))
+            self._ready = True
+        rows = self.build_rows(documents, vectors)
+        if self._auto_id:
+            self.delete_chunks([row["chunk_id"] for row in rows])
+            res = self.client.insert(collection_name=self.collection_name, data=rows)
+            return res.get("insert_count", len(rows)) if isinstance(res, dict) else len(rows)
+        res = self.client.upsert(collection_name=self.collection_name, data=rows)
+        return res.get("upsert_count", len(rows)) if isinstance(res, dict) else len(rows)
+
+    def delete_chunks(self, chunk_ids: List[str], batch_size: int = 500) -> int:
+        """按 chunk_id 删除文本块，返回删除的行数"""
+        if not chunk_ids or not self._ready:
+            return 0
+        deleted = 0
+        for start in range(0, len(chunk_ids), batch_size):
+            ids = json.dumps(chunk_ids[start:start + batch_size])
+            res = self.client.delete(collection_name=self.collection_name, filter=f"chunk_id in {ids}")
+            deleted += res.get("delete_count", 0) if isinstance(res, dict) else len(res or [])
+        return deleted
+
+
+def index_chunks_to_milvus(
+    chunks: Iterable[Document],
+    db_path: str,
+    collection_name: str,
+    provider: str = "huggingface",
+    model_name: str = "BAAI/bge-m3",
+    store_dir: Optional[str] = None,
+    batch_size: int = 64,
+    queue_size: int = 4,
+    max_retries: int = 2,
+    retry_backoff: float = 1.0,
+    drop_existing: bool = False,
+):
+    """
+    将文本块向量化并写入 Milvus，一次完成从原始文件到可检索索引的处理。
+
+    复用后端的三阶段入库流水线（见 backend/utils/ingest_pipeline.py）：读取阶段从 `chunks` 中按批拉取文本块
+    （传入生成器时，解析和切块也在该阶段中逐步进行），向量化和插入阶段之间以有界队列衔接，
+    下游变慢时上游自动阻塞；失败的批次按指数退避重试，最后输出各阶段的吞吐量。
+
+    Args:
+        chunks (Iterable[Document]): 文本块，通常来自 `iter_chunk_documents` 或 `chunk_documents`。
+        db_path (str): Milvus Lite 数据库文件路径或 Milvus 服务 URI。
+        collection_name (str): 集合名称。
+        provider (str): 嵌入模型提供商 (openai/huggingface)，通过 `EmbeddingFactory` 创建嵌入函数。
+        model_name (str): 嵌入模型名称。
+        store_dir (Optional[str]): 内容寻址向量存储目录，已向量化过的文本直接复用。
+        batch_size (int): 每批向量化和插入的文本块数。
+        queue_size (int): 阶段之间有界队列的长度。
+        max_retries (int): 失败批次的最大重试次数。
+        retry_backoff (float): 首次重试前的等待秒数，之后每次翻倍。
+        drop_existing (bool): 是否删除已存在的同名集合后重建。
+
+    Returns:
+        PipelineReport: 各阶段的行数、失败批次、重试次数和吞吐量。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from utils.embedding_config import EmbeddingProvider, EmbeddingConfig
+    from utils.embedding_factory import EmbeddingFactory
+    from utils.ingest_pipeline import run_ingest_pipeline
+
+    config = EmbeddingConfig(
+        provider=EmbeddingProvider(provider.lower()),
+        model_name=model_name,
+        store_dir=store_dir,
+    )
+    embeddings = EmbeddingFactory.create_embedding_function(config)
+    writer = MilvusChunkWriter(db_path, collection_name, drop_existing=drop_existing)
+
+    logging.info(f"开始写入 Milvus: {db_path} / {collection_name}，模型 {provider}:{model_name}")
+    with ThreadPoolExecutor(max_workers=1) as embed_executor:
+        report = run_ingest_pipeline(
+            batches=iter_batches(chunks, batch_size),
+            get_texts=lambda batch: [doc.page_content for doc in batch],
+            embed_fn=embeddings.embed_documents,
+            insert_fn=writer,
+            embed_executor=embed_executor,
+            queue_size=queue_size,
+            max_retries=max_retries,
+            retry_backoff=retry_backoff,
+        )
+    report.log_summary()
+    return report
+
+
+# --- 7. Incremental Re-chunking ---
+
+@dataclass
+class ChangeSet:
+    """
+    文档更新前后的文本块变更集：下游存储删除 `removed_ids` 对应的文本块、写入 `added` 即可与当前文档保持一致。
+    """
+    source: str
+    added: List[Document] = field(default_factory=list)
+    removed_ids: List[str] = field(default_factory=list)
+    unchanged_chunks: int = 0
+    changed_elements: int = 0
+    total_elements: int = 0
+    full_rebuild: bool = False
+    manifest: Dict[str, Any] = field(default_factory=dict, repr=False)
+    manifest_path: Optional[str] = None
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.added and not self.removed_ids
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "full_rebuild": self.full_rebuild,
+            "total_elements": self.total_elements,
+            "changed_elements": self.changed_elements,
+            "unchanged_chunks": self.unchanged_chunks,
+            "removed_ids": self.removed_ids,
+            "added": [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in self.added],
+        }
+
+
+def _manifest_path(manifest_dir: str, file_path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return os.path.join(manifest_dir, f"{digest}.json")
+
+
+def _load_manifest(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"读取切块清单失败，将全量重建: {path} ({e})")
+        return None
+
+
+def save_manifest(changeset: ChangeSet):
+    """
+    保存文档当前的切块清单。应在变更集被下游成功应用之后调用，
+    否则下一次增量切块会认为这些变更已经生效。
+    """
+    if not changeset.manifest_path:
+        return
+    os.makedirs(os.path.dirname(changeset.manifest_path), exist_ok=True)
+    ParseCache._atomic_write(
+        changeset.manifest_path,
+        json.dumps(changeset.manifest, ensure_ascii=False).encode('utf-8'),
+    )
+
+
+def _chunk_element(doc: Document, occurrence: int, text_splitter, chunk_signature: str) -> List[Document]:
+    """对单个元素切块，并为每个文本块分配由 (元素哈希, 出现次序, 块序号, 切块参数) 决定的稳定 chunk_id"""
+    element_hash = doc.metadata.get("element_hash") or compute_element_hash(doc.page_content)
+    chunks = text_splitter.split_documents([doc])
+    for i, chunk in enumerate(chunks):
+        chunk.metadata["element_hash"] = element_hash
+        chunk.metadata["chunk_id"] = hashlib.sha1(f"{element_hash}:{occurrence}:{i}:{chunk_signature}".encode('utf-8')).hexdigest()
+    return chunks
+
+
+def incremental_rechunk(
+    file_path: str,
+    manifest_dir: str,
+    parse_kwargs: Optional[Dict[str, Any]] = None,
+    chunk_kwargs: Optional[Dict[str, Any]] = None,
+) -> ChangeSet:
+    """
+    增量切块：将文档当前的解析结果与上次的切块清单按元素哈希序列做差异比较（difflib），
+    只对新增或修改的元素重新切块，未变化元素的文本块沿用原有 chunk_id，不需要重新向量化。
+
+    切块参数变化或没有历史清单时全量切块，变更集中包含全部文本块。
+    返回的变更集应用到下游存储后，再调用 `save_manifest` 保存新的清单。
+
+    Args:
+        file_path (str): 文档路径。
+        manifest_dir (str): 切块清单目录，每个文档一个清单文件。
+        parse_kwargs (Optional[Dict[str, Any]]): 传给 `load_and_parse_file` 的参数。
+        chunk_kwargs (Optional[Dict[str, Any]]): 切块参数，同 `chunk_documents`。
+
+    Returns:
+        ChangeSet: 新增的文本块和需要删除的 chunk_id。
+    """
+    import difflib
+
+    chunk_kwargs = dict(chunk_kwargs or {"strategy": "recursive", "chunk_size": 500, "chunk_overlap": 50})
+    text_splitter = _create_text_splitter(
+        chunk_kwargs.get("strategy", "recursive"),
+        chunk_kwargs.get("chunk_size", 1000),
+        chunk_kwargs.get("chunk_overlap", 200),
+        chunk_kwargs.get("code_language"),
+    )
+    chunk_signature = json.dumps(chunk_kwargs, sort_keys=True, default=str)
+
+    parsed_docs = load_and_parse_file(file_path, **(parse_kwargs or {}))
+    new_hashes = [doc.metadata.get("element_hash") or compute_element_hash(doc.page_content) for doc in parsed_docs]
+
+    manifest_path = _manifest_path(manifest_dir, file_path)
+    previous = _load_manifest(manifest_path)
+    full_rebuild = previous is None or previous.get("chunking") != chunk_signature
+    old_elements = [] if full_rebuild else previous.get("elements", [])
+    old_hashes = [element["hash"] for element in old_elements]
+
+    changeset = ChangeSet(
+        source=os.path.basename(file_path),
+        total_elements=len(parsed_docs),
+        full_rebuild=full_rebuild,
+        manifest_path=manifest_path,
+    )
+    if full_rebuild and previous is not None:
+        changeset.removed_ids = [cid for element in previous.get("elements", []) for cid in element["chunk_ids"]]
+
+    # 同一文档中重复出现的元素（如页眉）按出现次序区分 chunk_id，并避开沿用的 chunk_id
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    opcodes = matcher.get_opcodes()
+    kept_ids = {cid for tag, i1, i2, _, _ in opcodes if tag == "equal"
+                for element in old_elements[i1:i2] for cid in element["chunk_ids"]}
+    occurrences: Dict[str, int] = {}
+    new_elements = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            for old_element in old_elements[i1:i2]:
+                occurrences[old_element["hash"]] = occurrences.get(old_element["hash"], 0) + 1
+                new_elements.append(old_element)
+                changeset.unchanged_chunks += len(old_element["chunk_ids"])
+            continue
+        for old_element in old_elements[i1:i2]:
+            changeset.removed_ids.extend(old_element["chunk_ids"])
+        for doc, element_hash in zip(parsed_docs[j1:j2], new_hashes[j1:j2]):
+            occurrence = occurrences.get(element_hash, 0)
+            chunks = _chunk_element(doc, occurrence, text_splitter, chunk_signature)
+            while chunks and chunks[0].metadata["chunk_id"] in kept_ids:
+                occurrence += 1
+                chunks = _chunk_element(doc, occurrence, text_splitter, chunk_signature)
+            occurrences[element_hash] = occurrence + 1
+            changeset.added.extend(chunks)
+            changeset.changed_elements += 1
+            new_elements.append({"hash": element_hash, "chunk_ids": [c.metadata["chunk_id"] for c in chunks]})
+
+    # 同一 chunk_id 既被删除又被新增时内容相同（元素哈希、出现次序和切块参数都相同），保留原文本块即可
+    common_ids = set(changeset.removed_ids) & {chunk.metadata["chunk_id"] for chunk in changeset.added}
+    changeset.removed_ids = [cid for cid in dict.fromkeys(changeset.removed_ids) if cid not in common_ids]
+    changeset.added = [chunk for chunk in changeset.added if chunk.metadata["chunk_id"] not in common_ids]
+    changeset.unchanged_chunks += len(common_ids)
+
+    changeset.manifest = {
+        "source": os.path.abspath(file_path),
+        "chunking": chunk_signature,
+        "elements": new_elements,
+    }
+    logging.info(
+        f"增量切块 {changeset.source}：{changeset.total_elements} 个元素中 {changeset.changed_elements} 个有变化，"
+        f"新增 {len(changeset.added)} 块，删除 {len(changeset.removed_ids)} 块，沿用 {changeset.unchanged_chunks} 块"
+        f"{'（全量重建）' if full_rebuild else ''}。"
+    )
+    return changeset
+
+
+def apply_changeset_to_milvus(changeset: ChangeSet, db_path: str, collection_name: str, **index_kwargs):
+    """
+    将变更集应用到 Milvus 集合：按 chunk_id 删除旧文本块，再向量化并写入新增文本块，成功后保存切块清单。
+
+    Args:
+        changeset (ChangeSet): `incremental_rechunk` 返回的变更集。
+        db_path (str): Milvus Lite 数据库文件路径或 Milvus 服务 URI。
+        collection_name (str): 集合名称。
+        **index_kwargs: 传给 `index_chunks_to_milvus` 的其他参数（模型、批大小、重试次数等）。
+    """
+    writer = MilvusChunkWriter(db_path, collection_name)
+    deleted = writer.delete_chunks(changeset.removed_ids)
+    logging.info(f"已从 {collection_name} 删除 {deleted} 个文本块。")
+    if changeset.added:
+        report = index_chunks_to_milvus(changeset.added, db_path, collection_name, **index_kwargs)
+        if report.stages[-1].failed_batches or report.stages[1].failed_batches:
+            raise RuntimeError(f"{changeset.source} 的部分文本块写入失败，切块清单未更新，下次运行将重试。")
+    save_manifest(changeset)
+
+
+def _report_to_dict(report) -> Dict[str, Any]:
+    """将入库流水线的运行报告转换为可写入汇总 JSON 的字典"""
+    return {
+        "inserted_rows": report.inserted_rows,
+        "wall_seconds": round(report.wall_seconds, 2),
+        "stages": [{**asdict(stage), "rows_per_second": round(stage.rows_per_second, 1)} for stage in report.stages],
+    }
+
+
+def _jsonl_suffix(compression: Optional[Compression]) -> str:
+    return {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}[compression]
+
+
+def stream_single_file(
+    input_file: str,
+    output_dir: str,
+    parse_kwargs: Optional[Dict[str, Any]] = None,
+    chunk_kwargs: Optional[Dict[str, Any]] = None,
+    compression: Optional[Compression] = None,
+    deduplicator: Optional[ChunkDeduplicator] = None,
+) -> int:
+    """
+    流式处理单个文件：解析、切块和保存串联为生成器，文本块产出后立即写入 JSON Lines 文件。
+
+    Args:
+        input_file (str): 输入文件路径。
+        output_dir (str): 输出目录。
+        parse_kwargs (Optional[Dict[str, Any]]): 传给 `iter_parse_file` 的参数。
+        chunk_kwargs (Optional[Dict[str, Any]]): 传给 `iter_chunk_documents` 的参数。
+        compression (Optional[Compression]): 输出文件的压缩格式。
+        deduplicator (Optional[ChunkDeduplicator]): 去重器，重复的文本块不写入输出。
+
+    Returns:
+        int: 写入的文本块数量。
+    """
+    filename = os.path.splitext(os.path.basename(input_file))[0]
+    parsed = iter_parse_file(input_file, **(parse_kwargs or {}))
+    chunks = iter_chunk_documents(parsed, **(chunk_kwargs or {}))
+    if deduplicator is not None:
+        chunks = deduplicator.filter(chunks)
+    return save_docs_to_jsonl(
+        chunks,
+        os.path.join(output_dir, f"{filename}_chunked_recursive{_jsonl_suffix(compression)}"),
+        compression,
+    )
+
+
+def process_single_file(
+    input_file: str,
+    output_dir: str,
+    strategy: str = "fast",
+    cache_dir: Optional[str] = None,
+    page_window: Optional[int] = None,
+    window_workers: int = 1,
+    dedup_threshold: Optional[float] = None,
+    chunk_kwargs: Optional[Dict[str, Any]] = None,
+):
+    """
+    处理单个文件：解析、保存解析结果，并按不同策略切块保存。
+
+    Args:
+        input_file (str): 输入文件路径。
+        output_dir (str): 输出目录。
+        strategy (str): unstructured 解析策略。
+        cache_dir (Optional[str]): 解析缓存目录，为空时不使用缓存。
+        page_window (Optional[int]): PDF 页窗口大小，为空时整体解析。
+        window_workers (int): 并行解析页窗口的进程数。
+        dedup_threshold (Optional[float]): 近似重复的相似度阈值，设置后对递归切块结果去重。
+        chunk_kwargs (Optional[Dict[str, Any]]): 递归切块的参数，同 `chunk_documents`，默认 chunk_size=500、chunk_overlap=50。
+    """
+    filename = os.path.splitext(os.path.basename(input_file))[0]
 
     # --- 流程控制 ---
     
@@ -232,8 +1673,11 @@ def main():
     # 如果要进行OCR，请取消注释 ocr_languages 并确保 Tesseract 已安装
     logging.info("--- 步骤 1: 加载与解析文件 ---")
     parsed_docs = load_and_parse_file(
-        INPUT_FILE, 
-        strategy="fast" # 可选 'hi_res', 'fast', 'auto'
+        input_file, 
+        cache_dir=cache_dir,
+        page_window=page_window,
+        window_workers=window_workers,
+        strategy=strategy # 可选 'hi_res', 'fast', 'auto'
         # ocr_languages="eng", # 示例: 英文OCR
         # extract_images_in_pdf=True
     )
@@ -243,27 +1687,25 @@ def main():
     # 保存未经切块的解析结果，用于调试或作为 'semantic' 切块的结果
     save_docs_to_json(
         parsed_docs,
-        os.path.join(OUTPUT_DIR, f"{filename}_parsed_only.json")
+        os.path.join(output_dir, f"{filename}_parsed_only.json")
     )
 
 
     # 2. 按不同策略切块并保存
     logging.info("\n--- 步骤 2: 按不同策略进行文件切块 ---")
     
-    # 策略 A: 递归字符切块 (通用)
-    chunked_recursive_docs = chunk_documents(
-        parsed_docs,
-        strategy="recursive",
-        chunk_size=500,
-        chunk_overlap=50
-    )
+    # 策略 A: 递归字符切块 (通用)，参数与流式和目录模式一致
+    recursive_kwargs = {"strategy": "recursive", "chunk_size": 500, "chunk_overlap": 50, **(chunk_kwargs or {})}
+    chunked_recursive_docs = chunk_documents(parsed_docs, **recursive_kwargs)
+    if dedup_threshold is not None:
+        chunked_recursive_docs, _ = deduplicate_chunks(chunked_recursive_docs, threshold=dedup_threshold)
     save_docs_to_json(
         chunked_recursive_docs,
-        os.path.join(OUTPUT_DIR, f"{filename}_chunked_recursive.json")
+        os.path.join(output_dir, f"{filename}_chunked_recursive.json")
     )
 
     # 策略 B: 代码切块 (如果文件是代码)
-    if INPUT_FILE.endswith(".py"):
+    if input_file.endswith(".py"):
         logging.info("\n检测到Python文件，执行代码切块...")
         chunked_code_docs = chunk_documents(
             parsed_docs, # 对于代码，可以直接用 TextLoader 加载，但这里为了统一流程也用 unstructured
@@ -274,10 +1716,168 @@ def main():
         )
         save_docs_to_json(
             chunked_code_docs,
-            os.path.join(OUTPUT_DIR, f"{filename}_chunked_code.json")
+            os.path.join(output_dir, f"{filename}_chunked_code.json")
         )
     
-    print(f"\n处理完成！所有输出文件已保存在 '{OUTPUT_DIR}' 文件夹中。")
+    print(f"\n处理完成！所有输出文件已保存在 '{output_dir}' 文件夹中。")
+
+
+def run_incremental(args, parse_kwargs: Dict[str, Any], chunk_kwargs: Dict[str, Any], index_fn=None):
+    """
+    增量模式：逐个文件生成变更集并保存为 `<文件名>_changeset.json`；
+    配置了 Milvus 时直接应用变更集，应用成功后才更新切块清单。
+    """
+    manifest_dir = args.manifest_dir or os.path.join(args.output_dir, ".manifests")
+    file_paths = [args.input] if os.path.isfile(args.input) else discover_files(args.input)
+    if not file_paths:
+        logging.warning(f"没有找到待处理的文件: {args.input}")
+        return
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in file_paths])
+    index_kwargs = dict(index_fn.keywords) if index_fn is not None else {}
+    index_kwargs.pop("drop_existing", None)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for file_path in file_paths:
+        try:
+            changeset = incremental_rechunk(file_path, manifest_dir, parse_kwargs, chunk_kwargs)
+        except Exception as e:
+            logging.error(f"增量切块失败: {file_path}，错误: {e}")
+            continue
+        output_path = os.path.join(args.output_dir, f"{_output_name(os.path.abspath(file_path), base_dir)}_changeset.json")
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(changeset.to_dict(), f, ensure_ascii=False, indent=4, default=str)
+        if index_kwargs:
+            try:
+                apply_changeset_to_milvus(changeset, **index_kwargs)
+            except Exception as e:
+                logging.error(f"应用变更集失败: {file_path}，错误: {e}")
+        else:
+            save_manifest(changeset)
+
+
+def parse_args():
+    # 输入文件路径 (请根据您的文件位置修改)
+    # 示例1: 一个复杂的PDF文档
+    default_input = os.path.join("..", "90-文档-Data", "RAG", "LLM-RAG.pdf")
+    # 示例2: Python源代码文件
+    # default_input = "05-LlamaIndex-语义分块.py"
+
+    parser = argparse.ArgumentParser(description="文档加载、解析、切块与保存")
+    parser.add_argument("--input", default=default_input,
+                        help="输入文件、目录或 glob 模式（如 'docs/**/*.pdf'）；目录和 glob 模式使用多进程并行处理")
+    parser.add_argument("--output-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "output"),
+                        help="输出目录")
+    parser.add_argument("--strategy", default="fast", choices=["fast", "hi_res", "auto"], help="unstructured 解析策略")
+    parser.add_argument("--chunk-size", type=int, default=500, help="切块大小")
+    parser.add_argument("--chunk-overlap", type=int, default=50, help="切块重叠大小")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="并行解析的进程数")
+    parser.add_argument("--timeout", type=float, default=None, help="单个文件的最长处理时间（秒）")
+    parser.add_argument("--cache-dir", default=None,
+                        help="解析缓存目录，默认为 <output-dir>/.parse_cache；未修改的文件直接复用上次的解析结果")
+    parser.add_argument("--no-cache", action="store_true", help="不使用解析缓存")
+    parser.add_argument("--page-window", type=int, default=None,
+                        help="超过该页数的 PDF 按页窗口分段解析，控制峰值内存")
+    parser.add_argument("--window-workers", type=int, default=1,
+                        help="单文件模式下并行解析页窗口的进程数（目录模式下窗口串行解析）")
+    parser.add_argument("--output-format", default="json", choices=["json", "jsonl"],
+                        help="输出格式；jsonl 为流式模式，解析、切块和写入逐块进行，内存占用恒定")
+    parser.add_argument("--compression", default=None, choices=["gzip", "zstd"], help="jsonl 输出的压缩格式")
+    parser.add_argument("--dedup", action="store_true",
+                        help="去除精确重复和近似重复 (MinHash/LSH) 的文本块；流式、目录和 Milvus 模式下被合并块的来源"
+                             "记录在输出目录的 dedup_provenance.jsonl 中，单文件模式下记录在保留块的元数据中")
+    parser.add_argument("--dedup-threshold", type=float, default=0.85, help="近似重复的 Jaccard 相似度阈值")
+    parser.add_argument("--milvus-db", default=None,
+                        help="Milvus Lite 数据库路径或服务 URI；设置后切块结果直接向量化并写入该库，一次完成入库")
+    parser.add_argument("--collection", default="document_chunks", help="写入的 Milvus 集合名称")
+    parser.add_argument("--drop-collection", action="store_true", help="写入前删除已存在的同名集合")
+    parser.add_argument("--embedding-provider", default="huggingface", choices=["huggingface", "openai"],
+                        help="嵌入模型提供商")
+    parser.add_argument("--embedding-model", default="BAAI/bge-m3", help="嵌入模型名称")
+    parser.add_argument("--embedding-store", default=os.getenv("EMBEDDING_STORE_DIR"),
+                        help="内容寻址向量存储目录，已向量化的文本直接复用（默认读取 EMBEDDING_STORE_DIR）")
+    parser.add_argument("--index-batch-size", type=int, default=64, help="每批向量化和插入的文本块数")
+    parser.add_argument("--max-retries", type=int, default=2, help="向量化或插入失败的批次的最大重试次数")
+    parser.add_argument("--incremental", action="store_true",
+                        help="增量切块：与上次的切块清单比较，只对变化的元素重新切块，输出新增/删除的 chunk_id 变更集")
+    parser.add_argument("--manifest-dir", default=None, help="切块清单目录，默认为 <output-dir>/.manifests")
+    return parser.parse_args()
+
+
+def main():
+    """
+    主函数：单个文件时演示整个处理流程，目录或 glob 模式时并行批量处理。
+    """
+    args = parse_args()
+    cache_dir = None if args.no_cache else (args.cache_dir or os.path.join(args.output_dir, ".parse_cache"))
+
+    parse_kwargs = {
+        "strategy": args.strategy,
+        "cache_dir": cache_dir,
+        "page_window": args.page_window,
+        "window_workers": args.window_workers,
+    }
+    chunk_kwargs = {"strategy": "recursive", "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap}
+    dedup_threshold = args.dedup_threshold if args.dedup else None
+
+    # 流式和目录模式下文本块写出后不再修改，被合并块的来源另外记录到 dedup_provenance.jsonl
+    deduplicator = None
+    if args.dedup and (args.output_format == "jsonl" or args.milvus_db or not os.path.isfile(args.input)):
+        deduplicator = ChunkDeduplicator(
+            threshold=args.dedup_threshold,
+            provenance_path=os.path.join(args.output_dir, "dedup_provenance.jsonl"),
+        )
+
+    index_fn = None
+    if args.milvus_db:
+        index_fn = functools.partial(
+            index_chunks_to_milvus,
+            db_path=args.milvus_db,
+            collection_name=args.collection,
+            provider=args.embedding_provider,
+            model_name=args.embedding_model,
+            store_dir=args.embedding_store,
+            batch_size=args.index_batch_size,
+            max_retries=args.max_retries,
+            drop_existing=args.drop_collection,
+        )
+
+    if args.incremental:
+        run_incremental(args, parse_kwargs, chunk_kwargs, index_fn)
+        return
+
+    if os.path.isfile(args.input):
+        if index_fn is not None:
+            # 解析、切块、去重、向量化和插入串联为一条流水线，不落地中间 JSON
+            chunks = iter_chunk_documents(iter_parse_file(args.input, **parse_kwargs), **chunk_kwargs)
+            if deduplicator is not None:
+                chunks = deduplicator.filter(chunks)
+            index_fn(chunks)
+            if deduplicator is not None:
+                deduplicator.report.log_summary()
+        elif args.output_format == "jsonl":
+            stream_single_file(args.input, args.output_dir, parse_kwargs, chunk_kwargs, args.compression, deduplicator)
+            if deduplicator is not None:
+                deduplicator.report.log_summary()
+        else:
+            process_single_file(args.input, args.output_dir, dedup_threshold=dedup_threshold,
+                                chunk_kwargs=chunk_kwargs, **parse_kwargs)
+        return
+
+    summary = ingest_directory(
+        args.input,
+        args.output_dir,
+        parse_kwargs=parse_kwargs,
+        chunk_kwargs=chunk_kwargs,
+        max_workers=args.workers,
+        timeout=args.timeout,
+        output_format=args.output_format,
+        compression=args.compression,
+        deduplicator=deduplicator,
+        index_fn=index_fn,
+    )
+    os.makedirs(args.output_dir, exist_ok=True)
+    with open(os.path.join(args.output_dir, "ingest_summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=4)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,13 @@
 import os
 import sys
 import json
+import time
+import sqlite3
+import hashlib
 import logging
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 from nltk.translate.bleu_score import sentence_bleu
 from nltk.tokenize import word_tokenize
@@ -36,22 +42,291 @@ except ImportError as e:
 # 3. 日志配置
 logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# 默认的生成结果检查点，重新运行时跳过已完成的问题
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output", "text2sql_generations.jsonl")
+# 本地 SQLite 版 Sakila，用于执行准确率；参考SQL的执行结果缓存在 REFERENCE_CACHE_PATH 中跨运行复用
+DEFAULT_SAKILA_DB_PATH = os.path.join(project_root, "90-文档-Data", "sakila", "sakila.db")
+REFERENCE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output", "sakila_reference_results.json")
+# 跨运行的SQL生成缓存，只修改指标代码时直接复用已有的生成结果
+DEFAULT_GENERATION_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output", "text2sql_generation_cache.db")
+
 # 4. 评估函数
 def normalize_sql(sql):
     """规范化SQL语句：小写，去除首尾空格"""
     return sql.lower().strip()
 
+@lru_cache(maxsize=None)
+def tokenize(sql):
+    """分词结果缓存，BLEU 和召回率共用同一次分词"""
+    return tuple(word_tokenize(sql))
+
 def calculate_token_recall(reference, candidate):
     """计算基于词符的召回率"""
-    ref_tokens = set(word_tokenize(reference))
-    can_tokens = set(word_tokenize(candidate))
+    ref_tokens = set(tokenize(reference))
+    can_tokens = set(tokenize(candidate))
     if not ref_tokens:
         return 1.0 if not can_tokens else 0.0
     
     true_positives = len(ref_tokens.intersection(can_tokens))
     return true_positives / len(ref_tokens)
 
-def evaluate_text2sql():
+def _normalize_value(value):
+    """统一结果中的数值表示，避免 1 与 1.0、浮点误差导致结果集哈希不同"""
+    if isinstance(value, float):
+        value = round(value, 6)
+        return int(value) if value.is_integer() else value
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+def result_set_hash(rows):
+    """与行顺序无关的结果集哈希：行内值归一化后按行排序再计算哈希"""
+    normalized = sorted(json.dumps([_normalize_value(v) for v in row], default=str) for row in rows)
+    return hashlib.sha1("\n".join(normalized).encode('utf-8')).hexdigest()
+
+def execute_sql(db_path, sql, timeout=5.0):
+    """
+    在只读的 SQLite 数据库上执行SQL，返回 {"status": ok/error/timeout, "hash", "rows", "error"}。
+    通过 progress_handler 检查截止时间，超时的查询会被中断而不会拖慢整个评估。
+    """
+    if not sql.strip():
+        return {"status": "error", "hash": None, "rows": 0, "error": "empty sql"}
+    deadline = time.monotonic() + timeout
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+    try:
+        rows = conn.execute(sql).fetchall()
+        return {"status": "ok", "hash": result_set_hash(rows), "rows": len(rows), "error": None}
+    except sqlite3.OperationalError as e:
+        status = "timeout" if time.monotonic() > deadline else "error"
+        return {"status": status, "hash": None, "rows": 0, "error": str(e)}
+    except sqlite3.Error as e:
+        return {"status": "error", "hash": None, "rows": 0, "error": str(e)}
+    finally:
+        conn.close()
+
+def _reference_cache_key(db_path, sql):
+    """参考结果缓存键：数据库文件（大小、修改时间）与规范化后的SQL"""
+    stat = os.stat(db_path)
+    payload = f"{os.path.abspath(db_path)}|{stat.st_size}|{stat.st_mtime_ns}|{sql}"
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def execution_accuracy(reference_sqls, generated_sqls, db_path=DEFAULT_SAKILA_DB_PATH, workers=8, timeout=5.0,
+                       cache_path=REFERENCE_CACHE_PATH):
+    """
+    计算执行准确率：在本地 SQLite Sakila 上并行执行参考SQL和生成SQL，结果集（忽略行顺序）相同即视为正确。
+    参考SQL的执行结果按 (数据库文件, SQL) 缓存，数据库不变时后续运行只需执行生成的SQL。
+
+    注意：生成的SQL若使用 MySQL 特有的语法或函数，在 SQLite 上会执行失败并计为错误。
+
+    Returns:
+        (执行准确率, 每条样本的执行详情列表)
+    """
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+
+    ref_keys = [_reference_cache_key(db_path, sql) for sql in reference_sqls]
+    missing = {key: sql for key, sql in zip(ref_keys, reference_sqls) if key not in cache}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # sqlite3 执行查询时释放 GIL，每个线程使用独立的连接即可并行
+        ref_futures = {key: executor.submit(execute_sql, db_path, sql, timeout) for key, sql in missing.items()}
+        gen_futures = [executor.submit(execute_sql, db_path, sql, timeout) for sql in generated_sqls]
+        for key, future in ref_futures.items():
+            cache[key] = future.result()
+        gen_results = [future.result() for future in tqdm(gen_futures, desc="执行进度")]
+
+    if missing and cache_path:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+
+    details = []
+    correct = 0
+    for key, gen_result in zip(ref_keys, gen_results):
+        ref_result = cache[key]
+        if ref_result["status"] != "ok":
+            logging.warning(f"参考SQL执行失败: {ref_result['error']}")
+        match = ref_result["status"] == "ok" and gen_result["status"] == "ok" and ref_result["hash"] == gen_result["hash"]
+        correct += match
+        details.append({"match": match, "reference": ref_result, "generated": gen_result})
+    accuracy = correct / len(details) if details else 0.0
+    return accuracy, details
+
+def percentile(values, q):
+    """计算百分位数（线性插值），values 为空时返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+def generate_one(index, question):
+    """为单个问题生成SQL（不执行），返回包含耗时和错误信息的记录；在线程或子进程中运行"""
+    started = time.perf_counter()
+    try:
+        generated_sql = normalize_sql(text2sql(question, execute=False))
+        error = None
+    except Exception as e:
+        generated_sql = "" # 如果出错，视为空字符串
+        error = str(e)
+    return {
+        "index": index,
+        "question": question,
+        "generated_sql": generated_sql,
+        "latency": time.perf_counter() - started,
+        "error": error,
+    }
+
+def module_fingerprint(module):
+    """被评估模块源文件的哈希；修改 text2sql 的代码或提示词后指纹变化，旧的生成结果自动失效"""
+    with open(module.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def generation_config_key(model_version):
+    """生成配置标识：模型/提示词版本 + 模块指纹"""
+    return hashlib.sha1(f"{model_version}|{module_fingerprint(text2sql_module)}".encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    """
+    text2sql 生成结果的持久化缓存（SQLite），键为 (问题, 生成配置标识)。
+    只缓存成功的生成；只在主线程中读写。
+    """
+    def __init__(self, cache_path, config_key):
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(cache_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "question TEXT, config_key TEXT, generated_sql TEXT, latency REAL, created_at REAL, "
+            "PRIMARY KEY (question, config_key))"
+        )
+        self.config_key = config_key
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question):
+        row = self.conn.execute(
+            "SELECT generated_sql, latency FROM generations WHERE question = ? AND config_key = ?",
+            (question, self.config_key),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"generated_sql": row[0], "latency": row[1]}
+
+    def put(self, question, generated_sql, latency):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)",
+            (question, self.config_key, generated_sql, latency, time.time()),
+        )
+        self.conn.commit()
+
+    def invalidate(self, all_configs=False):
+        """删除当前配置（all_configs=True 时为全部配置）的缓存，返回删除的条数"""
+        if all_configs:
+            cursor = self.conn.execute("DELETE FROM generations")
+        else:
+            cursor = self.conn.execute("DELETE FROM generations WHERE config_key = ?", (self.config_key,))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def close(self):
+        self.conn.close()
+
+def load_checkpoint(checkpoint_path):
+    """读取检查点中已完成的记录（按题号），忽略中断时写了一半的最后一行"""
+    records = {}
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return records
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["index"]] = record
+    return records
+
+def generate_sqls(test_data, workers=4, executor_type="thread", checkpoint_path=DEFAULT_CHECKPOINT_PATH,
+                  resume=True, retry_errors=True, cache=None, config_key=None):
+    """
+    并行生成测试集的SQL，每完成一条立即追加写入 JSONL 检查点，重新运行时从中断处继续。
+
+    Args:
+        test_data: 测试数据列表，每项包含 question 和 sql
+        workers: 并发数
+        executor_type: "thread" 使用线程池（适合调用远程模型），"process" 使用进程池（适合本地计算密集的生成）
+        checkpoint_path: 检查点文件路径，为空时不保存
+        resume: 是否复用检查点中已有的结果
+        retry_errors: 是否重新生成检查点中出错的问题
+        cache: 跨运行的 GenerationCache，命中的问题不再调用 text2sql
+        config_key: 生成配置标识，检查点中配置不同的记录不会被复用
+
+    Returns:
+        按测试集顺序排列的记录列表，每条包含 generated_sql、latency 和 error
+    """
+    records = load_checkpoint(checkpoint_path) if resume else {}
+    # 测试集变化后题号对应的问题可能不同，只复用问题和生成配置都一致的记录
+    records = {
+        index: record for index, record in records.items()
+        if index < len(test_data) and record.get("question") == test_data[index]['question']
+        and record.get("config_key") == config_key
+        and not (retry_errors and record.get("error"))
+    }
+    pending = [index for index in range(len(test_data)) if index not in records]
+    if records:
+        print(f"从检查点恢复 {len(records)} 条结果，剩余 {len(pending)} 条待生成。")
+
+    cached_records = []
+    if cache is not None and pending:
+        for index in pending:
+            cached = cache.get(test_data[index]['question'])
+            if cached is not None:
+                records[index] = {"index": index, "question": test_data[index]['question'], **cached,
+                                  "error": None, "cached": True, "config_key": config_key}
+                cached_records.append(records[index])
+        pending = [index for index in pending if index not in records]
+        print(f"生成缓存: {cache.stats()}")
+
+    if checkpoint_path:
+        os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    mode = 'a' if resume else 'w'
+    with (open(checkpoint_path, mode, encoding='utf-8') if checkpoint_path else open(os.devnull, 'w')) as checkpoint:
+        # 缓存命中的记录同样写入检查点，全部命中缓存时检查点也是完整的
+        for record in cached_records:
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+        checkpoint.flush()
+        if pending:
+            executor_cls = ProcessPoolExecutor if executor_type == "process" else ThreadPoolExecutor
+            with executor_cls(max_workers=workers) as executor:
+                futures = [executor.submit(generate_one, index, test_data[index]['question']) for index in pending]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="生成进度"):
+                    record = future.result()
+                    record["config_key"] = config_key
+                    if record["error"]:
+                        logging.error(f"处理问题 '{record['question']}' 时发生错误: {record['error']}")
+                    elif cache is not None:
+                        cache.put(record["question"], record["generated_sql"], record["latency"])
+                    records[record["index"]] = record
+                    # 只在主线程写检查点，每条记录写完立即刷新，崩溃时最多丢失正在生成的问题
+                    checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+
+    return [records[index] for index in range(len(test_data))]
+
+def evaluate_text2sql(workers=4, executor_type="thread", checkpoint_path=DEFAULT_CHECKPOINT_PATH, resume=True,
+                      sakila_db_path=DEFAULT_SAKILA_DB_PATH, sql_timeout=5.0,
+                      generation_cache_path=DEFAULT_GENERATION_CACHE_PATH, model_version="default",
+                      invalidate_cache=False):
     """评估 text2sql RAG 系统的性能"""
     # 加载测试数据
     test_data_path = os.path.join(project_root, "90-文档-Data", "sakila", "q2sql_pairs.json")
@@ -62,26 +337,27 @@ def evaluate_text2sql():
         logging.error(f"测试数据文件未找到: {test_data_path}")
         return
 
-    generated_sqls = []
-    reference_sqls = []
-    
     print(f"开始评估，共 {len(test_data)} 条测试数据...")
 
-    # 遍历测试集
-    for item in tqdm(test_data, desc="评估进度"):
-        question = item['question']
-        ground_truth_sql = normalize_sql(item['sql'])
-        
-        try:
-            # 获取模型生成的SQL，不执行
-            generated_sql = text2sql(question, execute=False)
-            generated_sql = normalize_sql(generated_sql)
-        except Exception as e:
-            logging.error(f"处理问题 '{question}' 时发生错误: {e}")
-            generated_sql = "" # 如果出错，视为空字符串
-            
-        generated_sqls.append(generated_sql)
-        reference_sqls.append(ground_truth_sql)
+    # 生成配置标识：模型/提示词版本或 text2sql 模块代码变化后，缓存和检查点中的旧结果不再复用
+    config_key = generation_config_key(model_version)
+    cache = GenerationCache(generation_cache_path, config_key) if generation_cache_path else None
+    if invalidate_cache:
+        if cache is not None:
+            print(f"已清除 {cache.invalidate()} 条生成缓存。")
+        # 检查点中同一配置的记录同样需要失效，否则清除缓存后仍会直接复用
+        resume = False
+
+    # 并行生成SQL（不执行），结果写入检查点
+    try:
+        records = generate_sqls(test_data, workers, executor_type, checkpoint_path, resume,
+                                cache=cache, config_key=config_key)
+    finally:
+        if cache is not None:
+            cache.close()
+    generated_sqls = [record["generated_sql"] for record in records]
+    reference_sqls = [normalize_sql(item['sql']) for item in test_data]
+    latencies = [record["latency"] for record in records]
 
     # 5. 计算指标
     exact_matches = 0
@@ -94,8 +370,8 @@ def evaluate_text2sql():
             exact_matches += 1
         
         # BLEU 分数
-        ref_tokens = word_tokenize(ref)
-        gen_tokens = word_tokenize(gen)
+        ref_tokens = list(tokenize(ref))
+        gen_tokens = list(tokenize(gen))
         bleu = sentence_bleu([ref_tokens], gen_tokens)
         bleu_scores.append(bleu)
         
@@ -114,8 +390,54 @@ def evaluate_text2sql():
     
     avg_recall = (sum(recall_scores) / len(recall_scores))
     print(f"平均词符召回率 (Token Recall): {avg_recall:.4f}")
+
+    # 执行准确率
+    if sakila_db_path and os.path.exists(sakila_db_path):
+        exec_accuracy, details = execution_accuracy(reference_sqls, generated_sqls, sakila_db_path,
+                                                    workers=max(workers, 4), timeout=sql_timeout)
+        status_counts = {}
+        for detail in details:
+            status = detail["generated"]["status"]
+            status_counts[status] = status_counts.get(status, 0) + 1
+        print(f"执行准确率 (Execution Accuracy): {exec_accuracy * 100:.2f}%  生成SQL执行状态: {status_counts}")
+    else:
+        logging.warning(f"未找到 SQLite 版 Sakila 数据库，跳过执行准确率: {sakila_db_path}")
+
+    errors = sum(1 for record in records if record["error"])
+    print(f"生成失败: {errors} 条")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"生成缓存命中: {stats['hits']} 条, 未命中: {stats['misses']} 条 (命中率 {stats['hit_rate'] * 100:.1f}%)")
+    print(f"生成耗时 p50: {percentile(latencies, 50):.2f}s, p95: {percentile(latencies, 95):.2f}s")
     print("------------------")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="评估 text2sql RAG 系统")
+    parser.add_argument("--workers", type=int, default=4, help="并发生成的线程/进程数")
+    parser.add_argument("--executor", default="thread", choices=["thread", "process"], help="并发方式")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="生成结果检查点 (JSONL) 路径")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有检查点，全部重新生成")
+    parser.add_argument("--sakila-db", default=DEFAULT_SAKILA_DB_PATH, help="SQLite 版 Sakila 数据库路径，用于执行准确率")
+    parser.add_argument("--sql-timeout", type=float, default=5.0, help="单条SQL的最长执行时间（秒）")
+    parser.add_argument("--generation-cache", default=DEFAULT_GENERATION_CACHE_PATH, help="SQL生成缓存路径")
+    parser.add_argument("--no-generation-cache", action="store_true", help="不使用SQL生成缓存")
+    parser.add_argument("--invalidate-cache", action="store_true", help="清除当前配置的SQL生成缓存并忽略检查点，全部重新生成")
+    parser.add_argument("--model-version", default=os.getenv("TEXT2SQL_MODEL_VERSION", "default"),
+                        help="模型/提示词版本标识，更换模型或提示词时修改该值以区分缓存")
+    return parser.parse_args()
+
 # 7. 程序入口
 if __name__ == "__main__":
-    evaluate_text2sql() 
\ No newline at end of file
+    args = parse_args()
+    evaluate_text2sql(
+        workers=args.workers,
+        executor_type=args.executor,
+        checkpoint_path=args.checkpoint,
+        resume=not args.no_resume,
+        sakila_db_path=args.sakila_db,
+        sql_timeout=args.sql_timeout,
+        generation_cache_path=None if args.no_generation_cache else args.generation_cache,
+        model_version=args.model_version,
+        invalidate_cache=args.invalidate_cache,
+    )
+ 
\ No newline at end of file
@@ -1,11 +1,18 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field, ConfigDict
 from services.std_service import StdService
 from services.abbr_service import AbbrService
 from services.corr_service import CorrService
+from utils.single_flight import get_single_flight, make_key, single_flight_metrics
+from utils.llm_router import get_llm_router
+from utils.profiling import ProfilingConfig, current_profile, profiled, start_profile, stop_profile
 from typing import List, Dict, Optional, Literal, Union, Any
+import argparse
+import asyncio
 import logging
+import os
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -21,14 +28,50 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
 
+# 请求剖析：按 PROFILE_SAMPLE_RATE 抽样，或请求头 X-Profile: 1 加有效的 X-Admin-Token，最慢的 PROFILE_KEEP 个保存在 PROFILE_DIR
+profiling = ProfilingConfig.from_env()
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """剖析命中的请求，保存的剖析 id 通过响应头 X-Profile-Id 返回"""
+    path = request.url.path
+    requested = None
+    if path.startswith("/api/") and not path.startswith("/api/admin/"):
+        requested = profiling.should_profile(request.headers.get("X-Profile"), request.headers.get("X-Admin-Token"))
+    if requested is None:
+        return await call_next(request)
+
+    token = start_profile(request.method, path, requested)
+    profile = current_profile()
+    try:
+        response = await call_next(request)
+    finally:
+        stop_profile(token)
+    profile.finish(response.status_code)
+    try:
+        if await asyncio.to_thread(profiling.store.save, profile):
+            response.headers["X-Profile-Id"] = profile.profile_id
+    except Exception as e:
+        logger.error(f"Failed to save profile {profile.profile_id}: {str(e)}")
+    return response
+
+# 向量数据库文件目录
+DB_DIR = "/home/train/rag-finance-nlp-box/backend/db"
+
 # 初始化各个服务
 # ner_service = NERService()  # 命名实体识别服务
 # standardization_service = StdService()  # 术语标准化服务
 abbr_service = AbbrService()  # 缩写扩展服务
 corr_service = CorrService()  # 拼写纠正服务
 
+# 合并并发的相同请求：同一时刻的相同请求只计算一次，共享结果
+std_flight = get_single_flight("std")
+abbr_flight = get_single_flight("abbr")
+corr_flight = get_single_flight("corr")
+
 # 基础模型类
 class BaseInputModel(BaseModel):
     """基础输入模型，包含所有模型共享的字段"""
@@ -72,6 +115,19 @@ class TextInput(BaseInputModel):
         default_factory=EmbeddingOptions,
         description="向量数据库配置选项"
     )
+    collections: List[EmbeddingOptions] = Field(
+        default_factory=list,
+        description="需要同时检索的多个集合；非空时忽略 embeddingOptions，并发检索后合并排序"
+    )
+    limit: int = Field(
+        default=5,
+        description="返回结果的最大数量",
+        ge=1
+    )
+    sources: List[str] = Field(
+        default_factory=list,
+        description="只在这些来源/领域的术语中检索，为空时检索全部术语"
+    )
 
 class AbbrInput(BaseInputModel):
     """缩写扩展输入模型"""
@@ -89,6 +145,32 @@ class AbbrInput(BaseInputModel):
         description="向量数据库配置选项"
     )
 
+class AbbrBatchItem(BaseModel):
+    """批量缩写扩展中的单个条目"""
+    text: str = Field(..., description="缩写")
+    context: str = Field(
+        default="",
+        description="上下文信息"
+    )
+
+class AbbrBatchInput(BaseInputModel):
+    """批量缩写扩展输入模型"""
+    items: List[AbbrBatchItem] = Field(..., description="需要扩展的缩写及其上下文")
+    embeddingOptions: EmbeddingOptions = Field(
+        default_factory=EmbeddingOptions,
+        description="向量数据库配置选项"
+    )
+    tokenBudget: int = Field(
+        default=3000,
+        description="单个 LLM 提示词的 token 预算，条目按预算打包",
+        ge=500
+    )
+    limit: int = Field(
+        default=5,
+        description="每个扩展返回的标准术语数量",
+        ge=1
+    )
+
 class ErrorOptions(BaseModel):
     """错误生成选项"""
     probability: float = Field(
@@ -119,6 +201,41 @@ class CorrInput(BaseInputModel):
         description="错误生成选项"
     )
 
+def _standardize(input: TextInput):
+    """术语标准化的同步实现，在线程池中执行，避免阻塞事件循环"""
+    if input.collections:
+        # 多集合：并发检索，合并去重后统一排序
+        services = StdService.create_many([
+            {
+                "provider": options.provider,
+                "model": options.model,
+                "db_path": f"{DB_DIR}/{options.dbName}.db",
+                "collection_name": options.collectionName
+            } for options in input.collections
+        ])
+        std_result = StdService.fan_out_search(services, input.text, limit=input.limit, sources=input.sources)
+    else:
+        # 获取（首次使用时初始化）共享的标准化服务
+        standardization_service = StdService.get_shared(
+            provider=input.embeddingOptions.provider,
+            model=input.embeddingOptions.model,
+            db_path=f"{DB_DIR}/{input.embeddingOptions.dbName}.db",
+            collection_name=input.embeddingOptions.collectionName
+        )
+        std_result = standardization_service.search_similar_terms(
+            input.text, limit=input.limit, sources=input.sources
+        )
+
+    standardized_results = [{
+        "original_term": input.text,
+        "standardized_results": std_result
+    }]
+
+    return {
+        "message": "1 term has been standardized",
+        "standardized_terms": standardized_results
+    }
+
 # API 端点：术语标准化
 @app.post("/api/std")
 async def standardization(input: TextInput):
@@ -126,29 +243,12 @@ async def standardization(input: TextInput):
         # 记录请求信息
         logger.info(f"Received request: text={input.text}, embeddingOptions={input.embeddingOptions}")
 
-        # 初始化标准化服务
-        standardization_service = StdService(
-            provider=input.embeddingOptions.provider,
-            model=input.embeddingOptions.model,
-            db_path=f"/home/train/rag-finance-nlp-box/backend/db/{input.embeddingOptions.dbName}.db",
-            collection_name=input.embeddingOptions.collectionName
-        )
-
         # 直接对输入文本进行标准化
         if not input.text.strip():
             return {"message": "Input text is empty", "standardized_terms": []}
 
-        std_result = standardization_service.search_similar_terms(input.text)
-        
-        standardized_results = [{
-            "original_term": input.text,
-            "standardized_results": std_result
-        }]
-
-        return {
-            "message": "1 term has been standardized",
-            "standardized_terms": standardized_results
-        }
+        key = make_key("std", input.model_dump())
+        return await std_flight.do(key, lambda: asyncio.to_thread(profiled, _standardize, input))
 
     except Exception as e:
         logger.error(f"Error in standardization processing: {str(e)}")
@@ -159,43 +259,171 @@ async def standardization(input: TextInput):
 async def correct_notes(input: CorrInput):
     try:
         if input.method == "correct_spelling":  # 拼写纠正
-            return corr_service.correct_spelling(input.text, input.llmOptions)
-        elif input.method == "add_mistakes":  # 添加错误（测试用）
-            return corr_service.add_mistakes(input.text, input.errorOptions)
+            key = make_key("corr", input.method, input.text, input.llmOptions)
+            return await corr_flight.do(
+                key, lambda: asyncio.to_thread(profiled, corr_service.correct_spelling, input.text, input.llmOptions)
+            )
+        elif input.method == "add_mistakes":  # 添加错误（测试用，结果随机，不合并）
+            return await asyncio.to_thread(profiled, corr_service.add_mistakes, input.text, input.errorOptions)
         else:
             raise HTTPException(status_code=400, detail="Invalid method")
     except Exception as e:
         logger.error(f"Error in correction processing: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _expand_abbreviations(input: AbbrInput):
+    """缩写扩展的同步实现，在线程池中执行，避免阻塞事件循环"""
+    if input.method == "simple_ollama":  # 简单扩展
+        output = abbr_service.simple_ollama_expansion(input.text, input.llmOptions)
+        return {"input": input.text, "output": output}
+    elif input.method == "query_db_llm_rerank":  # 数据库查询+重排序
+        return abbr_service.query_db_llm_rerank(
+            input.text, 
+            input.context, 
+            input.llmOptions,
+            input.embeddingOptions
+        )
+    elif input.method == "llm_rank_query_db":  # LLM扩展+数据库标准化
+        return abbr_service.llm_rank_query_db(
+            input.text, 
+            input.context, 
+            input.llmOptions,
+            input.embeddingOptions
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Invalid method")
+
 # API 端点：缩写扩展
 @app.post("/api/abbr")
 async def expand_abbreviations(input: AbbrInput):
     try:
-        if input.method == "simple_ollama":  # 简单扩展
-            output = abbr_service.simple_ollama_expansion(input.text, input.llmOptions)
-            return {"input": input.text, "output": output}
-        elif input.method == "query_db_llm_rerank":  # 数据库查询+重排序
-            return abbr_service.query_db_llm_rerank(
-                input.text, 
-                input.context, 
-                input.llmOptions,
-                input.embeddingOptions
-            )
-        elif input.method == "llm_rank_query_db":  # LLM扩展+数据库标准化
-            return abbr_service.llm_rank_query_db(
-                input.text, 
-                input.context, 
-                input.llmOptions,
-                input.embeddingOptions
-            )
-        else:
-            raise HTTPException(status_code=400, detail="Invalid method")
+        key = make_key("abbr", input.model_dump())
+        return await abbr_flight.do(key, lambda: asyncio.to_thread(profiled, _expand_abbreviations, input))
     except Exception as e:
         logger.error(f"Error in abbreviation expansion: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# API 端点：批量缩写扩展
+@app.post("/api/abbr/batch")
+async def expand_abbreviations_batch(input: AbbrBatchInput):
+    try:
+        if not input.items:
+            return {"items": [], "llm_calls": 0, "method": "batch_llm_db"}
+        key = make_key("abbr_batch", input.model_dump())
+        return await abbr_flight.do(key, lambda: asyncio.to_thread(
+            profiled,
+            abbr_service.batch_llm_rank_query_db,
+            [item.model_dump() for item in input.items],
+            input.llmOptions,
+            input.embeddingOptions,
+            token_budget=input.tokenBudget,
+            limit=input.limit
+        ))
+    except Exception as e:
+        logger.error(f"Error in batch abbreviation expansion: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# API 端点：运行指标
+@app.get("/api/metrics")
+async def metrics():
+    """返回请求合并统计（每个端点的调用数、实际执行数和被合并的调用数）、缩写重排序门控统计和 LLM 路由统计"""
+    return {
+        "single_flight": single_flight_metrics(),
+        "rerank_gate": abbr_service.rerank_gate.stats(),
+        "llm_router": get_llm_router().stats()
+    }
+
+def _check_admin(request: Request):
+    """管理端点要求请求头 X-Admin-Token 与 PROFILE_ADMIN_TOKEN 一致；未设置 PROFILE_ADMIN_TOKEN 时管理端点关闭"""
+    if not profiling.admin_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiling.is_admin(request.headers.get("X-Admin-Token")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+# 管理端点：已保存的请求剖析
+@app.get("/api/admin/profiles")
+async def list_profiles(request: Request):
+    """列出已保存的剖析（按耗时降序）"""
+    _check_admin(request)
+    return {
+        "profiles": await asyncio.to_thread(profiling.store.list),
+        "keep": profiling.store.keep,
+        "sample_rate": profiling.sample_rate
+    }
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """返回剖析的阶段时间线和 cProfile 统计文本"""
+    _check_admin(request)
+    try:
+        return await asyncio.to_thread(profiling.store.get, profile_id)
+    except (KeyError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+
+@app.get("/api/admin/profiles/{profile_id}/download")
+async def download_profile(profile_id: str, request: Request):
+    """下载 cProfile 的 pstats 文件，可用 snakeviz 或 pstats 模块查看"""
+    _check_admin(request)
+    try:
+        path = profiling.store.prof_path(profile_id)
+    except KeyError:
+        path = None
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profile not found: {profile_id}")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+def run_multi_worker(args):
+    """
+    多 worker 模式：先启动独立的向量化服务进程加载嵌入模型，再启动多个 uvicorn worker，
+    各 worker 通过 Unix socket 调用向量化服务，嵌入模型在整个节点上只加载一份
+    """
+    import multiprocessing
+    import uvicorn
+    from utils.embedding_server import serve, wait_for_server
+
+    if not os.getenv("MILVUS_URI"):
+        logger.warning("Milvus Lite database files cannot be opened by multiple processes; "
+                       "set MILVUS_URI to a Milvus server when running with --workers > 1")
+
+    # worker 进程继承该环境变量，EmbeddingFactory 据此改用 RemoteEmbeddings
+    os.environ["EMBEDDING_SERVER_SOCKET"] = args.embedding_socket
+    embedding_server = multiprocessing.get_context("spawn").Process(
+        target=serve,
+        args=(args.embedding_socket, args.embedding_batch_size, args.embedding_wait_ms, args.preload),
+        name="embedding-server",
+        daemon=True
+    )
+    embedding_server.start()
+    if not wait_for_server(args.embedding_socket, process=embedding_server):
+        embedding_server.terminate()
+        raise RuntimeError(f"Embedding server failed to start on {args.embedding_socket}")
+    logger.info(f"Embedding server ready on {args.embedding_socket}, starting {args.workers} API workers")
+
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        embedding_server.terminate()
+        embedding_server.join()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="金融术语处理后端服务")
+    parser.add_argument("--host", default="0.0.0.0", help="监听地址")
+    parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="API worker 进程数；大于 1 时嵌入模型由独立的向量化服务进程加载，各 worker 共用")
+    parser.add_argument("--embedding-socket", default=os.getenv("EMBEDDING_SERVER_SOCKET", "/tmp/finance_embedding.sock"),
+                        help="向量化服务的 Unix socket 路径")
+    parser.add_argument("--embedding-batch-size", type=int, default=64, help="向量化服务单个批次的最大文本数")
+    parser.add_argument("--embedding-wait-ms", type=float, default=5.0, help="向量化服务凑批的最长等待时间（毫秒）")
+    parser.add_argument("--preload", nargs="*", default=["huggingface:BAAI/bge-m3"],
+                        help="向量化服务启动时预先加载的模型，格式为 provider:model")
+    return parser.parse_args()
+
 # 启动服务器
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    args = parse_args()
+    if args.workers > 1:
+        run_multi_worker(args)
+    else:
+        import uvicorn
+        uvicorn.run(app, host=args.host, port=args.port)
@@ -1,9 +1,11 @@
-from langchain_community.llms import Ollama
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
-from typing import Dict
-from services.std_service import StdService
-import os
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from services.std_service import StdService, normalize_distance
+from utils.rerank_gate import RerankGate
+from utils.llm_router import get_llm_router
+from utils.batch_prompt import pack_by_token_budget, parse_batch_expansions
+import json
 import logging
 
 # 配置日志
@@ -18,11 +20,11 @@ class AbbrService:
     2. LLM 生成 + 数据库查询：更准确但较慢
     """
     def __init__(self):
-        self.std_service = None  # 按需初始化标准化服务
+        self.rerank_gate = RerankGate.from_env()  # 重排序门控，置信度足够时跳过 LLM
         
     def _get_std_service(self, embedding_options: dict) -> StdService:
         """
-        获取或创建标准化服务实例
+        获取标准化服务实例（进程内按集合共享，可被并发请求同时使用）
         
         Args:
             embedding_options: 嵌入模型配置选项，包含：
@@ -38,7 +40,7 @@ class AbbrService:
             ValueError: 当标准化服务初始化失败时
         """
         try:
-            return StdService(
+            return StdService.get_shared(
                 provider=embedding_options.provider,
                 model=embedding_options.model,
                 db_path=f"/home/train/rag-finance-nlp-box/backend/db/{embedding_options.dbName}.db",
@@ -51,6 +53,7 @@ class AbbrService:
     def _get_llm(self, llm_options: dict):
         """
         根据配置获取语言模型实例
+        调用经 LLMRouter 路由：多个 Ollama 实例轮询，带截止时间、对冲请求和故障端点摘除
         
         Args:
             llm_options: 语言模型配置选项，包含：
@@ -65,17 +68,7 @@ class AbbrService:
         """
         provider = llm_options.get("provider", "openai")
         model = llm_options.get("model", "gpt-4o-mini")
-        
-        if provider == "ollama":
-            return Ollama(model=model, base_url="http://192.168.0.75:11434")
-        elif provider == "openai":
-            return ChatOpenAI(
-                model=model,
-                temperature=0,
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-        else:
-            raise ValueError(f"Unsupported LLM provider: {provider}")
+        return get_llm_router().bind(provider, model)
         
     def simple_ollama_expansion(self, text: str, llm_options: dict) -> Dict:
         """
@@ -140,7 +133,7 @@ class AbbrService:
         """
         try:
             # 获取标准化服务实例
-            self.std_service = self._get_std_service(embedding_options)
+            std_service = self._get_std_service(embedding_options)
             
             # 使用 LLM 生成扩展
             llm = self._get_llm(llm_options)
@@ -156,7 +149,7 @@ class AbbrService:
             expansion_text = expansion_result.content if hasattr(expansion_result, 'content') else str(expansion_result)
             
             # 在数据库中查找相似的标准术语
-            std_terms = self.std_service.search_similar_terms(expansion_text)
+            std_terms = std_service.search_similar_terms(expansion_text)
             
             return {
                 "input": text,
@@ -169,23 +162,148 @@ class AbbrService:
             logger.error(f"Error in llm_rank_query_db: {str(e)}")
             raise ValueError(f"Failed to process abbreviation expansion: {str(e)}")
 
+    def _expand_batch(self, llm, items: List[Dict], indices: List[int]) -> Dict[int, str]:
+        """用一次 LLM 调用扩展一组缩写，返回 {下标: 扩展}；解析不到的条目不在结果中，LLM 调用失败时抛出异常"""
+        batch_prompt = ChatPromptTemplate.from_messages([
+            ("system", "Given financial abbreviations and their contexts, provide the most likely expansion of each abbreviation based on common financial usage."),
+            ("system", "Return ONLY a JSON array with one object per input item, in the form [{{\"id\": <id>, \"expansion\": \"<expansion>\"}}]. Do not add any other text."),
+            ("human", "{items}")
+        ])
+        payload = json.dumps(
+            [{"id": index, "abbreviation": items[index]["text"], "context": items[index].get("context", "")}
+             for index in indices],
+            ensure_ascii=False
+        )
+        result = (batch_prompt | llm).invoke({"items": payload})
+        output = result.content if hasattr(result, 'content') else str(result)
+        expansions = parse_batch_expansions(output)
+        return {index: expansion for index, expansion in expansions.items() if index in indices and expansion}
+
+    def batch_llm_rank_query_db(self, items: List[Dict], llm_options: dict, embedding_options: dict,
+                                token_budget: int = 3000, limit: int = 5, max_workers: int = 4,
+                                max_retries: int = 5) -> Dict:
+        """
+        批量版 `llm_rank_query_db`：按 token 预算把多个 (缩写, 上下文) 打包进少量结构化提示词，
+        解析每个条目的扩展后，用一次批量向量检索完成全部标准化
+
+        Args:
+            items: 条目列表，每项包含 text（缩写）和 context（上下文）
+            llm_options: 语言模型配置选项
+            embedding_options: 嵌入模型配置选项
+            token_budget: 单个提示词的 token 预算
+            limit: 每个扩展返回的标准术语数量
+            max_workers: 并发执行的提示词数量
+            max_retries: LLM 调用成功但输出中缺失的条目，最多逐个重试的数量；调用本身失败的批次不重试
+
+        Returns:
+            {
+                "items": 与输入顺序一致的结果，每项包含 input, context, expansion, standardized_terms（调用或解析失败时含 error）,
+                "llm_calls": LLM 调用次数,
+                "method": "batch_llm_db"
+            }
+        """
+        try:
+            std_service = self._get_std_service(embedding_options)
+            llm = self._get_llm(llm_options)
+
+            batches = pack_by_token_budget(
+                [{"abbreviation": item["text"], "context": item.get("context", "")} for item in items], token_budget
+            )
+            expansions: Dict[int, str] = {}
+            errors: Dict[int, str] = {}
+            llm_calls = len(batches)
+
+            def run_batch(indices: List[int]):
+                try:
+                    return indices, self._expand_batch(llm, items, indices), None
+                except Exception as e:
+                    logger.error(f"Batch expansion of {len(indices)} items failed: {str(e)}")
+                    return indices, {}, e
+
+            def collect(outcomes) -> List[Exception]:
+                call_errors = []
+                for indices, result, error in outcomes:
+                    expansions.update(result)
+                    if error is not None:
+                        call_errors.append(error)
+                        errors.update({index: f"LLM call failed: {str(error)}" for index in indices})
+                return call_errors
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                call_errors = collect(executor.map(run_batch, batches))
+                if batches and len(call_errors) == len(batches):
+                    # 所有调用都失败（如 LLM 不可用），逐个重试同样会失败
+                    raise call_errors[0]
+
+                # 调用成功但输出中缺失的条目逐个重试一次，数量有上限
+                missing = [index for index in range(len(items)) if index not in expansions and index not in errors]
+                retry = missing[:max(max_retries, 0)]
+                if missing:
+                    logger.warning(f"{len(missing)} items missing from batched expansions, "
+                                   f"retrying {len(retry)} individually")
+                    llm_calls += len(retry)
+                    collect(executor.map(run_batch, [[index] for index in retry]))
+
+            # 一次批量检索完成全部标准化
+            resolved = sorted(expansions)
+            search_results = std_service.search_batch([expansions[index] for index in resolved], limit=limit)
+            std_terms = dict(zip(resolved, search_results))
+
+            results = []
+            for index, item in enumerate(items):
+                entry = {
+                    "input": item["text"],
+                    "context": item.get("context", ""),
+                    "expansion": expansions.get(index),
+                    "standardized_terms": std_terms.get(index, [])
+                }
+                if index not in expansions:
+                    entry["error"] = errors.get(index, "Failed to parse expansion from LLM output")
+                results.append(entry)
+
+            return {"items": results, "llm_calls": llm_calls, "method": "batch_llm_db"}
+        except Exception as e:
+            logger.error(f"Error in batch_llm_rank_query_db: {str(e)}")
+            raise ValueError(f"Failed to process batch abbreviation expansion: {str(e)}")
+
     def query_db_llm_rerank(self, text: str, context: str, llm_options: dict, embedding_options: dict) -> Dict:
         """
         先在数据库中查找，然后使用 LLM 对结果进行重排序
+        首个候选的相似度和相对其余候选的分差都超过门控阈值时直接采用，不调用 LLM
+
+        Returns:
+            包含候选列表和最佳扩展的字典，其中 rerank_path 为 "gate"（直接采用首个候选）或 "llm"，
+            gate 为门控的判断依据（首个候选分数、分差和原因）
         """
         try:
             # 获取标准化服务实例
-            self.std_service = self._get_std_service(embedding_options)
+            std_service = self._get_std_service(embedding_options)
             
             # 在数据库中查找相似术语
-            # 这是一个示例，您需要实现具体的逻辑
-            similar_terms = self.std_service.search_similar_terms(text, top_k=10)
-            
+            similar_terms = std_service.search_similar_terms(text, limit=10)
+            for term in similar_terms:
+                term["score"] = normalize_distance(term["distance"], std_service.metric_type)
+            similar_terms.sort(key=lambda term: term["score"], reverse=True)
+
+            # 置信度门控：首个候选足够确定时跳过 LLM
+            decision = self.rerank_gate.decide(similar_terms)
+            if decision.accept:
+                logger.info(f"Rerank gate accepted top candidate for '{text}': {decision.to_dict()}")
+                return {
+                    "input": text,
+                    "context": context,
+                    "candidates": [term['term'] for term in similar_terms],
+                    "best_expansion": similar_terms[0]['term'],
+                    "method": "db_llm_rerank",
+                    "rerank_path": "gate",
+                    "gate": decision.to_dict()
+                }
+
             # 使用 LLM 进行重排序
             llm = self._get_llm(llm_options)
             
             # 构建提示
-            candidates = "\n".join([f"- {term['entity']['term']}" for term in similar_terms])
+            candidates = "\n".join([f"- {term['term']}" for term in similar_terms])
             rerank_prompt = ChatPromptTemplate.from_messages([
                 ("system", "You are an expert in medical terminology. Given an abbreviation, its context, and a list of candidate expansions, choose the most likely expansion."),
                 ("human", f"Abbreviation: {text}\nContext: {context}\n\nCandidate Expansions:\n{candidates}\n\nWhich is the most likely expansion?")
@@ -198,9 +316,11 @@ class AbbrService:
             return {
                 "input": text,
                 "context": context,
-                "candidates": [term['entity']['term'] for term in similar_terms],
+                "candidates": [term['term'] for term in similar_terms],
                 "best_expansion": best_expansion,
-                "method": "db_llm_rerank"
+                "method": "db_llm_rerank",
+                "rerank_path": "llm",
+                "gate": decision.to_dict()
             }
         except Exception as e:
             logger.error(f"Error in query_db_llm_rerank: {str(e)}")
@@ -1,8 +1,6 @@
-from langchain_community.llms import Ollama
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from typing import Dict
-import os
+from utils.llm_router import get_llm_router
 import logging
 
 # 配置日志
@@ -20,6 +18,7 @@ class CorrService:
     def _get_llm(self, llm_options: dict):
         """
         根据配置获取语言模型实例
+        调用经 LLMRouter 路由，带截止时间、对冲请求和故障端点摘除
         
         Args:
             llm_options: 语言模型配置选项
@@ -32,15 +31,7 @@ class CorrService:
         """
         provider = llm_options.get("provider", "openai")
         model = llm_options.get("model", "gpt-4o-mini")
-        
-        if provider == "openai":
-            return ChatOpenAI(
-                model=model,
-                temperature=0,
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
-        else:
-            raise ValueError(f"Unsupported LLM provider: {provider}")
+        return get_llm_router().bind(provider, model)
         
     def correct_spelling(self, text: str, llm_options: dict) -> Dict:
         """
@@ -2,8 +2,13 @@ from pymilvus import MilvusClient
 from dotenv import load_dotenv
 from utils.embedding_factory import EmbeddingFactory
 from utils.embedding_config import EmbeddingProvider, EmbeddingConfig
-from typing import List, Dict
+from utils.milvus_partitions import source_partition_name, source_filter_expr
+from utils.profiling import stage
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import contextvars
 import logging
+import threading
 import os
 
 # Configure logging
@@ -12,56 +17,110 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# 进程内共享的服务实例和 embedding 函数，见 `StdService.get_shared`
+_shared_services: Dict[tuple, "StdService"] = {}
+_shared_embeddings: Dict[str, object] = {}
+_shared_lock = threading.Lock()
+
+
+def normalize_distance(distance: float, metric_type: str) -> float:
+    """
+    将不同度量下的距离统一映射为 [0, 1] 区间的相似度分数（越大越相似）
+
+    Args:
+        distance: Milvus 返回的距离
+        metric_type: 集合向量索引的度量方式 (COSINE/IP/L2)
+
+    Returns:
+        归一化后的相似度分数
+    """
+    metric_type = (metric_type or "COSINE").upper()
+    if metric_type in ("COSINE", "IP"):
+        # 余弦相似度（以及归一化向量上的内积）取值 [-1, 1]
+        return max(0.0, min(1.0, (distance + 1.0) / 2.0))
+    if metric_type == "L2":
+        return 1.0 / (1.0 + max(distance, 0.0))
+    raise ValueError(f"Unsupported metric type: {metric_type}")
+
+
 class StdService:
     """
     医学术语标准化服务
     使用向量数据库进行医学术语的标准化和相似度搜索
     """
-    def __init__(self, 
+    def __init__(self,
                  provider="huggingface",
                  model="BAAI/bge-m3",
                  db_path="/home/train/rag-finance-nlp-box/backend/db/finance_bge_m3.db",
-                 collection_name="finance_terms_bge_m3"):
+                 collection_name="finance_terms_bge_m3",
+                 embedding_func=None):
         """
         初始化标准化服务
-        
+
         Args:
             provider: 嵌入模型提供商 (openai/huggingface)
             model: 使用的模型名称
-            db_path: Milvus 数据库路径
+            db_path: Milvus 数据库路径，设置环境变量 MILVUS_URI 时被忽略
             collection_name: 集合名称
+            embedding_func: 已创建好的 embedding 函数，多个集合使用同一模型时可共享，避免重复加载
         """
         # 根据 provider 字符串匹配正确的枚举值
         provider_mapping = {
             'openai': EmbeddingProvider.OPENAI,
             'huggingface': EmbeddingProvider.HUGGINGFACE
         }
-        
+
         # 创建 embedding 函数
         embedding_provider = provider_mapping.get(provider.lower())
         if embedding_provider is None:
             raise ValueError(f"Unsupported provider: {provider}")
-            
+
+        # 设置 EMBEDDING_STORE_DIR 后，只读使用入库脚本写入的内容寻址向量存储，已向量化的文本不再重复计算；
+        # 在线服务不写入存储，避免请求路径上的文件锁和 fsync，以及用户输入让存储无限增长
         config = EmbeddingConfig(
             provider=embedding_provider,
-            model_name=model
+            model_name=model,
+            store_dir=os.getenv("EMBEDDING_STORE_DIR"),
+            store_read_only=True
         )
-        
-        # 连接 Milvus
-        self.client = MilvusClient(db_path)
-        self.collection_name = collection_name
-        self.client.load_collection(self.collection_name)
-        
-        self.embedding_func = EmbeddingFactory.create_embedding_function(config)
+        self.provider = provider.lower()
+        self.model = model
+        self.db_path = db_path
+
+        # 连接 Milvus；设置 MILVUS_URI 时连接独立部署的 Milvus 服务（多 worker 模式下 Milvus Lite 文件不能被多个进程同时打开）
+        with stage("milvus.connect"):
+            self.client = MilvusClient(os.getenv("MILVUS_URI") or db_path)
+            self.collection_name = collection_name
+            self.client.load_collection(self.collection_name)
+            self.metric_type = self._get_metric_type()
+            self.partitions = set(self.client.list_partitions(self.collection_name))
+
+        with stage("embedding.load"):
+            self.embedding_func = embedding_func or EmbeddingFactory.create_embedding_function(config)
+
+    @property
+    def model_key(self) -> str:
+        """嵌入模型标识，相同标识的服务可以共用查询向量"""
+        return f"{self.provider}:{self.model}"
+
+    def _get_metric_type(self) -> str:
+        """读取集合向量索引的度量方式，读取失败时按入库脚本的默认值 COSINE 处理"""
+        try:
+            index_info = self.client.describe_index(self.collection_name, index_name="vector")
+            return (index_info or {}).get("metric_type") or "COSINE"
+        except Exception as e:
+            logger.warning(f"Failed to describe index of {self.collection_name}, assuming COSINE: {str(e)}")
+            return "COSINE"
 
-    def search_similar_terms(self, query: str, limit: int = 5) -> List[Dict]:
+    def search_similar_terms(self, query: str, limit: int = 5, sources: Optional[List[str]] = None) -> List[Dict]:
         """
         搜索与查询文本相似的金融术语
-        
+
         Args:
             query: 查询文本
             limit: 返回结果的最大数量
-            
+            sources: 只在这些来源的术语中搜索，为空时搜索全部术语
+
         Returns:
             包含相似术语信息的列表，每个术语包含：
             - term: 术语
@@ -69,33 +128,191 @@ class StdService:
             - distance: 相似度距离
         """
         # 获取查询的向量表示
-        query_embedding = self.embedding_func.embed_query(query)
-        
+        with stage("embed"):
+            query_embedding = self.embedding_func.embed_query(query)
+        return self.search_by_vector(query_embedding, limit, sources)
+
+    def _source_restriction(self, sources: Optional[List[str]]) -> Dict:
+        """
+        构造按来源限定检索范围的参数：
+        所有来源都有对应分区时只搜索这些分区，否则退化为 source 过滤表达式
+        """
+        if not sources:
+            return {}
+        partition_names = [source_partition_name(source) for source in sources]
+        if all(name in self.partitions for name in partition_names):
+            return {"partition_names": partition_names}
+        return {"filter": source_filter_expr(sources)}
+
+    def search_by_vector(self, query_embedding: List[float], limit: int = 5,
+                         sources: Optional[List[str]] = None) -> List[Dict]:
+        """
+        使用已计算好的查询向量搜索相似术语，参数和返回格式同 `search_similar_terms`
+        """
+        return self._search_vectors([query_embedding], limit, sources)[0]
+
+    def search_batch(self, queries: List[str], limit: int = 5, sources: Optional[List[str]] = None) -> List[List[Dict]]:
+        """
+        批量搜索：一次向量化所有查询文本，并用一次检索请求完成全部查询
+
+        Args:
+            queries: 查询文本列表
+            limit: 每个查询返回结果的最大数量
+            sources: 只在这些来源的术语中搜索，为空时搜索全部术语
+
+        Returns:
+            与 queries 顺序一致的结果列表，每项格式同 `search_similar_terms`
+        """
+        if not queries:
+            return []
+        # 检索所用的嵌入模型（bge-m3）查询与文档使用相同的编码方式，可以批量向量化
+        with stage("embed"):
+            query_embeddings = self.embedding_func.embed_documents(queries)
+        return self._search_vectors(query_embeddings, limit, sources)
+
+    def _search_vectors(self, query_embeddings: List[List[float]], limit: int,
+                        sources: Optional[List[str]]) -> List[List[Dict]]:
         # 设置搜索参数
         search_params = {
             "collection_name": self.collection_name,
-            "data": [query_embedding],
+            "data": query_embeddings,
             "limit": limit,
             "output_fields": [
                 "term", "source"
             ],
-            # "filter": "domain_id == 'Condition'"
+            **self._source_restriction(sources)
         }
-        
+
         # 搜索相似项
-        search_result = self.client.search(**search_params)
+        with stage("milvus.search"):
+            search_result = self.client.search(**search_params)
 
         results = []
-        for hit in search_result[0]:
-            results.append({
+        for hits in search_result:
+            results.append([{
                 "term": hit['entity'].get('term'),
                 "source": hit['entity'].get('source'),
                 "distance": float(hit['distance'])
-            })
+            } for hit in hits])
 
         return results
 
-    def __del__(self):
-        """清理资源，释放集合"""
-        if hasattr(self, 'client') and hasattr(self, 'collection_name'):
-            self.client.release_collection(self.collection_name)
\ No newline at end of file
+    @classmethod
+    def get_shared(cls, provider: str, model: str, db_path: str, collection_name: str) -> "StdService":
+        """
+        获取进程内按 (provider, model, db_path, collection_name) 共享的服务实例
+
+        模型加载和 Milvus 连接只在第一次使用时执行一次，使用相同嵌入模型的集合共享同一个 embedding 函数。
+        实例只读，可以被并发的请求同时使用。
+        """
+        key = (provider.lower(), model, db_path, collection_name)
+        with _shared_lock:
+            service = _shared_services.get(key)
+            if service is None:
+                service = cls(
+                    provider=provider,
+                    model=model,
+                    db_path=db_path,
+                    collection_name=collection_name,
+                    embedding_func=_shared_embeddings.get(f"{provider.lower()}:{model}")
+                )
+                _shared_embeddings.setdefault(service.model_key, service.embedding_func)
+                _shared_services[key] = service
+            return service
+
+    @classmethod
+    def create_many(cls, targets: List[Dict]) -> List["StdService"]:
+        """
+        获取多个集合的标准化服务（进程内共享实例），使用相同嵌入模型的集合共享同一个 embedding 函数
+
+        Args:
+            targets: 集合配置列表，每项包含 provider, model, db_path, collection_name
+
+        Returns:
+            与 targets 顺序一致的服务列表
+        """
+        return [
+            cls.get_shared(
+                provider=target['provider'],
+                model=target['model'],
+                db_path=target['db_path'],
+                collection_name=target['collection_name']
+            ) for target in targets
+        ]
+
+    @staticmethod
+    def fan_out_search(services: List["StdService"], query: str, limit: int = 5,
+                       sources: Optional[List[str]] = None, max_workers: Optional[int] = None) -> List[Dict]:
+        """
+        并发检索多个集合，并合并为一个去重后的排序结果
+
+        相同嵌入模型的集合只计算一次查询向量；不同度量下的距离先归一化为 [0, 1] 的相似度分数，
+        同一术语（忽略大小写和首尾空格）出现在多个集合中时保留分数最高的一条，并记录全部来源。
+
+        Args:
+            services: 需要检索的标准化服务列表
+            query: 查询文本
+            limit: 返回结果的最大数量（每个集合也最多取 limit 条）
+            sources: 只在这些来源的术语中搜索，为空时搜索全部术语
+            max_workers: 并发线程数，默认为集合数量
+
+        Returns:
+            合并后的术语列表，每个术语包含：
+            - term: 术语
+            - source: 来源
+            - distance: 最佳命中的原始距离
+            - score: 归一化后的相似度分数
+            - provenance: 命中该术语的所有集合及其距离和分数
+        """
+        if not services:
+            return []
+
+        # 每个嵌入模型只计算一次查询向量
+        embedders = {}
+        for service in services:
+            embedders.setdefault(service.model_key, service.embedding_func)
+
+        def embed(func):
+            with stage("embed"):
+                return func.embed_query(query)
+
+        # 在调用方的上下文中执行，使请求剖析能记录线程池中的阶段
+        with ThreadPoolExecutor(max_workers=max_workers or len(services)) as executor:
+            embedding_futures = {
+                key: executor.submit(contextvars.copy_context().run, embed, func) for key, func in embedders.items()
+            }
+            search_futures = [
+                (service, executor.submit(
+                    contextvars.copy_context().run,
+                    lambda s: s.search_by_vector(embedding_futures[s.model_key].result(), limit, sources), service))
+                for service in services
+            ]
+
+            merged: Dict[str, Dict] = {}
+            for service, future in search_futures:
+                try:
+                    hits = future.result()
+                except Exception as e:
+                    logger.error(f"Search failed for collection {service.collection_name}: {str(e)}")
+                    continue
+                for hit in hits:
+                    score = normalize_distance(hit["distance"], service.metric_type)
+                    provenance = {
+                        "db_path": service.db_path,
+                        "collection_name": service.collection_name,
+                        "model": service.model,
+                        "metric_type": service.metric_type,
+                        "distance": hit["distance"],
+                        "score": score
+                    }
+                    key = (hit["term"] or "").strip().lower()
+                    entry = merged.get(key)
+                    if entry is None:
+                        merged[key] = {**hit, "score": score, "provenance": [provenance]}
+                        continue
+                    entry["provenance"].append(provenance)
+                    if score > entry["score"]:
+                        entry.update({**hit, "score": score})
+
+        results = sorted(merged.values(), key=lambda item: item["score"], reverse=True)
+        return results[:limit]
\ No newline at end of file
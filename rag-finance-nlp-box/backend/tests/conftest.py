@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与运行服务时相同，以 backend 目录为根导入 services、utils 模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
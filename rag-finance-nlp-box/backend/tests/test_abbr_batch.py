@@ -0,0 +1,78 @@
+import json
+import re
+import threading
+
+import pytest
+
+# 依赖 pymilvus 等服务端依赖，未安装时跳过
+abbr_service = pytest.importorskip("services.abbr_service")
+AbbrService = abbr_service.AbbrService
+
+
+class FakeLLM:
+    """按请求中的条目 id 返回扩展；drop 中的 id 不出现在输出里，fail 为 True 时调用报错"""
+
+    def __init__(self, drop=(), fail=False, fail_single=False):
+        self.drop = set(drop)
+        self.fail = fail
+        self.fail_single = fail_single
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt_value):
+        text = prompt_value.to_string()
+        ids = [int(value) for value in re.findall(r'"id": (\d+)', text)]
+        with self._lock:
+            self.calls.append(ids)
+        if self.fail or (self.fail_single and len(ids) == 1):
+            raise ConnectionError("llm unavailable")
+        return json.dumps([{"id": i, "expansion": f"expansion {i}"} for i in ids if i not in self.drop])
+
+
+class FakeStdService:
+    def search_batch(self, texts, limit=5):
+        return [[{"term": text}] for text in texts]
+
+
+def _service(monkeypatch, llm):
+    from langchain_core.runnables import RunnableLambda
+
+    service = AbbrService.__new__(AbbrService)
+    monkeypatch.setattr(service, "_get_std_service", lambda options: FakeStdService(), raising=False)
+    monkeypatch.setattr(service, "_get_llm", lambda options: RunnableLambda(llm), raising=False)
+    return service
+
+
+def _items(count):
+    return [{"text": f"A{i}", "context": "ctx"} for i in range(count)]
+
+
+def test_missing_items_are_retried_individually(monkeypatch):
+    llm = FakeLLM(drop={1})
+    result = _service(monkeypatch, llm).batch_llm_rank_query_db(_items(3), {}, {})
+    # 首次批量输出缺失 1，逐个重试时 1 仍被丢弃
+    assert llm.calls == [[0, 1, 2], [1]]
+    assert result["llm_calls"] == 2
+    assert [item["expansion"] for item in result["items"]] == ["expansion 0", None, "expansion 2"]
+    assert result["items"][1]["error"] == "Failed to parse expansion from LLM output"
+
+
+def test_individual_retries_are_capped(monkeypatch):
+    llm = FakeLLM(drop=set(range(10)))
+    result = _service(monkeypatch, llm).batch_llm_rank_query_db(_items(10), {}, {}, max_retries=3)
+    assert result["llm_calls"] == 4
+    assert sorted(ids for ids in llm.calls if len(ids) == 1) == [[0], [1], [2]]
+
+
+def test_failed_batch_call_is_not_retried_per_item(monkeypatch):
+    llm = FakeLLM(fail=True)
+    with pytest.raises(ValueError, match="llm unavailable"):
+        _service(monkeypatch, llm).batch_llm_rank_query_db(_items(5), {}, {})
+    assert len(llm.calls) == 1
+
+
+def test_failed_retry_reports_call_error(monkeypatch):
+    llm = FakeLLM(drop={0}, fail_single=True)
+    result = _service(monkeypatch, llm).batch_llm_rank_query_db(_items(2), {}, {})
+    assert result["items"][0]["error"] == "LLM call failed: llm unavailable"
+    assert result["items"][1]["expansion"] == "expansion 1"
@@ -0,0 +1,42 @@
+import json
+
+from utils.batch_prompt import BATCH_PROMPT_OVERHEAD_TOKENS, count_tokens, pack_by_token_budget, parse_batch_expansions
+
+
+def _cost(index, item):
+    return count_tokens(json.dumps({"id": index, **item}, ensure_ascii=False))
+
+
+def test_pack_keeps_every_batch_within_budget():
+    items = [{"abbreviation": f"ABB{i}", "context": "营业收入同比增长" * (i % 4)} for i in range(30)]
+    budget = BATCH_PROMPT_OVERHEAD_TOKENS + 60
+    batches = pack_by_token_budget(items, budget)
+    assert [index for batch in batches for index in batch] == list(range(len(items)))
+    for batch in batches:
+        if len(batch) > 1:
+            assert BATCH_PROMPT_OVERHEAD_TOKENS + sum(_cost(i, items[i]) for i in batch) <= budget
+
+
+def test_pack_puts_oversized_item_in_its_own_batch():
+    items = [{"abbreviation": "A"}, {"abbreviation": "B", "context": "x" * 3000}, {"abbreviation": "C"}]
+    assert pack_by_token_budget(items, BATCH_PROMPT_OVERHEAD_TOKENS + 50) == [[0], [1], [2]]
+
+
+def test_pack_empty():
+    assert pack_by_token_budget([], 100) == []
+
+
+def test_parse_ignores_code_fences_and_surrounding_text():
+    output = 'Sure:\n```json\n[{"id": 0, "expansion": " Earnings Per Share "}, {"id": "2", "expansion": "净利润"}]\n```'
+    assert parse_batch_expansions(output) == {0: "Earnings Per Share", 2: "净利润"}
+
+
+def test_parse_skips_malformed_entries():
+    output = '[{"id": 0}, {"id": "x", "expansion": "a"}, {"expansion": "b"}, 3, {"id": 1, "expansion": "ROE"}]'
+    assert parse_batch_expansions(output) == {1: "ROE"}
+
+
+def test_parse_returns_empty_for_invalid_output():
+    assert parse_batch_expansions("no json here") == {}
+    assert parse_batch_expansions("[not valid json]") == {}
+    assert parse_batch_expansions('{"id": 0, "expansion": "a"}') == {}
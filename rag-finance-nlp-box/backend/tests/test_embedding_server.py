@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from utils.embedding_server import EmbeddingServer, batch_query_fn
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.document_calls = []
+        self.query_calls = 0
+
+    def embed_documents(self, texts):
+        self.document_calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.query_calls += 1
+        return [float(len(text)), 1.0]
+
+
+class InstructEmbeddings(CountingEmbeddings):
+    query_instruction = "query: "
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = EmbeddingServer(str(tmp_path / "embedding.sock"), max_batch_size=64, max_wait=0.05,
+                             bind_and_activate=False)
+    yield server
+    server.server_close()
+
+
+def test_query_batch_is_one_model_call(server):
+    embeddings = CountingEmbeddings()
+    server._models[("huggingface", "m")] = embeddings
+    batcher = server.get_batcher("huggingface", "m", "query")
+
+    start = threading.Barrier(8)
+    results = [None] * 8
+
+    def submit(i):
+        start.wait()
+        results[i] = batcher.submit([f"q{'x' * i}"]).result()
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert embeddings.query_calls == 0
+    assert len(embeddings.document_calls) == batcher.batches
+    assert batcher.batches == 1
+    assert [result[0][0] for result in results] == [float(i + 1) for i in range(8)]
+
+
+def test_query_instruction_is_prepended():
+    embeddings = InstructEmbeddings()
+    batch_query_fn(embeddings)(["a", "b"])
+    assert embeddings.document_calls == [["query: a", "query: b"]]
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from utils.embedding_store import DOCUMENT, QUERY, EmbeddingStore, get_shared_store
+
+
+def _embed(texts):
+    return [[float(len(text)), float(i), 0.5] for i, text in enumerate(texts)]
+
+
+def test_round_trip_across_instances(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "bge-m3", "e")
+    store.put_many(["净利润", "ROE"], [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    reopened = EmbeddingStore(str(tmp_path), "bge-m3", "e")
+    assert reopened.dim == 3 and len(reopened) == 2
+    first, missing, second = reopened.get_many(["净利润", "EPS", "ROE"])
+    assert missing is None
+    np.testing.assert_array_equal(first, [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(second, [4.0, 5.0, 6.0])
+
+
+def test_existing_and_duplicate_texts_are_not_rewritten(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "m", "e")
+    store.put_many(["a", "a", "b"], [[1.0], [2.0], [3.0]])
+    store.put_many(["a", "c"], [[9.0], [4.0]])
+    assert len(store) == 3
+    np.testing.assert_array_equal(store.get_many(["a"])[0], [1.0])
+
+
+def test_embed_only_computes_misses(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "m", "e")
+    store.put_many(["a"], [[1.0, 1.0, 1.0]])
+    calls = []
+    vectors = store.embed(["a", "bb", "bb"], lambda texts: calls.append(list(texts)) or _embed(texts))
+    assert calls == [["bb"]]
+    np.testing.assert_array_equal(vectors[0], [1.0, 1.0, 1.0])
+    np.testing.assert_array_equal(vectors[1], vectors[2])
+    assert len(store) == 2
+
+
+def test_read_only_embed_does_not_write(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "m", "e")
+    store.embed(["query"], _embed, write=False)
+    assert len(store) == 0
+    assert EmbeddingStore(str(tmp_path), "m", "e").get_many(["query"]) == [None]
+
+
+def test_reader_sees_rows_appended_by_other_writer(tmp_path):
+    reader = EmbeddingStore(str(tmp_path), "m", "e")
+    writer = EmbeddingStore(str(tmp_path), "m", "e")
+    writer.put_many(["a"], [[1.0, 2.0]])
+    assert reader.get_many(["a"])[0] is not None
+
+
+def test_partial_trailing_row_is_ignored_and_overwritten(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "m", "e")
+    store.put_many(["a"], [[1.0, 2.0]])
+    # 模拟写入向量后、写入键之前崩溃
+    with open(store._vectors_path, "ab") as f:
+        f.write(np.asarray([7.0], dtype=np.float32).tobytes())
+    reopened = EmbeddingStore(str(tmp_path), "m", "e")
+    assert len(reopened) == 1
+    reopened.put_many(["b"], [[3.0, 4.0]])
+    np.testing.assert_array_equal(EmbeddingStore(str(tmp_path), "m", "e").get_many(["b"])[0], [3.0, 4.0])
+
+
+def test_model_and_dimension_are_checked(tmp_path):
+    EmbeddingStore(str(tmp_path), "m", "e").put_many(["a"], [[1.0, 2.0]])
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), "m", "e", dim=3)
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), "m", "e").put_many(["b"], [[1.0, 2.0, 3.0]])
+
+
+def test_shared_store_is_reused(tmp_path):
+    assert get_shared_store(str(tmp_path), "m", "e") is get_shared_store(str(tmp_path / "."), "m", "e")
+
+
+def test_query_and_document_vectors_do_not_collide(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "m", "e")
+    store.put_many(["净利润"], [[1.0, 0.0]], kind=DOCUMENT)
+    assert store.get_many(["净利润"], kind=QUERY) == [None]
+    store.put_many(["净利润"], [[0.0, 1.0]], kind=QUERY)
+    np.testing.assert_array_equal(store.get_many(["净利润"], kind=DOCUMENT)[0], [1.0, 0.0])
+    np.testing.assert_array_equal(store.get_many(["净利润"], kind=QUERY)[0], [0.0, 1.0])
+
+
+def test_embedders_are_kept_apart(tmp_path):
+    EmbeddingStore(str(tmp_path), "m", "pymilvus-sentence-transformer").put_many(["a"], [[1.0, 2.0]])
+    assert EmbeddingStore(str(tmp_path), "m", "langchain-huggingface").get_many(["a"]) == [None]
+
+
+def test_store_written_by_other_embedder_is_refused(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "m", "e")
+    store.put_many(["a"], [[1.0, 2.0]])
+    with open(store._meta_path, "w", encoding="utf-8") as f:
+        f.write('{"model": "m", "embedder": "other", "dim": 2, "dtype": "float32"}')
+    with pytest.raises(ValueError, match="embedder"):
+        EmbeddingStore(str(tmp_path), "m", "e")
@@ -0,0 +1,100 @@
+import pytest
+
+# 依赖 pymilvus、langchain_huggingface 等服务端依赖，未安装时跳过
+std_service = pytest.importorskip("services.std_service")
+StdService = std_service.StdService
+normalize_distance = std_service.normalize_distance
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [0.0]
+
+
+class FakeService:
+    """只提供 fan_out_search 用到的属性"""
+
+    def __init__(self, collection_name, metric_type, hits, embedding_func, model="m", error=None):
+        self.collection_name = collection_name
+        self.metric_type = metric_type
+        self.hits = hits
+        self.embedding_func = embedding_func
+        self.model = model
+        self.model_key = f"huggingface:{model}"
+        self.db_path = "db"
+        self.error = error
+
+    def search_by_vector(self, vector, limit, sources):
+        if self.error:
+            raise self.error
+        return self.hits[:limit]
+
+
+def _hit(term, distance, source="src"):
+    return {"term": term, "source": source, "distance": distance}
+
+
+@pytest.mark.parametrize("metric_type, distance, expected", [
+    ("COSINE", 1.0, 1.0),
+    ("COSINE", 0.0, 0.5),
+    ("COSINE", -1.0, 0.0),
+    ("IP", 0.6, 0.8),
+    ("IP", 1.2, 1.0),
+    ("L2", 0.0, 1.0),
+    ("L2", 1.0, 0.5),
+    ("L2", -0.1, 1.0),
+    (None, 0.0, 0.5),
+    ("cosine", 1.0, 1.0),
+])
+def test_normalize_distance(metric_type, distance, expected):
+    assert normalize_distance(distance, metric_type) == pytest.approx(expected)
+
+
+def test_normalize_distance_rejects_unknown_metric():
+    with pytest.raises(ValueError):
+        normalize_distance(0.5, "HAMMING")
+
+
+def test_merge_keeps_best_score_and_records_provenance():
+    embeddings = FakeEmbeddings()
+    cosine = FakeService("a", "COSINE", [_hit("Net Income", 0.8), _hit("Revenue", 0.2)], embeddings)
+    l2 = FakeService("b", "L2", [_hit(" net income ", 0.1, "other")], embeddings)
+    results = StdService.fan_out_search([cosine, l2], "净利润", limit=5)
+
+    assert [item["term"] for item in results] == [" net income ", "Revenue"]
+    best = results[0]
+    assert best["score"] == pytest.approx(1 / 1.1)
+    assert best["source"] == "other"
+    assert [(p["collection_name"], p["metric_type"]) for p in best["provenance"]] == [("a", "COSINE"), ("b", "L2")]
+    assert best["provenance"][0]["score"] == pytest.approx(0.9)
+    # 同一嵌入模型只计算一次查询向量
+    assert embeddings.calls == 1
+
+
+def test_results_are_sorted_and_truncated_to_limit():
+    embeddings = FakeEmbeddings()
+    first = FakeService("a", "COSINE", [_hit(f"t{i}", 0.1 * i) for i in reversed(range(5))], embeddings)
+    second = FakeService("b", "COSINE", [_hit(f"u{i}", 0.1 * i + 0.05) for i in reversed(range(5))], embeddings)
+    results = StdService.fan_out_search([first, second], "q", limit=3)
+    assert [item["term"] for item in results] == ["u4", "t4", "u3"]
+
+
+def test_failed_collection_is_skipped():
+    embeddings = FakeEmbeddings()
+    ok = FakeService("a", "COSINE", [_hit("Revenue", 0.5)], embeddings)
+    broken = FakeService("b", "COSINE", [], embeddings, error=ConnectionError("down"))
+    assert [item["term"] for item in StdService.fan_out_search([ok, broken], "q")] == ["Revenue"]
+
+
+def test_each_embedding_model_embeds_once():
+    first, second = FakeEmbeddings(), FakeEmbeddings()
+    services = [FakeService("a", "COSINE", [], first, model="m1"),
+                FakeService("b", "COSINE", [], first, model="m1"),
+                FakeService("c", "COSINE", [], second, model="m2")]
+    assert StdService.fan_out_search(services, "q") == []
+    assert (first.calls, second.calls) == (1, 1)
+    assert StdService.fan_out_search([], "q") == []
@@ -0,0 +1,135 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.ingest_pipeline import run_ingest_pipeline
+
+
+class Sink:
+    """记录写入批次的插入阶段；fail_times 中的批次在前 N 次调用时报错"""
+
+    def __init__(self, fail_times=None, error=ConnectionError):
+        self.fail_times = dict(fail_times or {})
+        self.error = error
+        self.batches = []
+        self.calls = 0
+
+    def __call__(self, batch, embeddings):
+        self.calls += 1
+        key = batch[0]
+        if self.fail_times.get(key, 0) > 0:
+            self.fail_times[key] -= 1
+            raise self.error(f"insert {key} failed")
+        assert embeddings == [[float(len(text))] for text in batch]
+        self.batches.append(list(batch))
+        return len(batch)
+
+
+def _batches(count, size=3):
+    return [[f"b{i}-{j}" for j in range(size)] for i in range(count)]
+
+
+def _embed(texts):
+    return [[float(len(text))] for text in texts]
+
+
+def _run(batches, sink, embed_fn=_embed, workers=2, timeout=10.0, **kwargs):
+    """在单独线程中运行流水线，超时视为卡死"""
+    outcome = {}
+
+    def target():
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                outcome["report"] = run_ingest_pipeline(batches, lambda batch: batch, embed_fn, sink, executor,
+                                                        max_inflight=workers, retry_backoff=0.01, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline hung"
+    assert not [t for t in threading.enumerate() if t.name.startswith("ingest-")], "stage threads left running"
+    return outcome
+
+
+def test_out_of_order_embedding_completes_every_batch():
+    def slow_embed(texts):
+        time.sleep(random.uniform(0, 0.02))
+        return _embed(texts)
+
+    batches = _batches(20)
+    sink = Sink()
+    report = _run(batches, sink, slow_embed, workers=4, queue_size=2)["report"]
+    assert sorted(map(tuple, sink.batches)) == sorted(map(tuple, batches))
+    assert report.inserted_rows == 60
+    assert [stage.rows for stage in report.stages] == [60, 60, 60]
+    assert sum(stage.failed_batches for stage in report.stages) == 0
+
+
+def test_failed_embed_and_insert_are_retried():
+    embed_failures = {"b1-0": 1}
+
+    def flaky_embed(texts):
+        if embed_failures.get(texts[0], 0):
+            embed_failures[texts[0]] -= 1
+            raise TimeoutError("embed timeout")
+        return _embed(texts)
+
+    sink = Sink(fail_times={"b3-0": 2})
+    report = _run(_batches(5), sink, flaky_embed, max_retries=2)["report"]
+    embed, insert = report.stages[1], report.stages[2]
+    assert (embed.retries, embed.failed_batches) == (1, 0)
+    assert (insert.retries, insert.failed_batches) == (2, 0)
+    assert report.inserted_rows == 15
+
+
+def test_batch_failing_after_max_retries_is_recorded_and_skipped():
+    sink = Sink(fail_times={"b2-0": 10})
+    report = _run(_batches(5), sink, max_retries=2)["report"]
+    insert = report.stages[2]
+    assert insert.failed_batches == 1
+    assert insert.retries == 2
+    assert sink.calls == 4 + 3
+    assert report.inserted_rows == 12
+
+
+def test_reader_error_propagates_without_hanging():
+    def batches():
+        for batch in _batches(3):
+            yield batch
+        raise OSError("csv read failed")
+
+    outcome = _run(batches(), Sink())
+    assert isinstance(outcome["error"], OSError)
+
+
+def test_fatal_insert_error_propagates_and_stops_upstream_stages():
+    class Fatal(BaseException):
+        pass
+
+    # 队列很小、批次很多：读取和向量化线程此时阻塞在已满的队列上，必须能随流水线停止退出
+    sink = Sink(fail_times={"b1-0": 1}, error=Fatal)
+    outcome = _run(_batches(200), sink, queue_size=1, max_retries=3)
+    assert isinstance(outcome["error"], Fatal)
+    assert len(sink.batches) == 1
+
+
+def test_embed_error_after_max_retries_skips_only_that_batch():
+    def failing_embed(texts):
+        if texts[0] == "b0-0":
+            raise ValueError("bad input")
+        return _embed(texts)
+
+    report = _run(_batches(4), Sink(), failing_embed, max_retries=1)["report"]
+    assert report.stages[1].failed_batches == 1
+    assert report.inserted_rows == 9
+
+
+@pytest.mark.parametrize("queue_size", [1, 4])
+def test_empty_input(queue_size):
+    report = _run([], Sink(), queue_size=queue_size)["report"]
+    assert report.inserted_rows == 0
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from utils.llm_router import LLMRouter, parse_fallback
+
+
+class FakeLLM:
+    """按固定延迟返回或报错的模型"""
+
+    def __init__(self, name, delay=0.0, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+
+    def invoke(self, input, config=None):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return f"{self.name}:{input}"
+
+
+def _router(models, fallback=None, **kwargs):
+    """models: {base_url 或 "provider:model": FakeLLM}"""
+    urls = [key for key in models if key.startswith("http")]
+    router = LLMRouter(ollama_base_urls=urls, fallback=fallback, **kwargs)
+    router._create_llm = lambda provider, model, base_url=None: models[base_url or f"{provider}:{model}"]
+    return router
+
+
+def test_fast_primary_is_used_without_hedging():
+    router = _router({"http://a": FakeLLM("a"), "http://b": FakeLLM("b")}, hedge_delay=1.0)
+    assert router.invoke("ollama", "m", "q") == "a:q"
+    assert router.invoke("ollama", "m", "q") == "b:q"  # 轮询
+    stats = router.stats()
+    assert (stats["calls"], stats["hedges"], stats["hedge_wins"], stats["failovers"]) == (2, 0, 0, 0)
+
+
+def test_slow_primary_is_hedged_and_hedge_win_counted():
+    router = _router({"http://a": FakeLLM("a", delay=0.5), "http://b": FakeLLM("b")}, hedge_delay=0.05)
+    start = time.monotonic()
+    assert router.invoke("ollama", "m", "q") == "b:q"
+    assert time.monotonic() - start < 0.4
+    stats = router.stats()
+    assert (stats["hedges"], stats["hedge_wins"], stats["failovers"]) == (1, 1, 0)
+
+
+def test_failover_win_is_not_counted_as_hedge_win():
+    router = _router({"http://a": FakeLLM("a", error=ConnectionError("down")), "http://b": FakeLLM("b")},
+                     hedge_delay=1.0)
+    assert router.invoke("ollama", "m", "q") == "b:q"
+    stats = router.stats()
+    assert (stats["hedges"], stats["hedge_wins"], stats["failovers"]) == (0, 0, 1)
+
+
+def test_fallback_provider_used_when_primary_fails():
+    router = _router({"http://a": FakeLLM("a", error=ConnectionError("down")), "openai:gpt": FakeLLM("fallback")},
+                     fallback=("openai", "gpt"), hedge_delay=0)
+    assert router.invoke("ollama", "m", "q") == "fallback:q"
+
+
+def test_all_endpoints_failing_raises_last_error():
+    router = _router({"http://a": FakeLLM("a", error=ConnectionError("a down")),
+                      "http://b": FakeLLM("b", error=ConnectionError("b down"))}, hedge_delay=0)
+    with pytest.raises(ConnectionError):
+        router.invoke("ollama", "m", "q")
+
+
+def test_deadline_exceeded_raises_timeout():
+    router = _router({"http://a": FakeLLM("a", delay=0.5)}, deadline=0.05, hedge_delay=0)
+    with pytest.raises(TimeoutError):
+        router.invoke("ollama", "m", "q")
+    assert router.stats()["deadline_exceeded"] == 1
+
+
+def test_failing_endpoint_is_ejected_and_tried_last():
+    router = _router({"http://a": FakeLLM("a", error=ConnectionError("down")), "http://b": FakeLLM("b")},
+                     hedge_delay=0, eject_after=1, eject_seconds=60)
+    router.invoke("ollama", "m", "q")
+    assert router.stats()["endpoints"]["ollama:m@http://a"]["ejected"]
+    for _ in range(4):
+        assert [endpoint.name for endpoint in router.candidates("ollama", "m")][-1] == "ollama:m@http://a"
+
+
+def test_counters_are_exact_under_concurrency():
+    router = _router({"http://a": FakeLLM("a"), "http://b": FakeLLM("b")}, hedge_delay=0)
+    threads = [threading.Thread(target=lambda: [router.invoke("ollama", "m", "q") for _ in range(50)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = router.stats()
+    assert stats["calls"] == 400
+    assert sum(endpoint["requests"] for endpoint in stats["endpoints"].values()) == 400
+
+
+def test_parse_fallback(caplog):
+    assert parse_fallback("") is None
+    assert parse_fallback("openai:gpt-4o-mini") == ("openai", "gpt-4o-mini")
+    assert parse_fallback("ollama:qwen2.5:7b") == ("ollama", "qwen2.5:7b")
+    with caplog.at_level(logging.WARNING):
+        assert parse_fallback("gpt-4o-mini") is None
+        assert parse_fallback("anthropic:claude") is None
+    assert "Ignoring invalid LLM_FALLBACK" in caplog.text
+
+
+def test_from_env_survives_malformed_fallback(monkeypatch):
+    monkeypatch.setenv("LLM_FALLBACK", "gpt-4o-mini")
+    assert LLMRouter.from_env().fallback is None
@@ -0,0 +1,56 @@
+import pytest
+
+from utils.profiling import ProfileStore, ProfilingConfig, RequestProfile
+
+
+def test_header_ignored_without_admin_token(tmp_path):
+    config = ProfilingConfig(str(tmp_path))
+    assert not config.admin_enabled
+    assert config.should_profile("1") is None
+    assert config.should_profile("1", "anything") is None
+    assert not config.is_admin("")
+
+
+def test_header_requires_valid_admin_token(tmp_path):
+    config = ProfilingConfig(str(tmp_path), admin_token="secret")
+    assert config.should_profile("1", "secret") is True
+    assert config.should_profile("1", "wrong") is None
+    assert config.should_profile("1") is None
+    assert config.should_profile("0", "secret") is None
+
+
+def test_sampling_does_not_need_admin_token(tmp_path):
+    config = ProfilingConfig(str(tmp_path), sample_rate=1.0)
+    assert config.should_profile(None) is False
+
+
+def test_from_env_reads_admin_token(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROFILE_DIR", str(tmp_path))
+    monkeypatch.setenv("PROFILE_ADMIN_TOKEN", "secret")
+    assert ProfilingConfig.from_env().is_admin("secret")
+    monkeypatch.setenv("PROFILE_ADMIN_TOKEN", "")
+    assert not ProfilingConfig.from_env().admin_enabled
+
+
+def _profile(duration, requested=False):
+    profile = RequestProfile("POST", "/api/std", requested)
+    profile.finish(200)
+    profile.duration = duration
+    return profile
+
+
+def test_store_keeps_slowest_and_requested(tmp_path):
+    store = ProfileStore(str(tmp_path), keep=2)
+    slow, fast, slower = _profile(0.5), _profile(0.1), _profile(0.9)
+    assert store.save(slow) and store.save(fast) and store.save(slower)
+    assert [item["id"] for item in store.list()] == [slower.profile_id, slow.profile_id]
+    assert not store.save(_profile(0.05))
+    requested = _profile(0.01, requested=True)
+    assert store.save(requested)
+    assert [item["id"] for item in store.list()] == [slower.profile_id, requested.profile_id]
+
+
+def test_store_rejects_path_traversal(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    with pytest.raises(KeyError):
+        store.get("../secret")
@@ -0,0 +1,63 @@
+import json
+import threading
+
+from utils.rerank_gate import RerankGate, RerankGateConfig, top_score_and_margin
+
+
+def _candidates(*pairs):
+    return [{"term": term, "score": score} for term, score in pairs]
+
+
+def test_margin_skips_repeated_top_term():
+    top, margin = top_score_and_margin(_candidates(("Net Income", 0.97), ("net income ", 0.96), ("Revenue", 0.90)))
+    assert top == 0.97
+    assert abs(margin - 0.07) < 1e-9
+
+
+def test_single_term_margin_is_top_score_and_empty_is_none():
+    assert top_score_and_margin(_candidates(("A", 0.95), ("a", 0.94))) == (0.95, 0.95)
+    assert top_score_and_margin([]) == (None, None)
+
+
+def test_decisions_and_stats():
+    gate = RerankGate(RerankGateConfig(min_top_score=0.9, min_margin=0.05))
+    assert gate.decide(_candidates(("A", 0.96), ("B", 0.80))).accept
+    assert gate.decide(_candidates(("A", 0.85), ("B", 0.70))).reason.startswith("top score below")
+    assert gate.decide(_candidates(("A", 0.96), ("B", 0.94))).reason.startswith("margin below")
+    assert gate.decide([]).reason == "no candidates"
+    stats = gate.stats()
+    assert (stats["gate"], stats["llm"], stats["gate_ratio"]) == (1, 3, 0.25)
+
+
+def test_counters_are_exact_under_concurrency():
+    gate = RerankGate()
+    confident, unsure = _candidates(("Net Income", 0.99)), _candidates(("Net Income", 0.5))
+
+    def decide():
+        for _ in range(500):
+            gate.decide(confident)
+            gate.decide(unsure)
+
+    threads = [threading.Thread(target=decide) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert (gate.stats()["gate"], gate.stats()["llm"]) == (4000, 4000)
+
+
+def test_disabled_gate_never_accepts():
+    gate = RerankGate(RerankGateConfig(enabled=False))
+    assert not gate.decide(_candidates(("A", 1.0))).accept
+
+
+def test_from_file_reads_calibration_output(tmp_path):
+    path = tmp_path / "gate.json"
+    path.write_text(json.dumps({"config": {"min_top_score": 0.8, "min_margin": 0.1, "enabled": True},
+                                "coverage": 0.5}), encoding="utf-8")
+    assert RerankGate.from_file(str(path)).config == RerankGateConfig(0.8, 0.1, True)
+
+
+def test_from_env_falls_back_to_defaults(monkeypatch, tmp_path):
+    monkeypatch.setenv("RERANK_GATE_CONFIG", str(tmp_path / "missing.json"))
+    assert RerankGate.from_env().config == RerankGateConfig()
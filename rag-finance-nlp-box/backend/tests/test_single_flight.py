@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from utils.single_flight import SingleFlight, make_key
+
+
+def test_make_key_ignores_dict_order():
+    assert make_key("std", {"a": 1, "b": 2}) == make_key("std", {"b": 2, "a": 1})
+    assert make_key("std", {"a": 1}) != make_key("abbr", {"a": 1})
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test")
+    executions = 0
+
+    async def compute():
+        nonlocal executions
+        executions += 1
+        await asyncio.sleep(0.01)
+        return {"value": 42}
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", compute) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert executions == 1
+    assert all(result is results[0] for result in results)
+    metrics = flight.metrics()
+    assert (metrics["calls"], metrics["executed"], metrics["coalesced"], metrics["inflight"]) == (5, 1, 4, 0)
+
+
+def test_errors_are_shared_and_key_is_released():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        async def ok():
+            return 1
+        return await flight.do("k", ok)
+
+    assert asyncio.run(run()) == 1
+    assert flight.metrics()["errors"] == 1
+    assert flight.metrics()["executed"] == 2
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    flight = SingleFlight("test")
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", compute))
+        second = asyncio.ensure_future(flight.do("k", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
@@ -0,0 +1,45 @@
+import threading
+import time
+
+import pytest
+
+# 依赖 pymilvus、langchain_huggingface 等服务端依赖，未安装时跳过
+std_service = pytest.importorskip("services.std_service")
+StdService = std_service.StdService
+
+
+@pytest.fixture
+def fake_init(monkeypatch):
+    calls = []
+
+    def init(self, provider="huggingface", model="m", db_path="db", collection_name="c", embedding_func=None):
+        time.sleep(0.01)
+        calls.append((provider, model, db_path, collection_name))
+        self.provider, self.model, self.db_path, self.collection_name = provider.lower(), model, db_path, collection_name
+        self.embedding_func = embedding_func or object()
+
+    monkeypatch.setattr(StdService, "__init__", init)
+    monkeypatch.setattr(std_service, "_shared_services", {})
+    monkeypatch.setattr(std_service, "_shared_embeddings", {})
+    return calls
+
+
+def test_concurrent_requests_share_one_instance(fake_init):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(StdService.get_shared("huggingface", "m", "db", "c")))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(fake_init) == 1
+    assert all(service is results[0] for service in results)
+
+
+def test_collections_with_same_model_share_embedding_function(fake_init):
+    first, second = StdService.create_many([
+        {"provider": "huggingface", "model": "m", "db_path": "db", "collection_name": "a"},
+        {"provider": "huggingface", "model": "m", "db_path": "db", "collection_name": "b"},
+    ])
+    assert first is not second
+    assert first.embedding_func is second.embedding_func
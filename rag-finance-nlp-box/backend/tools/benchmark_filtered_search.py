@@ -0,0 +1,91 @@
+"""
+按来源过滤检索的延迟基准测试
+对已有术语集合分别执行：不过滤、只搜索来源分区、使用 source 过滤表达式 三种检索，
+比较每种方式的 p50/p99 延迟和 QPS，用于评估领域限定查询在分区上的收益。
+
+示例：
+    python backend/tools/benchmark_filtered_search.py --sources FINTERM --num-queries 300
+"""
+from pymilvus import MilvusClient
+import numpy as np
+import pandas as pd
+import logging
+import argparse
+import time
+import sys
+import os
+
+# 将 backend 目录加入 sys.path，以便导入 utils 模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.milvus_partitions import source_partition_name, source_filter_expr
+from benchmark_milvus_index import embed_terms
+from create_milvus_db import DEFAULT_FILE_PATH, DEFAULT_DB_PATH, DEFAULT_COLLECTION_NAME, DEFAULT_MODEL_NAME
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def time_searches(client: MilvusClient, collection_name: str, queries: np.ndarray, top_k: int, **restriction):
+    """逐条执行检索，返回延迟统计和平均命中数"""
+    latencies, hit_counts = [], []
+    started = time.perf_counter()
+    for query in queries:
+        t0 = time.perf_counter()
+        result = client.search(collection_name=collection_name, data=[query.tolist()], limit=top_k,
+                               output_fields=["source"], **restriction)
+        latencies.append(time.perf_counter() - t0)
+        hit_counts.append(len(result[0]))
+    total = time.perf_counter() - started
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "qps": len(queries) / total if total > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "avg_hits": float(np.mean(hit_counts)),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="比较按来源过滤与不过滤检索的延迟")
+    parser.add_argument("--file", default=DEFAULT_FILE_PATH, help="术语 CSV 文件路径，用于抽样查询和统计来源")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Milvus 数据库路径或 URI")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION_NAME, help="集合名称")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="嵌入模型名称")
+    parser.add_argument("--embedding-store", default=os.getenv("EMBEDDING_STORE_DIR"), help="内容寻址向量存储目录")
+    parser.add_argument("--sources", nargs="*", help="要测试的来源，默认取术语数最多的 3 个来源")
+    parser.add_argument("--num-queries", type=int, default=200, help="查询数量")
+    parser.add_argument("--top-k", type=int, default=10, help="每次检索返回的结果数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = pd.read_csv(args.file, header=None, names=['term', 'source'], dtype=str).fillna("NA")
+    sources = args.sources or df['source'].value_counts().index[:3].tolist()
+    queries_text = df['term'].sample(n=min(args.num_queries, len(df)), random_state=args.seed).tolist()
+    queries = embed_terms(queries_text, args.model, args.embedding_store)
+
+    client = MilvusClient(args.db)
+    client.load_collection(args.collection)
+    partitions = set(client.list_partitions(args.collection))
+
+    rows = [("unfiltered", "-", time_searches(client, args.collection, queries, args.top_k))]
+    for source in sources:
+        partition_name = source_partition_name(source)
+        if partition_name in partitions:
+            rows.append(("partition", source, time_searches(
+                client, args.collection, queries, args.top_k, partition_names=[partition_name])))
+        else:
+            logging.warning(f"No partition for source '{source}', skipping partition search")
+        rows.append(("filter", source, time_searches(
+            client, args.collection, queries, args.top_k, filter=source_filter_expr([source]))))
+
+    print(f"\n{'mode':<12}{'source':<20}{'QPS':>10}{'p50 ms':>10}{'p99 ms':>10}{'avg hits':>10}")
+    for mode, source, stats in rows:
+        print(f"{mode:<12}{source:<20}{stats['qps']:>10.1f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['avg_hits']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
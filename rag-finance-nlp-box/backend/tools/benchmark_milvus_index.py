@@ -0,0 +1,221 @@
+"""
+术语集合索引配置基准测试
+对 FLAT、IVF_FLAT（不同 nlist/nprobe）、HNSW（不同 M/ef）等索引配置分别建集合，
+以暴力检索得到的精确 top-k 作为真值，统计单条查询与批量查询下的 recall@k、QPS 和延迟分位数，
+用数据来选择术语集合的索引配置。
+
+注意：Milvus Lite 只支持部分索引类型（如 FLAT、IVF_FLAT），测试 HNSW 等索引时请通过 --uri
+指向独立部署的 Milvus 服务；不支持的配置会被记录为失败并跳过。
+
+示例：
+    python backend/tools/benchmark_milvus_index.py --num-terms 20000 --num-queries 500 --top-k 10
+"""
+from pymilvus import MilvusClient, DataType, FieldSchema, CollectionSchema
+import numpy as np
+import pandas as pd
+import logging
+import argparse
+import json
+import time
+import sys
+import os
+
+# 将 backend 目录加入 sys.path，以便导入 utils 模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.embedding_store import EmbeddingStore
+from create_milvus_db import create_embedding_function, DEFAULT_FILE_PATH, DEFAULT_MODEL_NAME, EMBEDDER_ID
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_BENCH_URI = "/home/train/rag-finance-nlp-box/backend/db/index_benchmark.db"
+
+# 默认参数扫描：(索引类型, 建索引参数, [检索参数...])
+DEFAULT_SWEEP = [
+    ("FLAT", {}, [{}]),
+    ("IVF_FLAT", {"nlist": 128}, [{"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}]),
+    ("IVF_FLAT", {"nlist": 1024}, [{"nprobe": 8}, {"nprobe": 32}, {"nprobe": 128}]),
+    ("HNSW", {"M": 16, "efConstruction": 200}, [{"ef": 32}, {"ef": 64}, {"ef": 128}]),
+    ("HNSW", {"M": 32, "efConstruction": 200}, [{"ef": 32}, {"ef": 64}, {"ef": 128}]),
+]
+
+
+def load_terms(file_path: str, num_terms: int, seed: int):
+    """读取术语并打乱顺序，num_terms > 0 时只取前 num_terms 条"""
+    df = pd.read_csv(file_path, header=None, names=['term', 'source'], dtype=str).fillna("NA")
+    terms = df['term'].drop_duplicates().sample(frac=1.0, random_state=seed).tolist()
+    return terms[:num_terms] if num_terms > 0 else terms
+
+
+def embed_terms(terms, model_name: str, store_dir: str, batch_size: int = 256) -> np.ndarray:
+    """生成术语向量；配置了向量存储时优先复用已有向量"""
+    import torch
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    embedding_function = create_embedding_function(model_name, device)
+    store = EmbeddingStore(store_dir, model_name, EMBEDDER_ID) if store_dir else None
+
+    vectors = []
+    for start in range(0, len(terms), batch_size):
+        batch = terms[start:start + batch_size]
+        if store is not None:
+            vectors.extend(store.embed(batch, embedding_function))
+        else:
+            vectors.extend(embedding_function(batch))
+    if store is not None:
+        logging.info(f"Embedding store stats: {store.stats()}")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(queries: np.ndarray, corpus: np.ndarray, top_k: int, block: int = 256) -> np.ndarray:
+    """暴力计算余弦相似度下的精确 top-k，返回语料行号"""
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    results = []
+    for start in range(0, len(queries), block):
+        scores = queries[start:start + block] @ corpus.T
+        idx = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+        results.append(np.take_along_axis(idx, order, axis=1))
+    return np.vstack(results)
+
+
+def build_collection(client: MilvusClient, name: str, corpus: np.ndarray, index_type: str,
+                     build_params: dict, metric_type: str, insert_batch: int = 5000):
+    """创建集合、写入语料（主键即语料行号）并按给定配置建立索引"""
+    if client.has_collection(name):
+        client.drop_collection(name)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=corpus.shape[1]),
+    ]
+    client.create_collection(collection_name=name, schema=CollectionSchema(fields, "Index benchmark"))
+    for start in range(0, len(corpus), insert_batch):
+        rows = [{"id": start + i, "vector": vector.tolist()}
+                for i, vector in enumerate(corpus[start:start + insert_batch])]
+        client.insert(collection_name=name, data=rows)
+
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_type=index_type, metric_type=metric_type, params=build_params)
+    started = time.perf_counter()
+    client.create_index(collection_name=name, index_params=index_params)
+    client.load_collection(name)
+    return time.perf_counter() - started
+
+
+def run_queries(client: MilvusClient, name: str, queries: np.ndarray, top_k: int, batch_size: int,
+                metric_type: str, search_params: dict):
+    """按给定批大小执行检索，返回 (每条查询的结果行号, 每次调用的延迟秒数, 总耗时)"""
+    params = {"metric_type": metric_type, "params": search_params}
+    found, latencies = [], []
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        batch = [q.tolist() for q in queries[start:start + batch_size]]
+        t0 = time.perf_counter()
+        result = client.search(collection_name=name, data=batch, limit=top_k, search_params=params)
+        latencies.append(time.perf_counter() - t0)
+        found.extend([hit['id'] for hit in hits] for hits in result)
+    return found, latencies, time.perf_counter() - started
+
+
+def recall_at_k(found, truth: np.ndarray, top_k: int) -> float:
+    """计算 recall@k：检索结果与精确 top-k 的交集占比"""
+    hits = [len(set(f[:top_k]) & set(t[:top_k].tolist())) for f, t in zip(found, truth)]
+    return float(np.mean(hits)) / top_k
+
+
+def summarize(found, latencies, total_seconds, num_queries, truth, top_k):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "recall": recall_at_k(found, truth, top_k),
+        "qps": num_queries / total_seconds if total_seconds > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="术语集合索引配置的 recall@k / 延迟基准测试")
+    parser.add_argument("--file", default=DEFAULT_FILE_PATH, help="术语 CSV 文件路径 (term,source)")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="嵌入模型名称")
+    parser.add_argument("--embedding-store", default=os.getenv("EMBEDDING_STORE_DIR"), help="内容寻址向量存储目录")
+    parser.add_argument("--uri", default=DEFAULT_BENCH_URI, help="用于基准测试的 Milvus 数据库路径或服务 URI")
+    parser.add_argument("--num-terms", type=int, default=0, help="参与测试的术语数（0 表示全部）")
+    parser.add_argument("--num-queries", type=int, default=500, help="留出作为查询的术语数，不写入集合")
+    parser.add_argument("--top-k", type=int, default=10, help="recall@k 中的 k")
+    parser.add_argument("--batch-size", type=int, default=32, help="批量查询时每次请求的查询数")
+    parser.add_argument("--metric", default="COSINE", choices=["COSINE", "IP"], help="相似度度量")
+    parser.add_argument("--sweep", help="自定义参数扫描的 JSON 文件，格式同 DEFAULT_SWEEP")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output", help="将结果保存为 JSON 文件")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sweep = DEFAULT_SWEEP
+    if args.sweep:
+        with open(args.sweep, 'r', encoding='utf-8') as f:
+            sweep = json.load(f)
+
+    terms = load_terms(args.file, args.num_terms, args.seed)
+    if len(terms) <= args.num_queries:
+        raise ValueError(f"Need more than {args.num_queries} terms, got {len(terms)}")
+    logging.info(f"Embedding {len(terms)} terms with {args.model}")
+    vectors = embed_terms(terms, args.model, args.embedding_store)
+    queries, corpus = vectors[:args.num_queries], vectors[args.num_queries:]
+
+    logging.info(f"Computing exact top-{args.top_k} ground truth for {len(queries)} queries over {len(corpus)} terms")
+    truth = exact_top_k(queries, corpus, args.top_k)
+
+    db_dir = os.path.dirname(args.uri)
+    if db_dir and not args.uri.startswith("http") and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    client = MilvusClient(args.uri)
+
+    results = []
+    for i, (index_type, build_params, search_param_list) in enumerate(sweep):
+        name = f"index_bench_{i}"
+        try:
+            build_seconds = build_collection(client, name, corpus, index_type, build_params, args.metric)
+        except Exception as e:
+            logging.warning(f"Skipping {index_type} {build_params}: {e}")
+            results.append({"index_type": index_type, "build_params": build_params, "error": str(e)})
+            continue
+
+        for search_params in search_param_list:
+            row = {"index_type": index_type, "build_params": build_params,
+                   "search_params": search_params, "build_seconds": build_seconds}
+            try:
+                for mode, batch_size in (("single", 1), ("batched", args.batch_size)):
+                    found, latencies, total = run_queries(client, name, queries, args.top_k, batch_size,
+                                                          args.metric, search_params)
+                    row[mode] = summarize(found, latencies, total, len(queries), truth, args.top_k)
+            except Exception as e:
+                logging.warning(f"Search failed for {index_type} {build_params} {search_params}: {e}")
+                row["error"] = str(e)
+            results.append(row)
+            logging.info(json.dumps(row, ensure_ascii=False))
+
+        client.drop_collection(name)
+
+    # 汇总表
+    k = args.top_k
+    print(f"\n{'index':<10}{'build':<34}{'search':<16}{f'recall@{k}':>10}{'QPS(1)':>10}{'p99(1)ms':>10}"
+          f"{f'QPS({args.batch_size})':>10}{f'p99({args.batch_size})ms':>12}")
+    for row in results:
+        if "error" in row:
+            print(f"{row['index_type']:<10}{json.dumps(row['build_params']):<34}{'-':<16}  error: {row['error']}")
+            continue
+        single, batched = row["single"], row["batched"]
+        print(f"{row['index_type']:<10}{json.dumps(row['build_params']):<34}{json.dumps(row['search_params']):<16}"
+              f"{single['recall']:>10.4f}{single['qps']:>10.1f}{single['p99_ms']:>10.2f}"
+              f"{batched['qps']:>10.1f}{batched['p99_ms']:>12.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=4)
+        logging.info(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+缩写重排序门控阈值校准
+在标注数据（缩写 → 正确的标准术语）上执行向量检索，记录首个候选的分数、相对下一个不同术语的分差以及首个候选是否正确，
+在阈值网格上搜索：在“直接采用首个候选”的精确率不低于目标值的前提下，跳过 LLM 的比例最大的 (min_top_score, min_margin)。
+输出的 JSON 文件可通过环境变量 RERANK_GATE_CONFIG 提供给后端服务。
+
+标注文件为 CSV（列 abbreviation, expansion）或 JSON 列表（每项包含 abbreviation, expansion）。
+
+示例：
+    python backend/tools/calibrate_rerank_gate.py --labels backend/data/abbr_labels.csv --target-precision 0.98 \
+        --output backend/data/rerank_gate.json
+"""
+import numpy as np
+import pandas as pd
+import logging
+import argparse
+import json
+import sys
+import os
+
+# 将 backend 目录加入 sys.path，以便导入 services 和 utils 模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from services.std_service import StdService, normalize_distance
+from utils.rerank_gate import RerankGateConfig, top_score_and_margin
+from create_milvus_db import DEFAULT_DB_PATH, DEFAULT_COLLECTION_NAME, DEFAULT_MODEL_NAME
+
+# 设置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def load_labels(path: str):
+    """读取标注数据，返回 [(缩写, 正确的标准术语)]"""
+    if path.endswith(".json"):
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        return [(item['abbreviation'], item['expansion']) for item in items]
+    df = pd.read_csv(path, dtype=str).fillna("")
+    return list(zip(df['abbreviation'], df['expansion']))
+
+
+def collect_samples(service: StdService, labels, limit: int):
+    """对每条标注执行检索，返回 (首个候选分数, 分差, 首个候选是否正确) 数组"""
+    samples = []
+    for abbreviation, expansion in labels:
+        hits = service.search_similar_terms(abbreviation, limit=limit)
+        for hit in hits:
+            hit["score"] = normalize_distance(hit["distance"], service.metric_type)
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        top_score, margin = top_score_and_margin(hits)
+        if top_score is None:
+            continue
+        correct = (hits[0]["term"] or "").strip().lower() == expansion.strip().lower()
+        samples.append((top_score, margin, correct))
+    return np.asarray(samples, dtype=np.float64)
+
+
+def calibrate(samples: np.ndarray, target_precision: float, min_accepted: int, grid_size: int):
+    """
+    网格搜索阈值
+
+    Returns:
+        (最佳阈值, 覆盖率, 精确率)；没有满足目标精确率的阈值时返回 (None, 0, 0)
+    """
+    scores, margins, correct = samples[:, 0], samples[:, 1], samples[:, 2].astype(bool)
+    score_grid = np.unique(np.quantile(scores, np.linspace(0, 1, grid_size)))
+    margin_grid = np.unique(np.concatenate([[0.0], np.quantile(margins, np.linspace(0, 1, grid_size))]))
+
+    best = (None, 0.0, 0.0)
+    for min_top_score in score_grid:
+        for min_margin in margin_grid:
+            accepted = (scores >= min_top_score) & (margins >= min_margin)
+            count = int(accepted.sum())
+            if count < min_accepted:
+                continue
+            precision = float(correct[accepted].mean())
+            coverage = count / len(samples)
+            if precision >= target_precision and coverage > best[1]:
+                config = RerankGateConfig(min_top_score=float(min_top_score), min_margin=float(min_margin))
+                best = (config, coverage, precision)
+    return best
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="在标注数据上校准缩写重排序门控阈值")
+    parser.add_argument("--labels", required=True, help="标注文件 (CSV 或 JSON)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Milvus 数据库路径")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION_NAME, help="集合名称")
+    parser.add_argument("--provider", default="huggingface", help="嵌入模型提供商")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="嵌入模型名称")
+    parser.add_argument("--limit", type=int, default=10, help="每次检索的候选数（与服务中一致）")
+    parser.add_argument("--target-precision", type=float, default=0.98, help="直接采用首个候选时要求的最低精确率")
+    parser.add_argument("--min-accepted", type=int, default=20, help="阈值至少要覆盖的样本数，避免在极少样本上过拟合")
+    parser.add_argument("--grid-size", type=int, default=50, help="每个阈值维度的网格点数")
+    parser.add_argument("--output", help="输出的门控配置 JSON 文件")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    labels = load_labels(args.labels)
+    service = StdService(provider=args.provider, model=args.model, db_path=args.db, collection_name=args.collection)
+    samples = collect_samples(service, labels, args.limit)
+    if len(samples) == 0:
+        raise ValueError("No samples with search results")
+    top1_accuracy = float(samples[:, 2].mean())
+    logging.info(f"{len(samples)} labeled samples, top-1 accuracy without LLM: {top1_accuracy:.4f}")
+
+    config, coverage, precision = calibrate(samples, args.target_precision, args.min_accepted, args.grid_size)
+    if config is None:
+        logging.warning(f"No thresholds reach precision {args.target_precision}; keep calling the LLM for every query")
+        config = RerankGateConfig(enabled=False)
+
+    result = {
+        "config": vars(config),
+        "coverage": coverage,
+        "precision": precision,
+        "target_precision": args.target_precision,
+        "samples": len(samples),
+        "top1_accuracy": top1_accuracy,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+        logging.info(f"Gate config saved to {args.output}; set RERANK_GATE_CONFIG={args.output} to use it")
+
+
+if __name__ == "__main__":
+    main()
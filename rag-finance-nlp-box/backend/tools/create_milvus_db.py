@@ -1,146 +1,316 @@
 from pymilvus import model
-from pymilvus import MilvusClient
 import pandas as pd
-from tqdm import tqdm
 import logging
 from dotenv import load_dotenv
 load_dotenv()
-import torch    
+import torch
 from pymilvus import MilvusClient, DataType, FieldSchema, CollectionSchema
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import argparse
+import zlib
+import sys
 import os
 
+# 将 backend 目录加入 sys.path，以便导入 utils 模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.ingest_pipeline import run_ingest_pipeline
+from utils.embedding_store import EmbeddingStore
+from utils.milvus_partitions import source_partition_name, MAX_SOURCE_PARTITIONS
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# 初始化 OpenAI 嵌入函数
-embedding_function = model.dense.SentenceTransformerEmbeddingFunction(
-            model_name='BAAI/bge-m3',
-            # model_name='jinaai/jina-embeddings-v3',
-            device='cuda:0' if torch.cuda.is_available() else 'cpu',
-            trust_remote_code=True
-        )
-# embedding_function = model.dense.OpenAIEmbeddingFunction(model_name='text-embedding-3-large')
-
-# 文件路径
-file_path = "/home/train/rag-finance-nlp-box/backend/data/万条金融标准术语.csv"
-db_path = "/home/train/rag-finance-nlp-box/backend/db/finance_bge_m3.db"
-
-# 确保数据库目录存在
-db_dir = os.path.dirname(db_path)
-if db_dir and not os.path.exists(db_dir):
-    os.makedirs(db_dir)
-    logging.info(f"Created directory: {db_dir}")
-
-# 连接到 Milvus
-client = MilvusClient(db_path)
-
-collection_name = "finance_terms_bge_m3"
-
-# 加载数据
-logging.info("Loading data from CSV")
-df = pd.read_csv(file_path, header=None, names=['term', 'source'], dtype=str).fillna("NA")
-
-# 获取向量维度（使用一个样本文档）
-sample_doc = "Sample Text"
-sample_embedding = embedding_function([sample_doc])[0]
-vector_dim = len(sample_embedding)
-
-# 构造Schema
-fields = [
-    FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=True),
-    FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=vector_dim),
-    FieldSchema(name="term", dtype=DataType.VARCHAR, max_length=500),
-    FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=50),
-    FieldSchema(name="input_file", dtype=DataType.VARCHAR, max_length=500),
-]
-schema = CollectionSchema(fields, 
-                          "Financial Terms", 
-                          enable_dynamic_field=True)
-
-# 如果集合不存在，创建集合
-if not client.has_collection(collection_name):
-    client.create_collection(
-        collection_name=collection_name,
-        schema=schema
+# 默认配置
+DEFAULT_FILE_PATH = "/home/train/rag-finance-nlp-box/backend/data/万条金融标准术语.csv"
+DEFAULT_DB_PATH = "/home/train/rag-finance-nlp-box/backend/db/finance_bge_m3.db"
+DEFAULT_COLLECTION_NAME = "finance_terms_bge_m3"
+DEFAULT_MODEL_NAME = "BAAI/bge-m3"
+# DEFAULT_MODEL_NAME = "jinaai/jina-embeddings-v3"
+
+# 当前进程（或 worker 进程）中的嵌入函数和向量存储
+_embedding_function = None
+_embedding_store = None
+
+
+# 向量存储中标识 pymilvus SentenceTransformer 嵌入实现的名称，与在线服务的 langchain 实现分开存放
+EMBEDDER_ID = "pymilvus-sentence-transformer"
+
+
+def create_embedding_function(model_name: str, device: str):
+    """创建 SentenceTransformer 嵌入函数"""
+    return model.dense.SentenceTransformerEmbeddingFunction(
+        model_name=model_name,
+        device=device,
+        trust_remote_code=True
     )
-    logging.info(f"Created new collection: {collection_name}")
+    # return model.dense.OpenAIEmbeddingFunction(model_name='text-embedding-3-large')
 
-# # 在创建集合后添加索引
-index_params = client.prepare_index_params()
-index_params.add_index(
-    field_name="vector",  # 指定要为哪个字段创建索引，这里是向量字段
-    index_type="AUTOINDEX",  # 使用自动索引类型，Milvus会根据数据特性选择最佳索引
-    metric_type="COSINE",  # 使用余弦相似度作为向量相似度度量方式
-    params={"nlist": 1024}  # 索引参数：nlist表示聚类中心的数量，值越大检索精度越高但速度越慢
-)
 
-client.create_index(
-    collection_name=collection_name,
-    index_params=index_params
-)
+def _init_embedding_worker(model_name: str, device: str, torch_threads: int, store_dir: str = None):
+    """worker 进程初始化：每个进程加载一份模型，并限制 torch 线程数避免 CPU 超额订阅"""
+    global _embedding_function, _embedding_store
+    if torch_threads > 0:
+        torch.set_num_threads(torch_threads)
+    _embedding_function = create_embedding_function(model_name, device)
+    if store_dir:
+        _embedding_store = EmbeddingStore(store_dir, model_name, EMBEDDER_ID)
 
-# 批量处理
-batch_size = 1024
 
-for start_idx in tqdm(range(0, len(df), batch_size), desc="Processing batches"):
-    end_idx = min(start_idx + batch_size, len(df))
-    batch_df = df.iloc[start_idx:end_idx]
+def embed_texts(docs):
+    """使用当前进程中的嵌入函数生成向量（可在进程池中执行），配置了向量存储时只计算未命中的文本"""
+    if _embedding_store is not None:
+        return _embedding_store.embed(docs, _embedding_function)
+    return _embedding_function(docs)
 
-    # 准备文档
-    docs = batch_df['term'].tolist()
 
-    # 生成嵌入
-    try:
-        embeddings = embedding_function(docs)
-        logging.info(f"Generated embeddings for batch {start_idx // batch_size + 1}")
-    except Exception as e:
-        logging.error(f"Error generating embeddings for batch {start_idx // batch_size + 1}: {e}")
-        continue
+def row_ids(batch_df: pd.DataFrame, input_file: str):
+    """
+    确定性主键：高 31 位为输入文件名的 CRC32，低 32 位为行号（分块读取时行号在各批次间连续）
+    失败重试或重新导入同一文件时 upsert 覆盖已有行，不会产生重复行
+    """
+    file_hash = zlib.crc32(input_file.encode("utf-8")) & 0x7FFFFFFF
+    return [(file_hash << 32) | int(row) for row in batch_df.index]
 
-    # 准备数据
-    data = [
+
+def build_rows(batch_df: pd.DataFrame, embeddings, input_file: str, with_ids: bool = True):
+    """按列构建待插入的数据行，避免逐行 iterrows 带来的开销"""
+    terms = batch_df['term'].astype(str).tolist()
+    sources = batch_df['source'].astype(str).tolist()
+    rows = [
         {
-            "vector": embeddings[idx],
-            "term": str(row['term']),
-            "source": str(row['source']),
-            "input_file": file_path
-        } for idx, (_, row) in enumerate(batch_df.iterrows())
+            "vector": vector,
+            "term": term,
+            "source": source,
+            "input_file": input_file
+        } for vector, term, source in zip(embeddings, terms, sources)
     ]
+    if with_ids:
+        for row, row_id in zip(rows, row_ids(batch_df, input_file)):
+            row["id"] = row_id
+    return rows
+
+
+def uses_auto_id(client: MilvusClient, collection_name: str) -> bool:
+    """集合主键是否为自动生成（早期版本创建的集合），此时无法 upsert"""
+    return bool(client.describe_collection(collection_name).get("auto_id"))
+
+
+def write_rows(client: MilvusClient, collection_name: str, rows, auto_id: bool, partition_name: str = None) -> int:
+    """写入一组行：确定性主键的集合使用幂等的 upsert，自动主键的集合只能 insert"""
+    if auto_id:
+        res = client.insert(collection_name=collection_name, data=rows, partition_name=partition_name)
+        return res.get("insert_count", len(rows)) if isinstance(res, dict) else len(rows)
+    res = client.upsert(collection_name=collection_name, data=rows, partition_name=partition_name)
+    return res.get("upsert_count", len(rows)) if isinstance(res, dict) else len(rows)
 
-    # 插入数据
+
+def read_csv_batches(file_path: str, batch_size: int):
+    """分块流式读取 CSV，每个分块即为一个处理批次"""
+    reader = pd.read_csv(file_path, header=None, names=['term', 'source'], dtype=str, chunksize=batch_size)
+    for chunk in reader:
+        yield chunk.fillna("NA")
+
+
+def create_collection(client: MilvusClient, collection_name: str, vector_dim: int):
+    """构造 Schema、创建集合并建立向量索引"""
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=vector_dim),
+        FieldSchema(name="term", dtype=DataType.VARCHAR, max_length=500),
+        FieldSchema(name="source", dtype=DataType.VARCHAR, max_length=50),
+        FieldSchema(name="input_file", dtype=DataType.VARCHAR, max_length=500),
+    ]
+    schema = CollectionSchema(fields,
+                              "Financial Terms",
+                              enable_dynamic_field=True)
+
+    # 如果集合不存在，创建集合
+    if not client.has_collection(collection_name):
+        client.create_collection(
+            collection_name=collection_name,
+            schema=schema
+        )
+        logging.info(f"Created new collection: {collection_name}")
+
+    # # 在创建集合后添加索引
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="vector",  # 指定要为哪个字段创建索引，这里是向量字段
+        index_type="AUTOINDEX",  # 使用自动索引类型，Milvus会根据数据特性选择最佳索引
+        metric_type="COSINE"  # 使用余弦相似度作为向量相似度度量方式（AUTOINDEX 自行决定索引参数）
+    )
+
+    client.create_index(
+        collection_name=collection_name,
+        index_params=index_params
+    )
+
+    # 为 source 字段建立标量索引，加速按来源过滤的检索（部分部署如 Milvus Lite 可能不支持）
     try:
-        res = client.insert(
+        scalar_index_params = client.prepare_index_params()
+        scalar_index_params.add_index(field_name="source", index_type="INVERTED")
+        client.create_index(
             collection_name=collection_name,
-            data=data
+            index_params=scalar_index_params
         )
-        logging.info(f"Inserted batch {start_idx // batch_size + 1}, result: {res}")
     except Exception as e:
-        logging.error(f"Error inserting batch {start_idx // batch_size + 1}: {e}")
-
-logging.info("Insert process completed.")
-
-query = "A-Share"
-query_embeddings = embedding_function([query])
-
-
-# 搜索余弦相似度最高的
-search_result = client.search(
-    collection_name=collection_name,
-    data=[query_embeddings[0].tolist()],
-    limit=5,
-    output_fields=["term", 
-                   "source" 
-                   ]
-)
-logging.info(f"Search result for '{query}': {search_result}")
-
-# 查询所有匹配的实体
-query_result = client.query(
-    collection_name=collection_name,
-    filter="term == 'A-Shares'",
-    output_fields=["term", 
-                   "source"
-                   ],
-    limit=5
-)
-logging.info(f"Query result for term == 'A-Shares': {query_result}")
+        logging.warning(f"Failed to create scalar index on 'source', filtered search will scan: {e}")
+
+
+class SourcePartitionInserter:
+    """
+    按 source 将每批数据写入对应分区，分区不存在时自动创建
+    一批数据分多次写入各分区，批次失败重试时跳过已成功写入的分区，只重写其余部分
+    """
+    def __init__(self, client: MilvusClient, collection_name: str, input_file: str):
+        self.client = client
+        self.collection_name = collection_name
+        self.input_file = input_file
+        self.partitions = set(client.list_partitions(collection_name))
+        self.auto_id = uses_auto_id(client, collection_name)
+        # 批次首行行号 → 已写入的 source 及其行数
+        self._written = {}
+
+    def _partition_for(self, source: str):
+        name = source_partition_name(source)
+        if name in self.partitions:
+            return name
+        if len(self.partitions) >= MAX_SOURCE_PARTITIONS:
+            # 分区数已达上限，写入默认分区，检索时依赖 source 过滤表达式
+            return None
+        self.client.create_partition(collection_name=self.collection_name, partition_name=name)
+        self.partitions.add(name)
+        logging.info(f"Created partition {name} for source '{source}'")
+        return name
+
+    def __call__(self, batch_df: pd.DataFrame, embeddings) -> int:
+        batch_key = int(batch_df.index[0]) if len(batch_df) else None
+        written = self._written.setdefault(batch_key, {})
+        for source, positions in batch_df.groupby('source', sort=False).indices.items():
+            if source in written:
+                continue
+            data = build_rows(batch_df.iloc[positions], [embeddings[i] for i in positions], self.input_file,
+                              with_ids=not self.auto_id)
+            written[source] = write_rows(self.client, self.collection_name, data, self.auto_id,
+                                         partition_name=self._partition_for(str(source)))
+        del self._written[batch_key]
+        return sum(written.values())
+
+
+def sanity_check(client: MilvusClient, collection_name: str, embed_executor):
+    """插入完成后做一次检索和查询，确认集合可用"""
+    query = "A-Share"
+    query_embeddings = embed_executor.submit(embed_texts, [query]).result()
+
+    # 搜索余弦相似度最高的
+    search_result = client.search(
+        collection_name=collection_name,
+        data=[query_embeddings[0].tolist()],
+        limit=5,
+        output_fields=["term",
+                       "source"
+                       ]
+    )
+    logging.info(f"Search result for '{query}': {search_result}")
+
+    # 查询所有匹配的实体
+    query_result = client.query(
+        collection_name=collection_name,
+        filter="term == 'A-Shares'",
+        output_fields=["term",
+                       "source"
+                       ],
+        limit=5
+    )
+    logging.info(f"Query result for term == 'A-Shares': {query_result}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="将金融术语 CSV 向量化并写入 Milvus 集合")
+    parser.add_argument("--file", default=DEFAULT_FILE_PATH, help="术语 CSV 文件路径 (term,source)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Milvus 数据库路径或 URI")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION_NAME, help="集合名称")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME, help="嵌入模型名称")
+    parser.add_argument("--batch-size", type=int, default=1024, help="每批读取、向量化和插入的行数")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="CPU 上并行向量化的进程数（使用 GPU 时忽略，固定为 1）")
+    parser.add_argument("--embedding-store", default=os.getenv("EMBEDDING_STORE_DIR"),
+                        help="内容寻址向量存储目录，已向量化的文本直接复用（默认读取 EMBEDDING_STORE_DIR）")
+    parser.add_argument("--no-source-partitions", action="store_true",
+                        help="不按 source 划分分区，全部写入默认分区")
+    parser.add_argument("--queue-size", type=int, default=4, help="阶段之间有界队列的长度")
+    parser.add_argument("--max-retries", type=int, default=2, help="向量化或插入失败的批次的最大重试次数")
+    parser.add_argument("--skip-sanity-check", action="store_true", help="跳过插入完成后的检索验证")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+
+    # 确保数据库目录存在
+    db_dir = os.path.dirname(args.db)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+        logging.info(f"Created directory: {db_dir}")
+
+    # 向量化执行器：GPU 或单 worker 时在当前进程中执行，CPU 多 worker 时使用进程池
+    if device == 'cpu' and args.workers > 1:
+        torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+        embed_executor = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_embedding_worker,
+            initargs=(args.model, device, torch_threads, args.embedding_store)
+        )
+        max_inflight = args.workers
+        logging.info(f"Embedding with {args.workers} CPU worker processes ({torch_threads} torch threads each)")
+    else:
+        _init_embedding_worker(args.model, device, 0, args.embedding_store)
+        embed_executor = ThreadPoolExecutor(max_workers=1)
+        max_inflight = 1
+        logging.info(f"Embedding in-process on {device}")
+
+    with embed_executor:
+        # 获取向量维度（使用一个样本文档）
+        sample_embedding = embed_executor.submit(embed_texts, ["Sample Text"]).result()[0]
+        vector_dim = len(sample_embedding)
+
+        # 连接到 Milvus
+        client = MilvusClient(args.db)
+        create_collection(client, args.collection, vector_dim)
+
+        auto_id = uses_auto_id(client, args.collection)
+        if auto_id:
+            logging.warning(f"Collection {args.collection} uses auto-generated ids; "
+                            f"retried batches may insert duplicate rows")
+
+        def insert_batch(batch_df, embeddings):
+            data = build_rows(batch_df, embeddings, args.file, with_ids=not auto_id)
+            return write_rows(client, args.collection, data, auto_id)
+
+        if not args.no_source_partitions:
+            insert_batch = SourcePartitionInserter(client, args.collection, args.file)
+
+        # 流水线：流式读取 → 向量化 → 构建行并插入，阶段之间重叠执行
+        logging.info(f"Loading data from CSV: {args.file}")
+        report = run_ingest_pipeline(
+            batches=read_csv_batches(args.file, args.batch_size),
+            get_texts=lambda batch_df: batch_df['term'].tolist(),
+            embed_fn=embed_texts,
+            insert_fn=insert_batch,
+            embed_executor=embed_executor,
+            max_inflight=max_inflight,
+            queue_size=args.queue_size,
+            max_retries=args.max_retries
+        )
+        logging.info("Insert process completed.")
+        report.log_summary()
+
+        if not args.skip_sanity_check:
+            sanity_check(client, args.collection, embed_executor)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+批量提示词辅助函数
+按 token 预算把待处理条目分组，并解析 LLM 对一组条目返回的 JSON 结果。
+"""
+import json
+import re
+from functools import lru_cache
+from typing import Dict, List
+
+# 批量扩展提示词中除条目以外部分的预估 token 数
+BATCH_PROMPT_OVERHEAD_TOKENS = 200
+
+
+@lru_cache(maxsize=1)
+def _get_token_encoder():
+    """获取 tiktoken 编码器，未安装时返回 None"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的 token 数；没有 tiktoken 时按 UTF-8 字节数 / 3 估算（中文约每字 1 token，英文略高估）"""
+    encoder = _get_token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    return len(text.encode("utf-8")) // 3 + 1
+
+
+def pack_by_token_budget(items: List[Dict], token_budget: int) -> List[List[int]]:
+    """
+    按 token 预算把条目分组，每组的条目 token 数之和加上提示词开销不超过预算（单个条目超出预算时独占一组）
+
+    Returns:
+        每组条目在 items 中的下标
+    """
+    batches, current, used = [], [], BATCH_PROMPT_OVERHEAD_TOKENS
+    for index, item in enumerate(items):
+        cost = count_tokens(json.dumps({"id": index, **item}, ensure_ascii=False))
+        if current and used + cost > token_budget:
+            batches.append(current)
+            current, used = [], BATCH_PROMPT_OVERHEAD_TOKENS
+        current.append(index)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_expansions(output: str) -> Dict[int, str]:
+    """从 LLM 输出中解析 [{"id": ..., "expansion": ...}]，忽略代码块标记和多余文字"""
+    match = re.search(r"\[.*\]", output, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    expansions = {}
+    for entry in parsed if isinstance(parsed, list) else []:
+        if isinstance(entry, dict) and "id" in entry and isinstance(entry.get("expansion"), str):
+            try:
+                expansions[int(entry["id"])] = entry["expansion"].strip()
+            except (TypeError, ValueError):
+                continue
+    return expansions
@@ -11,3 +11,5 @@ class EmbeddingConfig:
     provider: EmbeddingProvider
     model_name: str  # 直接使用字符串，而不是枚举
     aws_region: Optional[str] = None
+    store_dir: Optional[str] = None  # 内容寻址向量存储目录，为空时不缓存向量
+    store_read_only: bool = False  # 只读使用向量存储：未命中的文本照常计算，但不写回存储（在线服务）
@@ -1,14 +1,57 @@
 import dotenv
 dotenv.load_dotenv()
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_openai import OpenAIEmbeddings
 import boto3
 import os
+from typing import List
 from utils.embedding_config import EmbeddingProvider, EmbeddingConfig
+from utils.embedding_store import DOCUMENT, QUERY, EmbeddingStore, get_shared_store
+from utils.embedding_server import RemoteEmbeddings
+
+class StoreBackedEmbeddings(Embeddings):
+    """
+    在任意 Embeddings 外包一层内容寻址向量存储：
+    已向量化过的文本直接从存储读取，只对新文本调用底层模型；read_only 时新文本的向量不写回存储
+    """
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore, read_only: bool = False):
+        self.embeddings = embeddings
+        self.store = store
+        self.read_only = read_only
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.store.embed(texts, self.embeddings.embed_documents, write=not self.read_only, kind=DOCUMENT)
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        # 查询来自任意用户输入，只读取存储（如查询恰好是已入库的术语），从不写入
+        vectors = self.store.embed([text], lambda texts: [self.embeddings.embed_query(texts[0])], write=False,
+                                   kind=QUERY)
+        return vectors[0].tolist()
 
 class EmbeddingFactory:
     @staticmethod
     def create_embedding_function(config: EmbeddingConfig):
+        # 设置 EMBEDDING_SERVER_SOCKET 时调用本地向量化服务进程，多个 API worker 共用一份模型
+        socket_path = os.getenv("EMBEDDING_SERVER_SOCKET")
+        if socket_path:
+            embeddings = RemoteEmbeddings(socket_path, config.provider.value, config.model_name)
+        else:
+            embeddings = EmbeddingFactory._create_base_embedding_function(config)
+        if config.store_dir:
+            # 每个进程共用一个存储实例，避免每次创建服务都重新加载整个键索引
+            store = get_shared_store(config.store_dir, config.model_name, EmbeddingFactory.embedder_id(config))
+            return StoreBackedEmbeddings(embeddings, store, read_only=config.store_read_only)
+        return embeddings
+
+    @staticmethod
+    def embedder_id(config: EmbeddingConfig) -> str:
+        """向量存储中标识嵌入实现的名称；本地与向量化服务进程使用同一实现，向量可以共用"""
+        return f"langchain-{config.provider.value}"
+
+    @staticmethod
+    def _create_base_embedding_function(config: EmbeddingConfig):
         if config.provider == EmbeddingProvider.OPENAI:
             return OpenAIEmbeddings(
                 model=config.model_name,
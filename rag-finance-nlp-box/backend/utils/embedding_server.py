@@ -0,0 +1,289 @@
+"""
+本地向量化服务进程
+多 worker 部署时由一个独立进程加载嵌入模型（如 bge-m3），各 API worker 通过 Unix socket 调用，
+模型只占一份内存；服务端把同一时间窗口内的多个请求合并为一个批次 (micro-batching) 统一向量化。
+
+协议：每条消息为 8 字节头（JSON 头长度、负载长度，大端 uint32）+ JSON 头 + 负载。
+请求头 {"provider", "model", "kind": "documents"|"query", "texts": [...]}，无负载；
+响应头 {"count", "dim"} 或 {"error"}，负载为 count×dim 的 float32 向量。
+
+启动：
+    python -m utils.embedding_server --socket /tmp/finance_embedding.sock --preload huggingface:BAAI/bge-m3
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">II")
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Embedding server connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_message(sock: socket.socket, header: Dict, payload: bytes = b""):
+    """发送一条消息"""
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(header_bytes), len(payload)) + header_bytes + payload)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict, bytes]:
+    """接收一条消息，返回 (JSON 头, 负载)"""
+    header_size, payload_size = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    header = json.loads(_recv_exact(sock, header_size).decode("utf-8"))
+    payload = _recv_exact(sock, payload_size) if payload_size else b""
+    return header, payload
+
+
+class MicroBatcher:
+    """
+    将并发请求合并为批次：第一个请求到达后最多再等待 max_wait 秒，
+    或累计文本数达到 max_batch_size 时，一次性调用 embed_fn
+    """
+    def __init__(self, embed_fn, max_batch_size: int = 64, max_wait: float = 0.005):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.texts = 0
+        self._queue: queue.Queue = queue.Queue()
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                vectors = np.asarray(self.embed_fn(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            offset = 0
+            for item_texts, future in batch:
+                future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+def batch_query_fn(embeddings: Embeddings):
+    """
+    返回一次向量化一批查询的函数，结果与逐条调用 `embed_query` 一致
+    HuggingFaceEmbeddings 的查询使用单独的 query_encode_kwargs（如 prompt / 查询指令）时沿用这些参数，
+    其余模型（含 OpenAIEmbeddings）的查询与文档编码方式相同，直接使用 embed_documents
+    """
+    query_encode_kwargs = getattr(embeddings, "query_encode_kwargs", None)
+    if query_encode_kwargs and hasattr(embeddings, "_embed"):
+        return lambda texts: embeddings._embed(list(texts), query_encode_kwargs)
+    query_instruction = getattr(embeddings, "query_instruction", None)
+    if isinstance(query_instruction, str) and query_instruction:
+        return lambda texts: embeddings.embed_documents([query_instruction + text for text in texts])
+    return embeddings.embed_documents
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """按 (provider, model, kind) 懒加载模型并为每种组合维护一个 MicroBatcher"""
+    daemon_threads = True
+    # 多个 API worker 的并发连接
+    request_queue_size = 256
+
+    def __init__(self, socket_path: str, max_batch_size: int = 64, max_wait: float = 0.005,
+                 bind_and_activate: bool = True):
+        super().__init__(socket_path, _EmbeddingRequestHandler, bind_and_activate=bind_and_activate)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._models: Dict[Tuple[str, str], Embeddings] = {}
+        self._batchers: Dict[Tuple[str, str, str], MicroBatcher] = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, provider: str, model: str) -> Embeddings:
+        key = (provider, model)
+        with self._lock:
+            if key not in self._models:
+                from utils.embedding_config import EmbeddingConfig, EmbeddingProvider
+                from utils.embedding_factory import EmbeddingFactory
+
+                logger.info(f"Loading embedding model {provider}:{model}")
+                config = EmbeddingConfig(provider=EmbeddingProvider(provider), model_name=model)
+                # 服务端直接加载模型，不能再转发给远程服务
+                self._models[key] = EmbeddingFactory._create_base_embedding_function(config)
+            return self._models[key]
+
+    def get_batcher(self, provider: str, model: str, kind: str) -> MicroBatcher:
+        key = (provider, model, kind)
+        with self._lock:
+            batcher = self._batchers.get(key)
+        if batcher is not None:
+            return batcher
+        embeddings = self.get_model(provider, model)
+        # 合并后的一批查询也只调用一次模型，否则 micro-batching 对查询没有意义
+        embed_fn = batch_query_fn(embeddings) if kind == "query" else embeddings.embed_documents
+        with self._lock:
+            return self._batchers.setdefault(key, MicroBatcher(embed_fn, self.max_batch_size, self.max_wait))
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """一个连接可以连续发送多个请求"""
+    def handle(self):
+        while True:
+            try:
+                header, _ = recv_message(self.request)
+            except (ConnectionError, struct.error):
+                return
+            try:
+                batcher = self.server.get_batcher(header["provider"], header["model"], header.get("kind", "documents"))
+                vectors = batcher.submit(header["texts"]).result()
+                send_message(self.request, {"count": int(vectors.shape[0]), "dim": int(vectors.shape[1])},
+                             vectors.tobytes())
+            except Exception as e:
+                logger.error(f"Embedding request failed: {str(e)}")
+                send_message(self.request, {"error": str(e)})
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    调用本地向量化服务的 Embeddings 实现，接口与直接加载模型一致
+    每个线程复用一条 Unix socket 连接，连接断开时自动重连一次
+    """
+    def __init__(self, socket_path: str, provider: str, model: str, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.provider = provider
+        self.model = model
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self._local.sock = sock
+        return sock
+
+    def _request(self, texts: List[str], kind: str) -> np.ndarray:
+        header = {"provider": self.provider, "model": self.model, "kind": kind, "texts": texts}
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                sock = sock or self._connect()
+                send_message(sock, header)
+                response, payload = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if "error" in response:
+            raise RuntimeError(f"Embedding server error: {response['error']}")
+        return np.frombuffer(payload, dtype=np.float32).reshape(response["count"], response["dim"])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._request(list(texts), "documents").tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._request([text], "query")[0].tolist()
+
+
+def wait_for_server(socket_path: str, timeout: float = 300.0, process=None) -> bool:
+    """等待服务端 socket 可连接（首次加载模型可能较慢）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and not process.is_alive():
+            return False
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def serve(socket_path: str, max_batch_size: int = 64, max_wait_ms: float = 5.0,
+          preload: Optional[List[str]] = None):
+    """
+    启动向量化服务（阻塞）
+
+    Args:
+        socket_path: Unix socket 路径
+        max_batch_size: 单个批次的最大文本数
+        max_wait_ms: 凑批的最长等待时间（毫秒）
+        preload: 启动时预先加载的模型，格式为 "provider:model"
+    """
+    logging.basicConfig(level=logging.INFO)
+    server = EmbeddingServer(socket_path, max_batch_size, max_wait_ms / 1000.0, bind_and_activate=False)
+    # 先加载模型再开始监听，客户端连接成功即表示模型已就绪
+    for spec in preload or []:
+        provider, model = spec.split(":", 1)
+        server.get_batcher(provider, model, "documents")
+        server.get_batcher(provider, model, "query")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server.server_bind()
+    server.server_activate()
+    logger.info(f"Embedding server listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地向量化服务 (Unix socket + micro-batching)")
+    parser.add_argument("--socket", default=os.getenv("EMBEDDING_SERVER_SOCKET", "/tmp/finance_embedding.sock"),
+                        help="Unix socket 路径")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="单个批次的最大文本数")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="凑批的最长等待时间（毫秒）")
+    parser.add_argument("--preload", nargs="*", default=["huggingface:BAAI/bge-m3"],
+                        help="启动时预先加载的模型，格式为 provider:model")
+    args = parser.parse_args()
+    serve(args.socket, args.max_batch_size, args.max_wait_ms, args.preload)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+内容寻址的向量存储
+以 hash(嵌入实现 + 模型名 + 向量类型 + 文本) 为键缓存向量，避免同一模型对同一文本重复向量化。
+入库脚本、custom_data_processor 的切块输出和在线服务共用同一个存储根目录。
+
+同一模型经不同实现（如 pymilvus 的 SentenceTransformerEmbeddingFunction 与 langchain 的
+HuggingFaceEmbeddings）向量化的结果可能因归一化等差异而不同，因此按嵌入实现 (embedder) 分开存放；
+查询与文档的向量也可能不同（如带查询指令的模型），向量类型 (kind) 参与键的计算。
+
+存储布局（每个 模型 + 嵌入实现 一个目录）：
+    {root_dir}/{模型名}@{嵌入实现}/meta.json     模型名、嵌入实现、向量维度、数据类型
+    {root_dir}/{模型名}@{嵌入实现}/keys.bin      每行一个 20 字节的 SHA-1 摘要，行号即向量所在行
+    {root_dir}/{模型名}@{嵌入实现}/vectors.f32   float32 向量按行顺序追加，读取时使用内存映射
+
+写入顺序为先向量后键，崩溃后以两者中较短的行数为准；多进程写入通过文件锁串行化，
+读取方在文件增长后自动增量加载新的键。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，退化为进程内锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_KEY_SIZE = 20
+_DTYPE = np.float32
+
+DOCUMENT = "document"
+QUERY = "query"
+
+
+def embedding_key(model_name: str, text: str, embedder: str, kind: str = DOCUMENT) -> bytes:
+    """计算 (嵌入实现, 模型名, 向量类型, 文本) 的内容寻址键"""
+    if kind not in (DOCUMENT, QUERY):
+        raise ValueError(f"Unknown embedding kind: {kind}")
+    return hashlib.sha1(f"{embedder}\0{model_name}\0{kind}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    基于内存映射文件的内容寻址向量存储
+    """
+    def __init__(self, root_dir: str, model_name: str, embedder: str, dim: Optional[int] = None):
+        """
+        打开（或创建）某个模型的向量存储
+
+        Args:
+            root_dir: 存储根目录
+            model_name: 嵌入模型名称，参与键的计算，并决定子目录
+            embedder: 嵌入实现的标识（如 "langchain-huggingface"），参与键的计算，并决定子目录
+            dim: 向量维度；为空时从已有 meta.json 读取，或在第一次写入时确定
+        """
+        self.model_name = model_name
+        self.embedder = embedder
+        self.dir = os.path.join(root_dir, re.sub(r"[^A-Za-z0-9_.@-]+", "_", f"{model_name}@{embedder}"))
+        os.makedirs(self.dir, exist_ok=True)
+        self._meta_path = os.path.join(self.dir, "meta.json")
+        self._keys_path = os.path.join(self.dir, "keys.bin")
+        self._vectors_path = os.path.join(self.dir, "vectors.f32")
+        self._lock_path = os.path.join(self.dir, ".lock")
+
+        self._lock = threading.RLock()
+        self._index: Dict[bytes, int] = {}
+        self._rows = 0
+        self._mmap: Optional[np.memmap] = None
+        self._mmap_rows = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.dim = dim
+        self._load_meta()
+        self.refresh()
+
+    def _load_meta(self):
+        """读取 meta.json 并校验模型名、嵌入实现和维度"""
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("model") != self.model_name:
+            raise ValueError(f"Embedding store at {self.dir} belongs to model {meta.get('model')}")
+        if meta.get("embedder") != self.embedder:
+            raise ValueError(f"Embedding store at {self.dir} was written by embedder {meta.get('embedder')}, "
+                             f"not {self.embedder}")
+        if self.dim is not None and meta.get("dim") != self.dim:
+            raise ValueError(f"Dimension mismatch: store has {meta.get('dim')}, got {self.dim}")
+        self.dim = meta["dim"]
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def _row_bytes(self) -> int:
+        return self.dim * np.dtype(_DTYPE).itemsize
+
+    def _complete_rows(self) -> int:
+        """磁盘上键和向量都已写完整的行数"""
+        if self.dim is None or not os.path.exists(self._keys_path) or not os.path.exists(self._vectors_path):
+            return 0
+        key_rows = os.path.getsize(self._keys_path) // _KEY_SIZE
+        vector_rows = os.path.getsize(self._vectors_path) // self._row_bytes()
+        return min(key_rows, vector_rows)
+
+    def refresh(self):
+        """增量加载其他进程追加的键"""
+        with self._lock:
+            if self.dim is None:
+                self._load_meta()
+            rows = self._complete_rows()
+            if rows <= self._rows:
+                return
+            with open(self._keys_path, "rb") as f:
+                f.seek(self._rows * _KEY_SIZE)
+                data = f.read((rows - self._rows) * _KEY_SIZE)
+            for i in range(rows - self._rows):
+                key = data[i * _KEY_SIZE:(i + 1) * _KEY_SIZE]
+                self._index.setdefault(key, self._rows + i)
+            self._rows = rows
+
+    def _vectors(self) -> np.memmap:
+        """返回覆盖所有已知行的只读内存映射"""
+        if self._mmap is None or self._mmap_rows != self._rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=_DTYPE, mode="r", shape=(self._rows, self.dim))
+            self._mmap_rows = self._rows
+        return self._mmap
+
+    def get_many(self, texts: Sequence[str], kind: str = DOCUMENT) -> List[Optional[np.ndarray]]:
+        """
+        批量查询向量
+
+        Args:
+            texts: 文本列表
+            kind: 向量类型，DOCUMENT 或 QUERY
+
+        Returns:
+            与输入等长的列表，命中的位置为向量，未命中为 None
+        """
+        with self._lock:
+            self.refresh()
+            results: List[Optional[np.ndarray]] = []
+            vectors = self._vectors() if self._rows else None
+            for text in texts:
+                row = self._index.get(embedding_key(self.model_name, text, self.embedder, kind))
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.array(vectors[row]))
+            return results
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]], kind: str = DOCUMENT):
+        """
+        批量写入向量，已存在的文本会被跳过
+
+        Args:
+            texts: 文本列表
+            vectors: 与文本一一对应的向量
+            kind: 向量类型，DOCUMENT 或 QUERY
+        """
+        if len(texts) != len(vectors):
+            raise ValueError("texts and vectors must have the same length")
+        if not texts:
+            return
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.dim is None:
+                    self._load_meta()
+                if self.dim is None:
+                    self.dim = len(vectors[0])
+                if not os.path.exists(self._meta_path):
+                    with open(self._meta_path, "w", encoding="utf-8") as f:
+                        json.dump({"model": self.model_name, "embedder": self.embedder, "dim": self.dim,
+                                   "dtype": "float32"}, f)
+                self.refresh()
+
+                new_keys: List[bytes] = []
+                new_vectors: List[np.ndarray] = []
+                seen = set()
+                for text, vector in zip(texts, vectors):
+                    key = embedding_key(self.model_name, text, self.embedder, kind)
+                    if key in self._index or key in seen:
+                        continue
+                    vector = np.asarray(vector, dtype=_DTYPE)
+                    if vector.shape != (self.dim,):
+                        raise ValueError(f"Expected vector of dim {self.dim}, got shape {vector.shape}")
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_vectors.append(vector)
+                if not new_keys:
+                    return
+
+                # 丢弃上次崩溃遗留的不完整行，再按“先向量后键”的顺序追加
+                for path, row_size in ((self._vectors_path, self._row_bytes()), (self._keys_path, _KEY_SIZE)):
+                    with open(path, "ab") as f:
+                        f.truncate(self._rows * row_size)
+                with open(self._vectors_path, "ab") as f:
+                    f.write(np.stack(new_vectors).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self._keys_path, "ab") as f:
+                    f.write(b"".join(new_keys))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.refresh()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def embed(self, texts: Sequence[str], embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+              write: bool = True, kind: str = DOCUMENT) -> List[np.ndarray]:
+        """
+        优先从存储中读取向量，只对未命中的文本调用 embed_fn，并把结果写回存储
+
+        Args:
+            texts: 文本列表
+            embed_fn: 对文本列表生成向量的函数
+            write: 是否把新计算的向量写回存储；在线服务只读，避免用户输入无限增长存储
+            kind: 向量类型，embed_fn 生成文档向量时为 DOCUMENT，生成查询向量时为 QUERY
+
+        Returns:
+            与输入顺序一致的向量列表
+        """
+        results = self.get_many(texts, kind)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, results) if vector is None))
+        if missing:
+            computed = [np.asarray(v, dtype=_DTYPE) for v in embed_fn(missing)]
+            if write:
+                self.put_many(missing, computed, kind)
+            by_text = dict(zip(missing, computed))
+            results = [vector if vector is not None else by_text[text] for text, vector in zip(texts, results)]
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        """返回命中统计"""
+        return {"rows": self._rows, "hits": self.hits, "misses": self.misses}
+
+
+_shared_stores: Dict[Tuple[str, str, str], EmbeddingStore] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_store(root_dir: str, model_name: str, embedder: str) -> EmbeddingStore:
+    """
+    进程内按 (存储目录, 模型名, 嵌入实现) 共享的存储实例
+    键索引只在第一次打开时完整加载，之后由 `refresh` 增量加载，不随请求重复读取 keys.bin
+    """
+    key = (os.path.abspath(root_dir), model_name, embedder)
+    with _shared_lock:
+        if key not in _shared_stores:
+            _shared_stores[key] = EmbeddingStore(root_dir, model_name, embedder)
+        return _shared_stores[key]
@@ -0,0 +1,240 @@
+"""
+流水线式向量入库工具
+将“读取 → 向量化 → 构建行并插入”拆分为独立阶段，阶段之间通过有界队列衔接：
+- 第 N+1 批的向量化与第 N 批的插入重叠执行；
+- 队列有界，下游变慢时上游自动阻塞（背压），内存占用不随数据量增长；
+- 向量化阶段可同时保持多个批次在执行器中运行（多进程 CPU 向量化）；
+- 向量化或插入失败的批次按指数退避重试，超过重试次数后记录并跳过；
+- 每个阶段单独统计行数、耗时和吞吐量 (rows/sec)。
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_SENTINEL = object()
+
+
+@dataclass
+class StageStats:
+    """单个流水线阶段的统计信息"""
+    name: str
+    rows: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    retries: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+
+@dataclass
+class PipelineReport:
+    """整条流水线的运行报告"""
+    stages: List[StageStats] = field(default_factory=list)
+    wall_seconds: float = 0.0
+
+    @property
+    def inserted_rows(self) -> int:
+        return self.stages[-1].rows if self.stages else 0
+
+    def log_summary(self):
+        """按阶段输出吞吐量统计"""
+        for stage in self.stages:
+            logger.info(
+                f"[{stage.name}] rows={stage.rows}, batches={stage.batches}, "
+                f"failed_batches={stage.failed_batches}, retries={stage.retries}, busy={stage.busy_seconds:.2f}s, "
+                f"throughput={stage.rows_per_second:.1f} rows/sec"
+            )
+        overall = self.inserted_rows / self.wall_seconds if self.wall_seconds > 0 else 0.0
+        logger.info(
+            f"[pipeline] inserted_rows={self.inserted_rows}, wall={self.wall_seconds:.2f}s, "
+            f"throughput={overall:.1f} rows/sec"
+        )
+
+
+def _put(q: queue.Queue, item: Any, stop_event: threading.Event) -> bool:
+    """向有界队列放入元素；若流水线已停止则放弃并返回 False"""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop_event: threading.Event) -> Any:
+    """从队列取出元素；若流水线已停止则返回结束标记"""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _SENTINEL
+
+
+def _backoff(attempt: int, retry_backoff: float, stop_event: threading.Event):
+    """第 attempt 次重试前等待 retry_backoff * 2^(attempt-1) 秒；流水线停止时提前返回"""
+    stop_event.wait(retry_backoff * (2 ** (attempt - 1)))
+
+
+def run_ingest_pipeline(
+    batches: Iterable[Any],
+    get_texts: Callable[[Any], List[str]],
+    embed_fn: Callable[[List[str]], List],
+    insert_fn: Callable[[Any, List], int],
+    embed_executor: Executor,
+    max_inflight: int = 1,
+    queue_size: int = 4,
+    max_retries: int = 0,
+    retry_backoff: float = 1.0,
+) -> PipelineReport:
+    """
+    运行三阶段入库流水线
+
+    Args:
+        batches: 批次迭代器（例如 `pd.read_csv(..., chunksize=...)` 返回的分块），按需流式读取
+        get_texts: 从一个批次中取出需要向量化的文本列表
+        embed_fn: 向量化函数，会被提交到 `embed_executor` 中执行，必须可被执行器序列化
+        insert_fn: 接收 (批次, 向量列表)，构建行并写入向量库，返回成功写入的行数；
+            失败时会以同一批次重新调用，必须是幂等的（如使用确定性主键 upsert）
+        embed_executor: 执行向量化的执行器（线程池或进程池）
+        max_inflight: 向量化阶段同时在执行器中运行的批次数，通常等于进程池的 worker 数
+        queue_size: 阶段之间队列的最大长度
+        max_retries: 向量化或插入失败时每个批次的最大重试次数，0 表示不重试
+        retry_backoff: 首次重试前的等待秒数，之后每次翻倍
+
+    Returns:
+        PipelineReport: 每个阶段的吞吐量统计
+    """
+    read_stats = StageStats("read")
+    embed_stats = StageStats("embed")
+    insert_stats = StageStats("insert")
+    report = PipelineReport(stages=[read_stats, embed_stats, insert_stats])
+
+    embed_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    insert_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors: List[BaseException] = []
+
+    def read_stage():
+        try:
+            iterator = iter(batches)
+            batch_no = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                batch_no += 1
+                read_stats.busy_seconds += time.perf_counter() - started
+                read_stats.rows += len(batch)
+                read_stats.batches += 1
+                if not _put(embed_queue, (batch_no, batch), stop_event):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(embed_queue, _SENTINEL, stop_event)
+
+    def embed_stage():
+        inflight: deque = deque()
+
+        def drain_one() -> bool:
+            batch_no, batch, future, started = inflight.popleft()
+            attempt = 0
+            while True:
+                try:
+                    embeddings = future.result()
+                    break
+                except Exception as e:
+                    if attempt >= max_retries or stop_event.is_set():
+                        logger.error(f"Error generating embeddings for batch {batch_no}: {e}")
+                        embed_stats.failed_batches += 1
+                        return True
+                    attempt += 1
+                    embed_stats.retries += 1
+                    logger.warning(f"Embedding batch {batch_no} failed ({e}), retry {attempt}/{max_retries}")
+                    _backoff(attempt, retry_backoff, stop_event)
+                    future = embed_executor.submit(embed_fn, get_texts(batch))
+            embed_stats.busy_seconds += time.perf_counter() - started
+            embed_stats.rows += len(batch)
+            embed_stats.batches += 1
+            return _put(insert_queue, (batch_no, batch, embeddings), stop_event)
+
+        try:
+            while True:
+                item = _get(embed_queue, stop_event)
+                if item is _SENTINEL:
+                    break
+                batch_no, batch = item
+                future = embed_executor.submit(embed_fn, get_texts(batch))
+                inflight.append((batch_no, batch, future, time.perf_counter()))
+                if len(inflight) >= max(1, max_inflight) and not drain_one():
+                    return
+            while inflight:
+                if not drain_one():
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop_event.set()
+        finally:
+            _put(insert_queue, _SENTINEL, stop_event)
+
+    wall_started = time.perf_counter()
+    threads = [
+        threading.Thread(target=read_stage, name="ingest-read", daemon=True),
+        threading.Thread(target=embed_stage, name="ingest-embed", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    # 插入阶段在当前线程执行，保证客户端连接只在一个线程中使用
+    try:
+        while True:
+            item = _get(insert_queue, stop_event)
+            if item is _SENTINEL:
+                break
+            batch_no, batch, embeddings = item
+            started = time.perf_counter()
+            inserted = None
+            for attempt in range(max_retries + 1):
+                if attempt:
+                    insert_stats.retries += 1
+                    _backoff(attempt, retry_backoff, stop_event)
+                try:
+                    inserted = insert_fn(batch, embeddings)
+                    break
+                except Exception as e:
+                    if attempt < max_retries:
+                        logger.warning(f"Inserting batch {batch_no} failed ({e}), retry {attempt + 1}/{max_retries}")
+                    else:
+                        logger.error(f"Error inserting batch {batch_no}: {e}")
+            if inserted is None:
+                insert_stats.failed_batches += 1
+                continue
+            insert_stats.busy_seconds += time.perf_counter() - started
+            insert_stats.rows += inserted
+            insert_stats.batches += 1
+            logger.debug(f"Inserted batch {batch_no}, rows: {inserted}")
+    finally:
+        stop_event.set()
+        for t in threads:
+            t.join()
+        report.wall_seconds = time.perf_counter() - wall_started
+
+    if errors:
+        raise errors[0]
+    return report
@@ -0,0 +1,326 @@
+"""
+大模型调用路由
+在多个端点（多个 Ollama 实例、备用提供商）之间分发 LLM 调用，压低尾延迟：
+- 轮询 (round-robin) 选择主端点，OLLAMA_BASE_URLS 可配置多个 Ollama 实例；
+- 每次调用有总截止时间 (deadline)，超时抛出 TimeoutError，而不是一直等到客户端超时；
+- 主端点在 hedge_delay 内未返回时，向下一个端点（或 LLM_FALLBACK 指定的备用提供商）发出对冲请求，
+  采用先成功返回的结果；端点报错时立即切换到下一个端点；
+- 连续失败达到阈值的端点被暂时摘除，冷却期过后重新参与轮询。
+
+环境变量：
+    OLLAMA_BASE_URLS          逗号分隔的 Ollama 地址
+    LLM_FALLBACK              备用提供商，格式为 provider:model（如 openai:gpt-4o-mini）
+    LLM_DEADLINE_SECONDS      单次调用的总截止时间，默认 30
+    LLM_HEDGE_DELAY_MS        发出对冲请求前的等待时间，默认 2000，设为 0 关闭对冲
+    LLM_EJECT_AFTER_FAILURES  连续失败多少次后摘除端点，默认 3
+    LLM_EJECT_SECONDS         摘除后的冷却时间，默认 30
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from utils.profiling import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_BASE_URL = "http://192.168.0.75:11434"
+
+
+def parse_fallback(value: str) -> Optional[Tuple[str, str]]:
+    """
+    解析 LLM_FALLBACK（provider:model）
+
+    Returns:
+        (provider, model)；未设置或格式错误时返回 None，格式错误时记录警告而不影响服务启动
+    """
+    value = value.strip()
+    if not value:
+        return None
+    provider, _, model = value.partition(":")
+    provider, model = provider.strip().lower(), model.strip()
+    if not model or provider not in ("ollama", "openai"):
+        logger.warning(f"Ignoring invalid LLM_FALLBACK {value!r}: expected provider:model "
+                       f"with provider ollama or openai")
+        return None
+    return provider, model
+
+
+class Endpoint:
+    """一个 LLM 端点（提供商 + 模型 + 地址）及其健康状态"""
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self._factory = factory
+        self._llm = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.latency_ewma: Optional[float] = None
+
+    @property
+    def llm(self):
+        """懒创建底层模型实例，创建后复用（内部连接池随之复用）"""
+        with self._lock:
+            if self._llm is None:
+                self._llm = self._factory()
+            return self._llm
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.ejected_until = 0.0
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+
+    def record_failure(self, eject_after: int, eject_seconds: float):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= eject_after and self.ejected_until <= time.monotonic():
+                self.ejected_until = time.monotonic() + eject_seconds
+                self.ejections += 1
+                logger.warning(f"Ejected LLM endpoint {self.name} for {eject_seconds}s "
+                               f"after {self.consecutive_failures} consecutive failures")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "failures": self.failures,
+                "consecutive_failures": self.consecutive_failures,
+                "ejections": self.ejections,
+                "ejected": not self.is_healthy(time.monotonic()),
+                "latency_ewma": self.latency_ewma,
+            }
+
+
+class LLMRouter:
+    """
+    按 (provider, model) 管理端点并执行带截止时间、对冲和故障切换的调用
+
+    Args:
+        ollama_base_urls: Ollama 实例地址列表，轮询使用
+        fallback: 备用提供商 (provider, model)，主端点全部失败或响应慢时使用
+        deadline: 单次调用的总截止时间（秒）
+        hedge_delay: 发出对冲请求前的等待时间（秒），<= 0 时不对冲，只在失败时切换
+        eject_after: 连续失败多少次后摘除端点
+        eject_seconds: 摘除后的冷却时间（秒）
+        max_workers: 执行模型调用的线程数
+    """
+
+    def __init__(self, ollama_base_urls: Optional[List[str]] = None, fallback: Optional[Tuple[str, str]] = None,
+                 deadline: float = 30.0, hedge_delay: float = 2.0, eject_after: int = 3,
+                 eject_seconds: float = 30.0, max_workers: int = 32):
+        self.ollama_base_urls = ollama_base_urls or [DEFAULT_OLLAMA_BASE_URL]
+        self.fallback = fallback
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-router")
+        self._endpoints: Dict[str, Endpoint] = {}
+        self._counters: Dict[Tuple[str, str], itertools.count] = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.deadline_exceeded = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMRouter":
+        urls = [url.strip() for url in os.getenv("OLLAMA_BASE_URLS", "").split(",") if url.strip()]
+        return cls(
+            ollama_base_urls=urls,
+            fallback=parse_fallback(os.getenv("LLM_FALLBACK", "")),
+            deadline=float(os.getenv("LLM_DEADLINE_SECONDS", "30")),
+            hedge_delay=float(os.getenv("LLM_HEDGE_DELAY_MS", "2000")) / 1000.0,
+            eject_after=int(os.getenv("LLM_EJECT_AFTER_FAILURES", "3")),
+            eject_seconds=float(os.getenv("LLM_EJECT_SECONDS", "30")),
+        )
+
+    def _create_llm(self, provider: str, model: str, base_url: Optional[str] = None):
+        # 客户端超时与截止时间一致，避免被放弃的请求长期占用线程
+        if provider == "ollama":
+            from langchain_community.llms import Ollama
+            return Ollama(model=model, base_url=base_url, timeout=int(self.deadline))
+        elif provider == "openai":
+            from langchain.chat_models import ChatOpenAI
+            return ChatOpenAI(
+                model=model,
+                temperature=0,
+                api_key=os.getenv("OPENAI_API_KEY"),
+                request_timeout=self.deadline,
+                max_retries=0
+            )
+        else:
+            raise ValueError(f"Unsupported LLM provider: {provider}")
+
+    def _get_endpoint(self, provider: str, model: str, base_url: Optional[str] = None) -> Endpoint:
+        name = f"{provider}:{model}" + (f"@{base_url}" if base_url else "")
+        with self._lock:
+            if name not in self._endpoints:
+                self._endpoints[name] = Endpoint(name, lambda: self._create_llm(provider, model, base_url))
+            return self._endpoints[name]
+
+    def _primary_endpoints(self, provider: str, model: str) -> List[Endpoint]:
+        if provider == "ollama":
+            return [self._get_endpoint(provider, model, url) for url in self.ollama_base_urls]
+        if provider == "openai":
+            return [self._get_endpoint(provider, model)]
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+
+    def candidates(self, provider: str, model: str) -> List[Endpoint]:
+        """
+        本次调用依次尝试的端点：轮询起点的健康主端点、健康的备用端点，最后是被摘除的端点（全部摘除时仍可尝试）
+        """
+        primaries = self._primary_endpoints(provider, model)
+        with self._lock:
+            counter = self._counters.setdefault((provider, model), itertools.count())
+            start = next(counter) % len(primaries)
+        ordered = primaries[start:] + primaries[:start]
+        if self.fallback and self.fallback != (provider, model):
+            ordered.append(self._get_endpoint(*self.fallback))
+
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in ordered if endpoint.is_healthy(now)]
+        return healthy + [endpoint for endpoint in ordered if not endpoint.is_healthy(now)]
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _call(self, endpoint: Endpoint, input: Any, config: Optional[RunnableConfig]):
+        endpoint.record_request()
+        start = time.monotonic()
+        try:
+            result = endpoint.llm.invoke(input, config)
+        except Exception:
+            endpoint.record_failure(self.eject_after, self.eject_seconds)
+            raise
+        endpoint.record_success(time.monotonic() - start)
+        return result
+
+    def invoke(self, provider: str, model: str, input: Any, config: Optional[RunnableConfig] = None):
+        """
+        调用模型：先请求首个候选端点，hedge_delay 内未返回时向下一个端点发出对冲请求，
+        端点报错时立即切换，返回最先成功的结果
+
+        Raises:
+            TimeoutError: 超过截止时间仍没有端点返回
+            Exception: 所有端点都失败时抛出最后一个错误
+        """
+        self._count("calls")
+        endpoints = self.candidates(provider, model)
+        deadline = time.monotonic() + self.deadline
+        pending: Dict[Future, Endpoint] = {}
+        hedged = set()  # 对冲发出的请求，只有它们先成功时才计入 hedge_wins
+        next_index = 0
+        last_error: Optional[Exception] = None
+
+        def launch(hedge: bool = False):
+            nonlocal next_index
+            endpoint = endpoints[next_index]
+            next_index += 1
+            future = self._executor.submit(self._call, endpoint, input, config)
+            pending[future] = endpoint
+            if hedge:
+                hedged.add(future)
+
+        launch()
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            can_hedge = self.hedge_delay > 0 and next_index < len(endpoints)
+            done, _ = wait(list(pending), timeout=min(remaining, self.hedge_delay) if can_hedge else remaining,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge:
+                    self._count("hedges")
+                    logger.info(f"LLM endpoint {pending[next(iter(pending))].name} slow, "
+                                f"hedging to {endpoints[next_index].name}")
+                    launch(hedge=True)
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    logger.warning(f"LLM endpoint {endpoint.name} failed: {str(e)}")
+                    continue
+                if future in hedged:
+                    self._count("hedge_wins")
+                return result
+            # 全部进行中的请求都失败时切换到下一个端点
+            if not pending and next_index < len(endpoints):
+                self._count("failovers")
+                launch()
+
+        if pending:
+            self._count("deadline_exceeded")
+            raise TimeoutError(f"LLM call to {provider}:{model} exceeded deadline of {self.deadline}s")
+        raise last_error
+
+    def bind(self, provider: str, model: str) -> "RoutedLLM":
+        """返回可直接用于 `prompt | llm` 的模型对象"""
+        # 提前校验提供商，保持与直接创建模型时相同的 ValueError
+        self._primary_endpoints(provider, model)
+        return RoutedLLM(self, provider, model)
+
+    def stats(self) -> Dict:
+        """调用、对冲、故障切换和超时次数，以及每个端点的健康状态"""
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        with self._stats_lock:
+            counters = {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "deadline_exceeded": self.deadline_exceeded,
+            }
+        return {**counters, "endpoints": {name: endpoint.stats() for name, endpoint in endpoints.items()}}
+
+
+class RoutedLLM(Runnable):
+    """经 LLMRouter 路由的模型，调用方式与 langchain 模型相同"""
+
+    def __init__(self, router: LLMRouter, provider: str, model: str):
+        self.router = router
+        self.provider = provider
+        self.model = model
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any):
+        with stage(f"llm:{self.provider}:{self.model}"):
+            return self.router.invoke(self.provider, self.model, input, config)
+
+
+_router: Optional[LLMRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_llm_router() -> LLMRouter:
+    """进程内共享的路由实例，各服务共用端点健康状态"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter.from_env()
+        return _router
@@ -0,0 +1,40 @@
+"""
+按 source 字段划分 Milvus 分区的命名与过滤工具
+入库脚本按术语来源写入各自的分区，检索时只在指定来源的分区中搜索。
+"""
+import hashlib
+import json
+import re
+from typing import Iterable, List
+
+# 单个集合允许的分区数有限（Milvus 默认 1024，含 _default），超出后不再新建分区
+MAX_SOURCE_PARTITIONS = 1000
+
+
+def source_partition_name(source: str) -> str:
+    """
+    将来源名称映射为合法且唯一的分区名（只含字母、数字和下划线）
+
+    Args:
+        source: 术语来源
+
+    Returns:
+        分区名，例如 "src_FINTERM_1a2b3c4d"
+    """
+    readable = re.sub(r"[^0-9A-Za-z_]", "_", source.strip())[:40]
+    digest = hashlib.md5(source.strip().encode("utf-8")).hexdigest()[:8]
+    return f"src_{readable}_{digest}"
+
+
+def source_filter_expr(sources: Iterable[str]) -> str:
+    """
+    构造按来源过滤的标量表达式，例如 'source in ["FINTERM", "IFRS"]'
+
+    Args:
+        sources: 来源列表
+
+    Returns:
+        Milvus 过滤表达式
+    """
+    values: List[str] = [json.dumps(source.strip(), ensure_ascii=False) for source in sources]
+    return f"source in [{', '.join(values)}]"
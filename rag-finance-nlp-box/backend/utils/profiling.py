@@ -0,0 +1,263 @@
+"""
+按需请求剖析
+按 PROFILE_SAMPLE_RATE 抽样命中的请求，或带 `X-Profile: 1` 和有效 `X-Admin-Token` 请求头的请求会被剖析：
+- 在执行计算的工作线程中运行 cProfile；
+- 记录阶段时间线（模型加载、向量化、Milvus 检索、LLM 调用等），各服务通过 `stage()` 标记阶段；
+- 结果写入 PROFILE_DIR，只保留最慢的 PROFILE_KEEP 个（显式请求的剖析总会保存），
+  通过管理端点列出和下载。
+未设置 PROFILE_ADMIN_TOKEN 时管理端点关闭，X-Profile 请求头被忽略，只保留抽样剖析。
+
+剖析状态保存在 contextvars 中，随 `asyncio.to_thread` 传递到工作线程；
+自行创建线程池的代码需要用 `contextvars.copy_context().run` 提交任务，否则其中的阶段不会被记录。
+"""
+import contextvars
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+# cProfile 同一时刻只能有一个剖析器处于启用状态
+_cprofile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """一个请求的剖析结果：阶段时间线和 cProfile 统计"""
+
+    def __init__(self, method: str, path: str, requested: bool):
+        self.profile_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+        self.method = method
+        self.path = path
+        self.requested = requested
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.status_code: Optional[int] = None
+        self.stages: List[Dict[str, Any]] = []
+        self.profiler: Optional[cProfile.Profile] = None
+        self.cprofile_skipped: Optional[str] = None
+
+    def add_stage(self, name: str, start: float, end: float, error: Optional[str] = None):
+        self.stages.append({
+            "name": name,
+            "start_ms": round((start - self._start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+            "thread": threading.current_thread().name,
+            "error": error,
+        })
+
+    def finish(self, status_code: int):
+        self.duration = time.perf_counter() - self._start
+        self.status_code = status_code
+
+    def top_functions(self, limit: int = 40) -> str:
+        """按累计耗时排序的 cProfile 统计文本"""
+        if self.profiler is None:
+            return ""
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "requested": self.requested,
+            "started_at": self.started_at,
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "status_code": self.status_code,
+            "has_cprofile": self.profiler is not None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.summary(),
+            "cprofile_skipped": self.cprofile_skipped,
+            "stages": self.stages,
+            "top_functions": self.top_functions(),
+        }
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+def start_profile(method: str, path: str, requested: bool) -> contextvars.Token:
+    """为当前请求开启剖析，返回用于 `stop_profile` 的 token"""
+    return _current_profile.set(RequestProfile(method, path, requested))
+
+
+def stop_profile(token: contextvars.Token):
+    _current_profile.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """标记一个阶段；当前请求未开启剖析时不做任何事"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        profile.add_stage(name, start, time.perf_counter(), error=type(e).__name__)
+        raise
+    profile.add_stage(name, start, time.perf_counter())
+
+
+def profiled(fn: Callable, *args, **kwargs):
+    """
+    在当前线程中执行 fn；当前请求开启剖析时同时运行 cProfile
+    用于包装交给 `asyncio.to_thread` 的同步函数，使 cProfile 运行在实际执行计算的工作线程上
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    if not _cprofile_lock.acquire(blocking=False):
+        profile.cprofile_skipped = "another request is being profiled"
+        with stage("handler"):
+            return fn(*args, **kwargs)
+    try:
+        profile.profiler = cProfile.Profile()
+        with stage("handler"):
+            return profile.profiler.runcall(fn, *args, **kwargs)
+    finally:
+        _cprofile_lock.release()
+
+
+class ProfileStore:
+    """
+    磁盘上的剖析结果：每个剖析保存为 <id>.json（时间线和统计文本）和 <id>.prof（pstats 二进制，可用 snakeviz 等工具查看）
+    只保留最慢的 keep 个抽样剖析
+    """
+
+    def __init__(self, directory: str, keep: int = 20):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        # 只允许 start_profile 生成的 id 形式，防止路径穿越
+        if not profile_id or not all(c.isalnum() or c == "-" for c in profile_id):
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """所有已保存剖析的摘要，按耗时降序"""
+        summaries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            summaries.append({key: data.get(key) for key in
+                              ("id", "method", "path", "requested", "started_at", "duration_ms",
+                               "status_code", "has_cprofile")})
+        return sorted(summaries, key=lambda item: item["duration_ms"] or 0.0, reverse=True)
+
+    def save(self, profile: RequestProfile) -> bool:
+        """
+        保存剖析结果
+
+        Returns:
+            是否被保存：抽样剖析只有进入最慢的 keep 个时才保存，显式请求的剖析总会保存
+        """
+        duration_ms = (profile.duration or 0.0) * 1000
+        with self._lock:
+            existing = self.list()
+            slowest_enough = len(existing) < self.keep or duration_ms > (existing[-1]["duration_ms"] or 0.0)
+            if not profile.requested and not slowest_enough:
+                return False
+            with open(self._path(profile.profile_id, ".json"), "w", encoding="utf-8") as f:
+                json.dump(profile.to_dict(), f, ensure_ascii=False, indent=2)
+            if profile.profiler is not None:
+                profile.profiler.dump_stats(self._path(profile.profile_id, ".prof"))
+            # 超出数量时删除最快的剖析（不删除刚保存的这一个）
+            existing = [item for item in existing if item["id"] != profile.profile_id]
+            for item in existing[max(self.keep - 1, 0):]:
+                self.delete(item["id"])
+        return True
+
+    def get(self, profile_id: str) -> Dict[str, Any]:
+        with open(self._path(profile_id, ".json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def prof_path(self, profile_id: str) -> Optional[str]:
+        path = self._path(profile_id, ".prof")
+        return path if os.path.exists(path) else None
+
+    def delete(self, profile_id: str):
+        for suffix in (".json", ".prof"):
+            try:
+                os.remove(self._path(profile_id, suffix))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingConfig:
+    """剖析配置，读取环境变量 PROFILE_DIR、PROFILE_KEEP、PROFILE_SAMPLE_RATE、PROFILE_ADMIN_TOKEN"""
+
+    def __init__(self, directory: str, keep: int = 20, sample_rate: float = 0.0,
+                 admin_token: Optional[str] = None):
+        self.store = ProfileStore(directory, keep)
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token or None
+
+    @classmethod
+    def from_env(cls) -> "ProfilingConfig":
+        default_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "profiles"))
+        return cls(
+            directory=os.getenv("PROFILE_DIR", default_dir),
+            keep=int(os.getenv("PROFILE_KEEP", "20")),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            admin_token=os.getenv("PROFILE_ADMIN_TOKEN"),
+        )
+
+    @property
+    def admin_enabled(self) -> bool:
+        """是否配置了管理令牌；未配置时管理端点和 X-Profile 请求头都不可用"""
+        return self.admin_token is not None
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        """请求携带的令牌是否与 PROFILE_ADMIN_TOKEN 一致；未配置令牌时总是 False"""
+        if not self.admin_enabled or not token:
+            return False
+        return hmac.compare_digest(token.encode("utf-8"), self.admin_token.encode("utf-8"))
+
+    def should_profile(self, header_value: Optional[str], admin_token: Optional[str] = None) -> Optional[bool]:
+        """
+        判断是否剖析当前请求
+
+        Args:
+            header_value: X-Profile 请求头
+            admin_token: X-Admin-Token 请求头，X-Profile 只在令牌有效时生效
+
+        Returns:
+            None 表示不剖析；True 表示请求头显式要求；False 表示抽样命中
+        """
+        requested = header_value and header_value.strip().lower() in ("1", "true", "yes", "on")
+        if requested and self.is_admin(admin_token):
+            return True
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return False
+        return None
@@ -0,0 +1,126 @@
+"""
+基于置信度的重排序门控
+向量检索的首个候选足够接近查询、且明显优于其余候选时直接采用，不再调用大模型重排序。
+分数为 `normalize_distance` 归一化后的相似度 [0, 1]（越大越相似），阈值可通过
+tools/calibrate_rerank_gate.py 在标注数据上校准，并通过环境变量 RERANK_GATE_CONFIG 指定的 JSON 文件加载。
+"""
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RerankGateConfig:
+    """门控阈值"""
+    min_top_score: float = 0.92  # 首个候选的最低相似度
+    min_margin: float = 0.03  # 首个候选相对第二个（不同术语）候选的最小分差
+    enabled: bool = True
+
+
+@dataclass
+class GateDecision:
+    """门控结果；accept 为 True 时直接采用首个候选"""
+    accept: bool
+    top_score: Optional[float]
+    margin: Optional[float]
+    reason: str
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+def top_score_and_margin(candidates: List[Dict]):
+    """
+    计算首个候选的分数及其相对下一个不同术语的分差
+
+    Args:
+        candidates: 按分数降序排列的候选，每项包含 term 和 score
+
+    Returns:
+        (首个候选分数, 分差)；只有一个候选时分差为首个候选分数，没有候选时均为 None
+    """
+    if not candidates:
+        return None, None
+    top = candidates[0]
+    top_term = (top.get("term") or "").strip().lower()
+    for candidate in candidates[1:]:
+        if (candidate.get("term") or "").strip().lower() != top_term:
+            return top["score"], top["score"] - candidate["score"]
+    return top["score"], top["score"]
+
+
+class RerankGate:
+    """根据首个候选的分数和分差决定是否跳过大模型重排序"""
+
+    def __init__(self, config: Optional[RerankGateConfig] = None):
+        self.config = config or RerankGateConfig()
+        self._lock = threading.Lock()  # 并发请求和批量接口的线程池会同时更新计数
+        self.accepted = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_file(cls, path: str) -> "RerankGate":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # 校准工具输出的文件中阈值位于 "config" 字段，也支持直接写阈值
+        data = data.get("config", data)
+        fields = RerankGateConfig.__dataclass_fields__
+        return cls(RerankGateConfig(**{k: v for k, v in data.items() if k in fields}))
+
+    @classmethod
+    def from_env(cls) -> "RerankGate":
+        """读取 RERANK_GATE_CONFIG 指定的配置文件，未设置或读取失败时使用默认阈值"""
+        path = os.getenv("RERANK_GATE_CONFIG")
+        if not path:
+            return cls()
+        try:
+            gate = cls.from_file(path)
+            logger.info(f"Loaded rerank gate config from {path}: {gate.config}")
+            return gate
+        except Exception as e:
+            logger.warning(f"Failed to load rerank gate config {path}, using defaults: {str(e)}")
+            return cls()
+
+    def decide(self, candidates: List[Dict]) -> GateDecision:
+        """
+        判断是否直接采用首个候选
+
+        Args:
+            candidates: 按分数降序排列的候选，每项包含 term 和归一化后的 score
+        """
+        decision = self._decide(candidates)
+        with self._lock:
+            if decision.accept:
+                self.accepted += 1
+            else:
+                self.rejected += 1
+        return decision
+
+    def _decide(self, candidates: List[Dict]) -> GateDecision:
+        top_score, margin = top_score_and_margin(candidates)
+        if not self.config.enabled:
+            return GateDecision(False, top_score, margin, "gate disabled")
+        if top_score is None:
+            return GateDecision(False, None, None, "no candidates")
+        if top_score < self.config.min_top_score:
+            return GateDecision(False, top_score, margin, f"top score below {self.config.min_top_score}")
+        if margin < self.config.min_margin:
+            return GateDecision(False, top_score, margin, f"margin below {self.config.min_margin}")
+        return GateDecision(True, top_score, margin, "confident top candidate")
+
+    def stats(self) -> Dict:
+        """直接采用首个候选 (gate) 与调用 LLM 重排序 (llm) 的次数"""
+        with self._lock:
+            accepted, rejected = self.accepted, self.rejected
+        total = accepted + rejected
+        return {
+            "gate": accepted,
+            "llm": rejected,
+            "gate_ratio": accepted / total if total else 0.0,
+            "config": asdict(self.config),
+        }
@@ -0,0 +1,101 @@
+"""
+进行中请求合并 (single-flight)
+并发到达的相同请求（方法、文本、上下文和选项都相同）只执行一次计算，所有调用方等待并共享同一结果，
+突发流量下避免重复的向量化、向量检索和大模型调用。
+"""
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+def make_key(*parts: Any) -> str:
+    """由请求的各组成部分生成合并键，字典按键排序，保证相同内容得到相同的键"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    按键合并进行中的异步调用
+
+    同一个键在计算完成前的后续调用不会再次执行，而是等待首个调用的结果（包括异常）；
+    计算完成后键即被移除，之后的调用重新执行。计算在独立的 Task 中运行，
+    某个调用方取消（如客户端断开）不会影响其他等待同一结果的调用方。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_waiters = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行或加入键为 key 的计算
+
+        Args:
+            key: 合并键，通常由 `make_key` 生成
+            fn: 返回协程的函数，只有在没有进行中的同键计算时才会被调用
+
+        Returns:
+            计算结果，同一批合并的调用方拿到的是同一个对象
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 1
+            self.executed += 1
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+            self._waiters[key] += 1
+            self.max_waiters = max(self.max_waiters, self._waiters[key])
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        # 读取异常，避免所有调用方都已取消时出现 "exception was never retrieved" 警告
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        """合并统计：总调用数、实际执行数、被合并的调用数及比例、出错次数和当前进行中的键数"""
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / self.calls if self.calls else 0.0,
+            "errors": self.errors,
+            "inflight": len(self._inflight),
+            "max_waiters": self.max_waiters,
+        }
+
+
+_registry: Dict[str, SingleFlight] = {}
+_registry_lock = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """按名称获取（不存在时创建）共享的 SingleFlight 实例"""
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = SingleFlight(name)
+        return _registry[name]
+
+
+def single_flight_metrics() -> Dict[str, Dict[str, Any]]:
+    """所有 SingleFlight 实例的合并统计"""
+    with _registry_lock:
+        return {name: flight.metrics() for name, flight in _registry.items()}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 根目录下的脚本（custom_data_processor.py、evaluate_text2sql.py）不是包，测试时直接导入
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,43 @@
+import json
+
+from custom_data_processor import ChunkDeduplicator, Document, deduplicate_chunks
+
+BASE = "本公司董事会及全体董事保证本报告内容不存在任何虚假记载、误导性陈述或者重大遗漏，并对其内容的真实性、准确性和完整性承担个别及连带责任。"
+
+
+def _doc(text, source="a.pdf", page=1):
+    return Document(page_content=text, metadata={"source": source, "page_number": page})
+
+
+def test_exact_duplicates_ignore_case_and_whitespace():
+    kept, report = deduplicate_chunks([_doc("Net  income rose"), _doc("net income rose", "b.pdf")],
+                                      near_duplicates=False)
+    assert [doc.page_content for doc in kept] == ["Net  income rose"]
+    assert report.exact_duplicates == 1
+    assert kept[0].metadata["duplicate_count"] == 1
+    assert kept[0].metadata["duplicates"][0]["source"] == "b.pdf"
+
+
+def test_near_duplicates_are_merged_and_distinct_chunks_kept():
+    near = BASE.replace("个别及连带责任", "个别和连带责任")
+    other = "2023年公司实现营业收入128亿元，同比增长12.5%，归属于上市公司股东的净利润为15亿元。"
+    kept, report = deduplicate_chunks([_doc(BASE), _doc(near, "b.pdf"), _doc(other)], threshold=0.8)
+    assert [doc.page_content for doc in kept] == [BASE, other]
+    assert report.near_duplicates == 1
+    assert report.kept_chunks == 2
+    assert kept[0].metadata["duplicates"][0]["kind"] == "near"
+
+
+def test_streaming_mode_does_not_hold_documents(tmp_path):
+    provenance = tmp_path / "provenance.jsonl"
+    deduplicator = ChunkDeduplicator(provenance_path=str(provenance))
+    first, duplicate = _doc(BASE), _doc(BASE, "b.pdf", 3)
+    assert list(deduplicator.filter([first, duplicate])) == [first]
+
+    assert deduplicator._kept_docs is None
+    assert "duplicates" not in first.metadata
+    records = [json.loads(line) for line in provenance.read_text(encoding="utf-8").splitlines()]
+    assert records == [{
+        "kept_chunk_hash": first.metadata["chunk_hash"], "kind": "exact", "similarity": 1.0,
+        "source": "b.pdf", "page_number": 3, "start_index": None,
+    }]
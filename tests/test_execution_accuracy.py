@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("nltk")
+pytest.importorskip("tqdm")
+try:
+    # 导入时需要加载 Sakila 目录下的 text2sql 模块，找不到时脚本直接退出
+    import evaluate_text2sql
+except SystemExit:
+    pytest.skip("text2sql module for evaluate_text2sql.py is not available", allow_module_level=True)
+
+from evaluate_text2sql import execute_sql, result_set_hash
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "sakila.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE actor (actor_id INTEGER, first_name TEXT, rating REAL)")
+    conn.executemany("INSERT INTO actor VALUES (?, ?, ?)", [(1, "PENELOPE", 2.0), (2, "NICK", 3.5), (3, "ED", 1.25)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_hash_ignores_row_order():
+    assert result_set_hash([(1, "a"), (2, "b")]) == result_set_hash([(2, "b"), (1, "a")])
+
+
+def test_hash_normalizes_numbers():
+    assert result_set_hash([(1, 2.0)]) == result_set_hash([(1.0, 2)])
+    assert result_set_hash([(0.1 + 0.2,)]) == result_set_hash([(0.3,)])
+
+
+def test_hash_distinguishes_values_and_column_order():
+    assert result_set_hash([(1, "a")]) != result_set_hash([(1, "b")])
+    assert result_set_hash([(1, "a")]) != result_set_hash([("a", 1)])
+    assert result_set_hash([(1,), (1,)]) != result_set_hash([(1,)])
+
+
+def test_equivalent_queries_hash_equal(db_path):
+    first = execute_sql(db_path, "SELECT actor_id, first_name FROM actor ORDER BY actor_id")
+    second = execute_sql(db_path, "SELECT actor_id, first_name FROM actor ORDER BY first_name DESC")
+    assert first["status"] == second["status"] == "ok"
+    assert first["rows"] == 3
+    assert first["hash"] == second["hash"]
+
+
+def test_invalid_and_empty_sql_are_errors(db_path):
+    result = execute_sql(db_path, "SELECT missing FROM actor")
+    assert result["status"] == "error" and result["hash"] is None and "missing" in result["error"]
+    assert execute_sql(db_path, "   ")["status"] == "error"
+
+
+def test_database_is_read_only(db_path):
+    assert execute_sql(db_path, "DELETE FROM actor")["status"] == "error"
+    assert execute_sql(db_path, "SELECT COUNT(*) FROM actor")["hash"] == result_set_hash([(3,)])
+
+
+def test_slow_query_times_out(db_path):
+    sql = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+           "SELECT COUNT(*) FROM n")
+    result = execute_sql(db_path, sql, timeout=0.2)
+    assert result["status"] == "timeout"
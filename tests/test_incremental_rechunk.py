@@ -0,0 +1,78 @@
+import custom_data_processor as cdp
+from custom_data_processor import Document, incremental_rechunk, save_manifest
+
+CHUNK_KWARGS = {"strategy": "recursive", "chunk_size": 200, "chunk_overlap": 0}
+
+
+def _parse_as(monkeypatch, texts):
+    docs = [Document(page_content=text, metadata={"source": "report.pdf", "element_hash": cdp.compute_element_hash(text)})
+            for text in texts]
+    monkeypatch.setattr(cdp, "load_and_parse_file", lambda file_path, **kwargs: [doc.copy(deep=True) for doc in docs])
+
+
+def _run(tmp_path, chunk_kwargs=CHUNK_KWARGS):
+    changeset = incremental_rechunk(str(tmp_path / "report.pdf"), str(tmp_path / "manifests"), chunk_kwargs=chunk_kwargs)
+    save_manifest(changeset)
+    return changeset
+
+
+def _ids(changeset):
+    return [chunk.metadata["chunk_id"] for chunk in changeset.added]
+
+
+def test_first_run_chunks_everything(tmp_path, monkeypatch):
+    _parse_as(monkeypatch, ["营业收入 100 亿元", "净利润 20 亿元", "每股收益 1.2 元"])
+    changeset = _run(tmp_path)
+    assert changeset.full_rebuild
+    assert len(changeset.added) == 3
+    assert changeset.removed_ids == []
+
+
+def test_unchanged_document_is_empty(tmp_path, monkeypatch):
+    _parse_as(monkeypatch, ["营业收入 100 亿元", "净利润 20 亿元"])
+    _run(tmp_path)
+    changeset = _run(tmp_path)
+    assert changeset.is_empty
+    assert changeset.unchanged_chunks == 2
+
+
+def test_whitespace_change_is_not_a_change(tmp_path, monkeypatch):
+    _parse_as(monkeypatch, ["营业收入 100 亿元", "净利润 20 亿元"])
+    _run(tmp_path)
+    _parse_as(monkeypatch, ["营业收入  100\n亿元", "净利润 20 亿元"])
+    assert _run(tmp_path).is_empty
+
+
+def test_only_edited_element_is_rechunked(tmp_path, monkeypatch):
+    _parse_as(monkeypatch, ["营业收入 100 亿元", "净利润 20 亿元", "每股收益 1.2 元"])
+    first = _run(tmp_path)
+    _parse_as(monkeypatch, ["营业收入 100 亿元", "净利润 25 亿元", "每股收益 1.2 元", "分红 0.5 元"])
+    changeset = _run(tmp_path)
+    assert not changeset.full_rebuild
+    assert [chunk.page_content for chunk in changeset.added] == ["净利润 25 亿元", "分红 0.5 元"]
+    assert changeset.removed_ids == [_ids(first)[1]]
+    assert changeset.unchanged_chunks == 2
+
+
+def test_repeated_elements_get_distinct_ids(tmp_path, monkeypatch):
+    _parse_as(monkeypatch, ["页眉", "正文一", "页眉", "正文二"])
+    changeset = _run(tmp_path)
+    assert len(set(_ids(changeset))) == 4
+    kept = set(_ids(changeset))
+    # 新插入的页眉不能与沿用的页眉 chunk_id 冲突
+    _parse_as(monkeypatch, ["页眉", "正文一", "页眉", "正文二", "页眉"])
+    changeset = _run(tmp_path)
+    assert changeset.removed_ids == []
+    assert len(changeset.added) == 1
+    assert _ids(changeset)[0] not in kept
+    assert changeset.unchanged_chunks == 4
+
+
+def test_chunking_change_forces_full_rebuild(tmp_path, monkeypatch):
+    _parse_as(monkeypatch, ["营业收入 100 亿元", "净利润 20 亿元"])
+    first = _run(tmp_path)
+    changeset = _run(tmp_path, {**CHUNK_KWARGS, "chunk_size": 300})
+    assert changeset.full_rebuild
+    assert sorted(changeset.removed_ids) == sorted(_ids(first))
+    assert len(changeset.added) == 2
+    assert not set(_ids(changeset)) & set(_ids(first))
@@ -0,0 +1,20 @@
+from custom_data_processor import Document, MilvusChunkWriter, chunk_row_id
+
+
+def test_row_id_is_stable_and_prefers_chunk_id():
+    doc = Document(page_content="营业收入", metadata={"source": "a.pdf", "page_number": 2, "start_index": 10})
+    same = Document(page_content="营业收入", metadata={"source": "a.pdf", "page_number": 2, "start_index": 10})
+    moved = Document(page_content="营业收入", metadata={"source": "a.pdf", "page_number": 2, "start_index": 90})
+    assert chunk_row_id(doc) == chunk_row_id(same)
+    assert chunk_row_id(doc) != chunk_row_id(moved)
+
+    doc.metadata["chunk_id"] = "abc"
+    assert chunk_row_id(doc) == "abc"
+
+
+def test_build_rows_uses_row_id_as_primary_key():
+    docs = [Document(page_content="text", metadata={"source": "a.pdf", "page_number": None})]
+    rows = MilvusChunkWriter.build_rows(docs, [[0.1, 0.2]])
+    assert rows[0]["chunk_id"] == chunk_row_id(docs[0])
+    assert rows[0]["page_number"] == 0
+    assert rows[0]["vector"] == [0.1, 0.2]
@@ -0,0 +1,82 @@
+import multiprocessing
+
+from unstructured.documents.elements import Text
+
+import custom_data_processor as cdp
+from custom_data_processor import ParseCache, iter_parse_file
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def _hash_files(cache_dir, paths):
+    cache = ParseCache(cache_dir)
+    for path in paths:
+        cache.file_hash(path)
+
+
+def test_key_changes_with_content_version_and_kwargs(tmp_path, monkeypatch):
+    cache = ParseCache(str(tmp_path / "cache"))
+    path = _write(tmp_path / "a.txt", "营业收入")
+    key = cache.key(path, {"strategy": "fast"})
+    assert cache.key(path, {"strategy": "fast"}) == key
+    assert cache.key(path, {"strategy": "hi_res"}) != key
+
+    monkeypatch.setattr(cdp, "UNSTRUCTURED_VERSION", "0.0.0-test")
+    assert cache.key(path, {"strategy": "fast"}) != key
+    monkeypatch.undo()
+
+    _write(tmp_path / "a.txt", "净利润 20 亿元")
+    assert cache.key(path, {"strategy": "fast"}) != key
+
+
+def test_file_hashes_persist_across_instances(tmp_path):
+    path = _write(tmp_path / "a.txt", "营业收入")
+    file_hash = ParseCache(str(tmp_path / "cache")).file_hash(path)
+    reopened = ParseCache(str(tmp_path / "cache"))
+    assert reopened._hash_index[str(tmp_path / "a.txt")][2] == file_hash
+
+
+def test_concurrent_processes_do_not_lose_hashes(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    groups = [[_write(tmp_path / f"{worker}_{i}.txt", f"{worker}-{i}") for i in range(20)] for worker in range(4)]
+    processes = [multiprocessing.Process(target=_hash_files, args=(cache_dir, paths)) for paths in groups]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert len(ParseCache(cache_dir)._hash_index) == 80
+
+
+def test_truncated_hash_record_is_ignored(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    path = _write(tmp_path / "a.txt", "营业收入")
+    ParseCache(cache_dir).file_hash(path)
+    with open(tmp_path / "cache" / "file_hashes.jsonl", "a", encoding="utf-8") as f:
+        f.write('["/x", 1')
+    assert list(ParseCache(cache_dir)._hash_index) == [str(tmp_path / "a.txt")]
+
+
+def test_parse_served_from_cache_until_kwargs_change(tmp_path, monkeypatch):
+    calls = []
+
+    def partition(filename, **kwargs):
+        calls.append(kwargs)
+        return [Text("营业收入 100 亿元"), Text("净利润 20 亿元")]
+
+    monkeypatch.setattr(cdp, "partition", partition)
+    path = _write(tmp_path / "a.txt", "营业收入 100 亿元\n净利润 20 亿元")
+    cache_dir = str(tmp_path / "cache")
+
+    first = list(iter_parse_file(path, cache_dir=cache_dir, strategy="fast"))
+    second = list(iter_parse_file(path, cache_dir=cache_dir, strategy="fast"))
+    assert len(calls) == 1
+    assert [doc.page_content for doc in second] == [doc.page_content for doc in first]
+
+    list(iter_parse_file(path, cache_dir=cache_dir, strategy="hi_res"))
+    assert len(calls) == 2
+    monkeypatch.setattr(cdp, "UNSTRUCTURED_VERSION", "0.0.0-test")
+    list(iter_parse_file(path, cache_dir=cache_dir, strategy="fast"))
+    assert len(calls) == 3
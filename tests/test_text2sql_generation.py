@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("nltk")
+pytest.importorskip("tqdm")
+try:
+    # 导入时需要加载 Sakila 目录下的 text2sql 模块，找不到时脚本直接退出
+    import evaluate_text2sql
+except SystemExit:
+    pytest.skip("text2sql module for evaluate_text2sql.py is not available", allow_module_level=True)
+
+QUESTIONS = [{"question": "How many actors?", "sql": "select count(*) from actor"},
+             {"question": "List films", "sql": "select title from film"}]
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    calls = []
+
+    def text2sql(question, execute=False):
+        calls.append(question)
+        return "SELECT 1"
+
+    monkeypatch.setattr(evaluate_text2sql, "text2sql", text2sql)
+    return calls
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    data_dir = tmp_path / "90-文档-Data" / "sakila"
+    data_dir.mkdir(parents=True)
+    (data_dir / "q2sql_pairs.json").write_text(json.dumps(QUESTIONS), encoding="utf-8")
+    monkeypatch.setattr(evaluate_text2sql, "project_root", str(tmp_path))
+    return tmp_path
+
+
+def _read_checkpoint(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def _evaluate(project, **kwargs):
+    evaluate_text2sql.evaluate_text2sql(
+        workers=2, checkpoint_path=str(project / "checkpoint.jsonl"), sakila_db_path=None,
+        generation_cache_path=str(project / "cache.db"), **kwargs)
+
+
+def test_resume_and_cache_skip_generation(project, generator):
+    _evaluate(project)
+    assert len(generator) == 2
+    _evaluate(project)
+    assert len(generator) == 2
+
+
+def test_invalidate_cache_regenerates_despite_checkpoint(project, generator):
+    _evaluate(project)
+    _evaluate(project, invalidate_cache=True)
+    assert len(generator) == 4
+
+
+def test_checkpoint_written_when_served_from_cache(tmp_path, generator):
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    cache = evaluate_text2sql.GenerationCache(str(tmp_path / "cache.db"), "key")
+    evaluate_text2sql.generate_sqls(QUESTIONS, workers=1, checkpoint_path=checkpoint, cache=cache, config_key="key")
+    os.remove(checkpoint)
+    records = evaluate_text2sql.generate_sqls(QUESTIONS, workers=1, checkpoint_path=checkpoint, cache=cache,
+                                              config_key="key")
+    cache.close()
+    assert len(generator) == 2
+    assert all(record["cached"] for record in records)
+    assert sorted(record["index"] for record in _read_checkpoint(checkpoint)) == [0, 1]